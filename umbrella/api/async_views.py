@@ -0,0 +1,139 @@
+"""
+Async versions of the read-heavy API endpoints, used under ASGI.
+
+DRF 3.13 views are synchronous, so under ASGI each request holds a thread of
+the sync executor while it waits for the database. The views here serve GET
+requests as coroutines with the async ORM and delegate everything else to
+their DRF view (write_view): writes, and reads that ask for the browsable API.
+
+api.urls picks them when settings.ASYNC_API_VIEWS is on, which umbrella.asgi
+does by default. Responses are the same JSON as the DRF views return.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from rest_framework import exceptions, permissions, status
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from posts import caching, detail
+from posts.models import Group, Post
+from posts.serializers import CommentSerializer, GroupSerializer, PostSerializer
+from .pagination import KeysetPagination
+from .views import CommentView, GroupView, PostView, filter_posts, get_fields
+
+
+class AsyncReadView(View):
+    """
+    Authentication, permissions and errors of a DRF view around an async read().
+
+    Subclasses define read(request, **kwargs), which receives the DRF Request
+    and returns the response data; conditional_scopes are the posts.caching scopes of its validators.
+    """
+    write_view = None
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    conditional_scopes = None
+    delegate = None
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(delegate=cls.write_view.as_view(), **initkwargs)
+        # Like DRF views: the JWT authentication is not affected by CSRF
+        view.csrf_exempt = True
+        return view
+
+    async def get(self, request, *args, **kwargs):
+        request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        try:
+            renderers = [renderer() for renderer in self.write_view.renderer_classes]
+            renderer, _ = DefaultContentNegotiation().select_renderer(request, renderers)
+            if renderer.format != 'json':
+                return await self.delegate_request(request._request, *args, **kwargs)
+            await sync_to_async(self.check_permissions)(request)
+            respond = self.respond
+            if self.conditional_scopes is not None:
+                respond = caching.conditional(self.conditional_scopes, per_user=False)(respond)
+            return await respond(request, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(request, exc)
+
+    async def respond(self, request, **kwargs):
+        return self.render(await self.read(request, **kwargs))
+
+    async def delegate_request(self, request, *args, **kwargs):
+        return await sync_to_async(self.delegate)(request, *args, **kwargs)
+
+    post = put = patch = delete = options = delegate_request
+
+    def check_permissions(self, request):
+        # As in DRF, every request is authenticated, so an invalid token is rejected even on public reads
+        request.user
+        for permission in [permission() for permission in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied()
+
+    def handle_exception(self, request, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            authenticators = request.authenticators
+            if authenticators:
+                exc.auth_header = authenticators[0].authenticate_header(request)
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+        response = exception_handler(exc, {'view': self, 'request': request})
+        if response is None:
+            raise exc
+        rendered = self.render(response.data, response.status_code)
+        for name, value in response.items():
+            # e.g. WWW-Authenticate; the response is not rendered, so its Content-Type is a default
+            if name.lower() != 'content-type':
+                rendered[name] = value
+        return rendered
+
+    @staticmethod
+    def render(data, status_code=status.HTTP_200_OK):
+        return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+class AsyncPostView(AsyncReadView):
+    write_view = PostView
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    conditional_scopes = staticmethod(caching.index_scopes)
+
+    async def read(self, request):
+        posts = filter_posts(Post.objects.select_related('author'), request.query_params)
+        fields = get_fields(request.query_params, PostSerializer)
+        pagination = KeysetPagination()
+        page = await pagination.apaginate_queryset(posts, request)
+        serializer = PostSerializer(instance=page, many=True, fields=fields)
+        return pagination.get_paginated_response(serializer.data).data
+
+
+class AsyncCommentView(AsyncReadView):
+    write_view = CommentView
+    conditional_scopes = staticmethod(caching.post_resource_scopes)
+
+    async def read(self, request, post_id):
+        try:
+            post = await Post.objects.aget(pk=post_id)
+        except Post.DoesNotExist:
+            raise exceptions.NotFound()
+        # Comments read through the post know it already, only their authors are joined
+        pagination = KeysetPagination(ordering=detail.COMMENT_ORDERING)
+        page = await pagination.apaginate_queryset(post.comments.select_related('author'), request)
+        serializer = CommentSerializer(instance=page, many=True)
+        return pagination.get_paginated_response(serializer.data).data
+
+
+class AsyncGroupView(AsyncReadView):
+    write_view = GroupView
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    async def read(self, request):
+        groups = [group async for group in Group.objects.all()]
+        return GroupSerializer(instance=groups, many=True).data
@@ -0,0 +1,84 @@
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from posts import search
+from posts.paginator import CursorPaginator
+
+
+class KeysetPagination:
+    """ Cursor pagination of API lists on top of posts.paginator.CursorPaginator. """
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def __init__(self, ordering=('-pub_date', '-id')):
+        self.ordering = ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request):
+        paginator = CursorPaginator(queryset, self.get_page_size(request), ordering=self.ordering)
+        self.page = paginator.get_page(request.query_params.get(self.cursor_query_param))
+        self.request = request
+        return self.page.object_list
+
+    async def apaginate_queryset(self, queryset, request):
+        paginator = CursorPaginator(queryset, self.get_page_size(request), ordering=self.ordering)
+        self.page = await paginator.aget_page(request.query_params.get(self.cursor_query_param))
+        self.request = request
+        return self.page.object_list
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
+
+
+class SearchPagination:
+    """ Pages of ranked search results; there is no key to continue from, so pages are read by offset. """
+    page_size = 20
+    max_page_size = 100
+    offset_query_param = 'offset'
+    page_size_query_param = 'limit'
+    get_page_size = KeysetPagination.get_page_size
+
+    def get_offset(self, request):
+        try:
+            offset = int(request.query_params[self.offset_query_param])
+        except (KeyError, ValueError):
+            return 0
+        return min(max(offset, 0), search.MAX_RESULTS)
+
+    def paginate_search(self, query, posts, request):
+        self.limit = self.get_page_size(request)
+        self.offset = self.get_offset(request)
+        self.request = request
+        # One post more than the page tells whether there is a next page without counting the matches
+        found = search.find(query, self.offset, self.limit + 1, posts)
+        self.has_next = len(found) > self.limit
+        return found[:self.limit]
+
+    def get_link(self, offset):
+        if offset is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.offset_query_param, offset)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.offset + self.limit if self.has_next else None),
+            'previous': self.get_link(max(self.offset - self.limit, 0) if self.offset else None),
+            'results': data,
+        })
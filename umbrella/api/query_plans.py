@@ -0,0 +1,38 @@
+from django.utils import timezone
+
+from posts.models import Post
+from posts.paginator import CursorPaginator
+from posts.query_plans import hot_query, pages
+from .views import ExportView, filter_posts
+
+
+def _list_pages(params):
+    posts = filter_posts(Post.objects.select_related('author'), params)
+    return pages(CursorPaginator(posts, 20), pub_date=timezone.now(), id=1)
+
+
+@hot_query('api: posts', ordered_scan=True)
+def api_posts():
+    return _list_pages({})
+
+
+@hot_query('api: posts of a group')
+def api_group_posts():
+    return _list_pages({'group': '1'})
+
+
+@hot_query('api: posts of an author')
+def api_author_posts():
+    return _list_pages({'author': 'admin'})
+
+
+@hot_query('api: full export', ordered_scan=True)
+def api_export():
+    return [ExportView.get_posts({})]
+
+
+@hot_query('api: export since')
+def api_export_since():
+    # The prefetch of ?comments=1 reads the comments of every chunk of posts
+    return [ExportView.get_posts({'since': timezone.now().isoformat()}),
+            ExportView.get_comments().filter(post_id__in=[1, 2, 3])]
@@ -1,7 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.routers import SimpleRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import PostView, PostDetailView, CommentView, CommentDetailView, FollowViewSet, GroupView
+from .views import (PostView, PostDetailView, PostBulkView, CommentView, CommentDetailView, CommentBulkView,
+                    FollowViewSet, GroupView, SearchView, ExportView)
+
+if settings.ASYNC_API_VIEWS:
+    # GET requests of the read-heavy endpoints are served by coroutines, the rest by the DRF views
+    from .async_views import AsyncPostView as PostView, AsyncCommentView as CommentView, AsyncGroupView as GroupView
 
 router = SimpleRouter()
 router.register('follow', FollowViewSet)
@@ -11,12 +17,19 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     path('posts/', PostView.as_view()),
+    path('posts/bulk/', PostBulkView.as_view()),
     path('posts/<int:post_id>/', PostDetailView.as_view()),
 
     path('posts/<int:post_id>/comments/', CommentView.as_view()),
+    path('posts/<int:post_id>/comments/bulk/', CommentBulkView.as_view()),
     path('posts/<int:post_id>/comments/<int:comment_id>/', CommentDetailView.as_view()),
 
     path('group/', GroupView.as_view()),
+
+    path('search/', SearchView.as_view()),
+
+    # Newline-delimited JSON stream of all posts for mirrors and analytics
+    path('export/', ExportView.as_view()),
 ]
 
 urlpatterns += router.urls
@@ -1,4 +1,14 @@
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 from rest_framework.generics import ListCreateAPIView
 from rest_framework.response import Response
@@ -7,22 +17,67 @@ from rest_framework.views import APIView
 from rest_framework import permissions
 from rest_framework.viewsets import ViewSetMixin
 
+from posts import bulk, caching, detail
 from posts.models import Post, Comment, Group, Follow
+from posts.paginator import CursorEncoder, CursorPaginator
 from posts.serializers import PostSerializer, CommentSerializer, FollowSerializer, GroupSerializer
+from .pagination import KeysetPagination, SearchPagination
+
+
+def filter_posts(posts, params, since_field='pub_date'):
+    """ Apply the ?group=, ?author= and ?since= filters of the posts list. """
+    group = params.get('group')
+    if group is not None:  # filter queryset by the group parameter, if specified
+        # isdigit() also accepts digits like '²' that int() rejects; ids are 64-bit integers
+        if not (group.isascii() and group.isdecimal()) or int(group) >= 2 ** 63:
+            raise ValidationError({'group': 'Expected the id of a group.'})
+        posts = posts.filter(group=group)
+    author = params.get('author')
+    if author is not None:
+        posts = posts.filter(author__username=author)
+    since = params.get('since')
+    if since is not None:  # only posts published after the given moment
+        try:
+            since_date = parse_datetime(since)
+        except ValueError:
+            since_date = None
+        if since_date is None:
+            raise ValidationError({'since': 'Expected a date and time in ISO 8601 format.'})
+        if timezone.is_naive(since_date):
+            since_date = timezone.make_aware(since_date)
+        posts = posts.filter(**{f'{since_field}__gt': since_date})
+    return posts
+
+
+def get_fields(params, serializer_class):
+    """ Fields requested with ?fields=id,text or None for all of them. """
+    fields = params.get('fields')
+    if not fields:
+        return None
+    fields = fields.split(',')
+    unknown = set(fields) - set(serializer_class.Meta.fields)
+    if unknown:
+        raise ValidationError({'fields': f'Unknown fields: {", ".join(sorted(unknown))}.'})
+    return fields
+
 
+# Validators of conditional GETs, derived from the cache versions of posts.caching
+post_list_conditional = method_decorator(caching.conditional(caching.index_scopes, per_user=False), name='get')
+post_conditional = method_decorator(caching.conditional(caching.post_resource_scopes, per_user=False), name='get')
 
+
+@post_list_conditional
 class PostView(APIView):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
     def get(self, request):
-        group = request.query_params.get('group')
-        if group is not None:  # filter queryset by the group parameter, if specified
-            posts = Post.objects.filter(group=group)
-            serializer = PostSerializer(instance=posts, many=True)
-            return Response(data=serializer.data, status=status.HTTP_200_OK)
-        posts = Post.objects.all()
-        serializer = PostSerializer(instance=posts, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        """ Page of posts, newest first. Supports ?group=, ?author=, ?since=, ?fields=, ?limit= and ?cursor=. """
+        posts = filter_posts(Post.objects.select_related('author'), request.query_params)
+        fields = get_fields(request.query_params, PostSerializer)
+        pagination = KeysetPagination()
+        page = pagination.paginate_queryset(posts, request)
+        serializer = PostSerializer(instance=page, many=True, fields=fields)
+        return pagination.get_paginated_response(serializer.data)
 
     def post(self, request):
         serializer = PostSerializer(data=request.data)
@@ -32,10 +87,93 @@ class PostView(APIView):
         return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SearchView(APIView):
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get(self, request):
+        """ Posts matching ?q= in their text or comments, most relevant first. Supports ?fields=, ?limit= and ?offset=. """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'Expected the words to search for.'})
+        fields = get_fields(request.query_params, PostSerializer)
+        pagination = SearchPagination()
+        page = pagination.paginate_search(query, Post.objects.select_related('author'), request)
+        serializer = PostSerializer(instance=page, many=True, fields=fields)
+        return pagination.get_paginated_response(serializer.data)
+
+
+class ExportView(APIView):
+    """
+    Stream posts as newline-delimited JSON, oldest change first.
+
+    Every line carries the `cursor` of its (updated, id) key: a mirror passes the
+    cursor of the last line it has received as ?cursor= to export only the posts
+    changed after it. Posts of one bulk update share their `updated`, so the id
+    tells which of them were already sent. ?since= exports the posts changed after
+    a moment. ?comments=1 adds the comments of each post; a new, edited or deleted
+    comment changes the `updated` of its post. Posts are read in chunks, so a full
+    export runs in constant memory regardless of the number of posts.
+    """
+    chunk_size = 500
+    ordering = ('updated', 'id')
+
+    @classmethod
+    def get_posts(cls, params):
+        posts = filter_posts(Post.objects.select_related('author'), params, since_field='updated')
+        cursor = params.get('cursor')
+        if cursor is not None:
+            posts = CursorPaginator(posts, 1, ordering=cls.ordering).rows_after(cursor)
+            if posts is None:
+                raise ValidationError({'cursor': 'Expected the cursor of an exported line.'})
+        return posts.order_by(*cls.ordering)
+
+    @staticmethod
+    def get_comments():
+        # Grouped by post, oldest first: the reverse order of the comment index, so nothing is sorted
+        return Comment.objects.select_related('author').order_by('-post', 'created', 'id')
+
+    def get(self, request):
+        try:
+            posts = self.get_posts(request.query_params)
+        except (DjangoValidationError, TypeError, ValueError, OverflowError):
+            # Key values of a forged cursor could not be converted to the field types
+            raise ValidationError({'cursor': 'Expected the cursor of an exported line.'})
+        with_comments = request.query_params.get('comments') in ('1', 'true')
+        if with_comments:
+            posts = posts.prefetch_related(Prefetch('comments', queryset=self.get_comments()))
+        lines = (self.dump(post, with_comments) for post in posts.iterator(chunk_size=self.chunk_size))
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+    @classmethod
+    def dump(cls, post, with_comments):
+        data = {
+            'id': post.id,
+            'author': post.author.username,
+            'group': post.group_id,
+            'text': post.text,
+            'image': post.image.name or None,
+            'pub_date': post.pub_date,
+            'updated': post.updated,
+            'comment_count': post.comment_count,
+        }
+        if with_comments:
+            data['comments'] = [
+                {'id': comment.id, 'author': comment.author.username, 'text': comment.text, 'created': comment.created}
+                for comment in post.comments.all()
+            ]
+        # The cursor of the last line is the watermark of the next export
+        data['cursor'] = CursorPaginator(None, 1, ordering=cls.ordering).encode_cursor(CursorPaginator.NEXT, post)
+        return json.dumps(data, cls=CursorEncoder, ensure_ascii=False) + '\n'
+
+
+@post_conditional
 class PostDetailView(APIView):
     def get(self, request, post_id):
-        post = get_object_or_404(Post, pk=post_id)  # get a post instance by its id, or throw a 404 error
-        serializer = PostSerializer(instance=post)
+        # The post joined with its author, the same loader as the post page uses
+        post_detail = detail.load(post_id, comments=False)
+        if post_detail is None:
+            raise Http404
+        serializer = PostSerializer(instance=post_detail.post)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
     def put(self, request, post_id):
@@ -66,12 +204,127 @@ class PostDetailView(APIView):
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
+class BulkView(APIView):
+    """
+    Create, update or delete a list of objects in one request and one transaction.
+
+    POST takes a list of objects, PATCH a list of partial objects with their ids,
+    DELETE a list of ids. Every item is validated on its own; the valid ones are
+    written with bulk queries, and the response lists the result of each item in
+    the order of the request: {"status": 201, "data": {...}} or {"status": 400, "errors": {...}}.
+
+    Subclasses set serializer_class and define get_queryset(), build(validated_data)
+    returning a new unsaved instance of one item, and bulk_create(instances) and
+    bulk_update(instances, fields) writing them through posts.bulk.
+    """
+    serializer_class = None
+    max_items = 1000
+
+    def get_items(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': 'Expected a list of items.'})
+        if len(items) > self.max_items:
+            raise ValidationError({'non_field_errors': f'No more than {self.max_items} items per request.'})
+        return items
+
+    @staticmethod
+    def is_id(value):
+        # bool is a subclass of int, but true and false are not ids
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def get_instances(self, ids):
+        """ Instances of the given ids, or 400/404/403 results for the ids that can't be changed. """
+        found = self.get_queryset().in_bulk([pk for pk in ids if self.is_id(pk)])
+        instances, results = {}, {}
+        for position, pk in enumerate(ids):
+            if not self.is_id(pk):
+                results[position] = {'status': status.HTTP_400_BAD_REQUEST, 'id': pk,
+                                     'errors': {'id': ['Expected the integer id of an object.']}}
+                continue
+            instance = found.get(pk)
+            if instance is None:
+                results[position] = {'status': status.HTTP_404_NOT_FOUND, 'id': pk}
+            elif instance.author_id != self.request.user.pk:  # only the author can change the object
+                results[position] = {'status': status.HTTP_403_FORBIDDEN, 'id': pk}
+            else:
+                instances[position] = instance
+        return instances, results
+
+    def post(self, request, **kwargs):
+        results, valid = {}, {}
+        for position, item in enumerate(self.get_items(request)):
+            serializer = self.serializer_class(data=item)
+            if serializer.is_valid():
+                valid[position] = self.build(serializer.validated_data)
+            else:
+                results[position] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+        if valid:
+            self.bulk_create(list(valid.values()))
+        for position, instance in valid.items():
+            results[position] = {'status': status.HTTP_201_CREATED, 'data': self.serializer_class(instance).data}
+        return Response([results[position] for position in sorted(results)], status=status.HTTP_200_OK)
+
+    def patch(self, request, **kwargs):
+        items = self.get_items(request)
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        instances, results = self.get_instances(ids)
+        fields = set()
+        for position, instance in list(instances.items()):
+            serializer = self.serializer_class(instance=instance, data=items[position], partial=True)
+            if not serializer.is_valid():
+                results[position] = {'status': status.HTTP_400_BAD_REQUEST, 'id': ids[position],
+                                     'errors': serializer.errors}
+                del instances[position]
+                continue
+            for field, value in serializer.validated_data.items():
+                setattr(instance, field, value)
+                fields.add(field)
+        if instances and fields:
+            self.bulk_update(list(instances.values()), sorted(fields))
+        for position, instance in instances.items():
+            results[position] = {'status': status.HTTP_200_OK, 'data': self.serializer_class(instance).data}
+        return Response([results[position] for position in sorted(results)], status=status.HTTP_200_OK)
+
+    def delete(self, request, **kwargs):
+        ids = self.get_items(request)
+        instances, results = self.get_instances(ids)
+        if instances:
+            with transaction.atomic():
+                # QuerySet.delete() sends the signals that update counters, feeds and caches
+                self.get_queryset().filter(pk__in=[instance.pk for instance in instances.values()]).delete()
+        for position, instance in instances.items():
+            results[position] = {'status': status.HTTP_204_NO_CONTENT, 'id': instance.pk}
+        return Response([results[position] for position in sorted(results)], status=status.HTTP_200_OK)
+
+
+class PostBulkView(BulkView):
+    serializer_class = PostSerializer
+
+    def get_queryset(self):
+        return Post.objects.select_related('author')
+
+    def build(self, validated_data):
+        return Post(author=self.request.user, **validated_data)
+
+    def bulk_create(self, instances):
+        bulk.create_posts(instances)
+
+    def bulk_update(self, instances, fields):
+        bulk.update_posts(instances, fields)
+
+
+@post_conditional
 class CommentView(APIView):
     def get(self, request, post_id):
+        """ Page of comments, newest first. Supports ?limit= and ?cursor=. """
         post = get_object_or_404(Post, pk=post_id)
-        comments = Comment.objects.filter(post=post)
-        serializer = CommentSerializer(instance=comments, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        # Comments read through the post know it already, only their authors are joined
+        comments = post.comments.select_related('author')
+        pagination = KeysetPagination(ordering=detail.COMMENT_ORDERING)
+        page = pagination.paginate_queryset(comments, request)
+        serializer = CommentSerializer(instance=page, many=True)
+        return pagination.get_paginated_response(serializer.data)
 
     def post(self, request, post_id):
         post = get_object_or_404(Post, pk=post_id)
@@ -82,10 +335,11 @@ class CommentView(APIView):
         return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@post_conditional
 class CommentDetailView(APIView):
     def get(self, request, post_id, comment_id):
         post = get_object_or_404(Post, pk=post_id)
-        comment = get_object_or_404(Comment, pk=comment_id, post=post)
+        comment = get_object_or_404(post.comments.select_related('author'), pk=comment_id)
         serializer = CommentSerializer(instance=comment)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
 
@@ -120,8 +374,28 @@ class CommentDetailView(APIView):
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
+class CommentBulkView(BulkView):
+    serializer_class = CommentSerializer
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.post_object = get_object_or_404(Post, pk=kwargs['post_id'])
+
+    def get_queryset(self):
+        return Comment.objects.filter(post=self.post_object).select_related('author', 'post')
+
+    def build(self, validated_data):
+        return Comment(author=self.request.user, post=self.post_object, **validated_data)
+
+    def bulk_create(self, instances):
+        bulk.create_comments(self.post_object, instances)
+
+    def bulk_update(self, instances, fields):
+        bulk.update_comments(instances, fields)
+
+
 class FollowViewSet(ViewSetMixin, ListCreateAPIView):
-    queryset = Follow.objects.all()
+    queryset = Follow.objects.select_related('user', 'author')
     serializer_class = FollowSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     filter_backends = [SearchFilter]
@@ -0,0 +1,16 @@
+"""
+HTTP benchmarks of the pages and the API.
+
+Every route of posts/urls.py and api/urls.py is requested against the data in
+the configured database (fill it with `manage.py seed_load` first) and the
+latency percentiles, throughput and SQL queries per request are reported.
+Results are written as JSON, so two runs can be compared:
+
+    python -m benchmarks --output before.json
+    ... change the code ...
+    python -m benchmarks --output after.json --compare before.json
+
+The application is driven in-process through its WSGI or ASGI callable
+(--transport wsgi/asgi, no network overhead) or over a local socket
+(--transport socket starts a threaded server, --url targets a running one).
+"""
@@ -0,0 +1,113 @@
+import argparse
+import datetime
+import os
+import platform
+import subprocess
+import sys
+
+import benchmarks
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=benchmarks.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=('wsgi', 'asgi', 'socket'), default='wsgi')
+    parser.add_argument('--url', help='Benchmark a running server over the socket instead of a local one.')
+    parser.add_argument('--api', choices=('sync', 'async'),
+                        help='Views of the read-heavy API endpoints (settings.ASYNC_API_VIEWS); '
+                             'async with --transport asgi by default, as umbrella.asgi serves them.')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per route.')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per route sent first.')
+    parser.add_argument('--user', help='Username to log in as; the user following the most authors by default.')
+    parser.add_argument('--password', default='password', help='Password of the user, for the token route.')
+    parser.add_argument('--anonymous', action='store_true', help='Send requests without credentials.')
+    parser.add_argument('--routes', help='Benchmark only the routes whose pattern contains this text.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with.')
+    parser.add_argument('--threshold', type=float, default=25,
+                        help='p95 growth, in percent, reported as a regression by --compare.')
+    return parser.parse_args(argv)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'umbrella.settings')
+    # The URLconf picks the API views when it is loaded, so the choice is made before django.setup()
+    if options.api:
+        os.environ['ASYNC_API_VIEWS'] = '1' if options.api == 'async' else '0'
+    elif options.transport == 'asgi':
+        os.environ.setdefault('ASYNC_API_VIEWS', '1')
+    import django
+    django.setup()
+
+    from django.conf import settings
+
+    from . import report, routes, runner, transports
+
+    sample = routes.get_sample(options.user, options.password, options.anonymous)
+    route_list = routes.get_routes(sample, options.routes)
+    counter = runner.QueryCounter()
+
+    def run(transport):
+        summaries = {}
+        for route in route_list:
+            result = runner.run_route(transport, route, sample.headers, options.requests, options.concurrency,
+                                      options.warmup, None if options.url else counter)
+            summary = summaries[report.route_key(route)] = report.summarize(result)
+            print(f'{route.method} {route.path}: p95 {summary["p95_ms"]} ms', file=sys.stderr)
+        transport.close()
+        return summaries
+
+    with counter:
+        if options.url:
+            summaries = run(transports.HttpTransport(options.url))
+        elif options.transport == 'socket':
+            from umbrella.wsgi import application
+            with transports.LocalServer(application) as server:
+                summaries = run(transports.HttpTransport(server.url))
+        elif options.transport == 'asgi':
+            from umbrella.asgi import application
+            summaries = run(transports.AsgiTransport(application))
+        else:
+            from umbrella.wsgi import application
+            summaries = run(transports.WsgiTransport(application))
+
+    print(report.format_table(summaries))
+    meta = {
+        'revision': git_revision(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'transport': 'url' if options.url else options.transport,
+        'api': None if options.url else ('async' if settings.ASYNC_API_VIEWS else 'sync'),
+        'requests': options.requests,
+        'concurrency': options.concurrency,
+        'user': None if options.anonymous else sample.username,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+    }
+    if options.output:
+        report.write(options.output, meta, summaries)
+
+    if options.compare:
+        baseline = report.load(options.compare)
+        for name in ('transport', 'concurrency'):
+            if baseline['meta'].get(name) != meta[name]:
+                print(f'Warning: the baseline was measured with {name} {baseline["meta"].get(name)}', file=sys.stderr)
+        lines, regressions = report.compare(baseline, summaries, options.threshold, options.routes)
+        print('\n'.join(lines))
+        if regressions:
+            print(f'{regressions} regressions', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
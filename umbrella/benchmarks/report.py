@@ -0,0 +1,116 @@
+"""
+Summaries of the route results, their JSON file and the comparison of two runs.
+"""
+import json
+import math
+
+
+def percentile(values, share):
+    """ Nearest-rank percentile of the values, share in 0..100. """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(result):
+    milliseconds = [latency * 1000 for latency in result.latencies]
+
+    def ms(share):
+        value = percentile(milliseconds, share)
+        return None if value is None else round(value, 2)
+
+    return {
+        'method': result.route.method,
+        'path': result.route.path,
+        'requests': len(milliseconds),
+        'failures': result.failures,
+        'statuses': {str(status): count for status, count in sorted(result.statuses.items())},
+        'p50_ms': ms(50),
+        'p95_ms': ms(95),
+        'p99_ms': ms(99),
+        'rps': round(len(milliseconds) / result.seconds, 1) if result.seconds else None,
+        'queries': None if result.queries is None else round(result.queries, 2),
+    }
+
+
+def route_key(route):
+    # Keyed by the URL pattern, not the path: sample ids differ between databases
+    return f'{route.method} {route.pattern}'
+
+
+def write(path, meta, summaries):
+    with open(path, 'w') as file:
+        json.dump({'meta': meta, 'routes': summaries}, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def format_table(summaries):
+    lines = [f'{"route":<60} {"p50":>8} {"p95":>8} {"p99":>8} {"rps":>8} {"queries":>8}  statuses']
+    for key, summary in summaries.items():
+        values = [summary[name] for name in ('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'queries')]
+        cells = ' '.join(f'{"-" if value is None else value:>8}' for value in values)
+        statuses = ', '.join(f'{status}×{count}' for status, count in summary['statuses'].items())
+        if summary['failures']:
+            statuses += f', failed×{summary["failures"]}'
+        lines.append(f'{key:<60} {cells}  {statuses}')
+    return '\n'.join(lines)
+
+
+def status_problems(old, summary):
+    """ Notes on the responses of a route that are errors or differ from the baseline ones. """
+    notes = []
+    errors = {status: count for status, count in summary['statuses'].items() if not 200 <= int(status) < 400}
+    if errors:
+        notes.append('errors ' + ', '.join(f'{status}×{count}' for status, count in errors.items()))
+    if summary['failures']:
+        notes.append(f'failed×{summary["failures"]}')
+    if old is not None and set(old['statuses']) != set(summary['statuses']):
+        notes.append(f'statuses {", ".join(old["statuses"])} -> {", ".join(summary["statuses"])}')
+    return notes
+
+
+def compare(baseline, summaries, threshold, only=None):
+    """
+    Lines describing the changes against a baseline run and the number of regressions.
+
+    A route regresses when it answers with an error, its response statuses
+    differ from the baseline ones, its p95 grows by more than threshold
+    percent, or it runs more queries per request than before. The timings of
+    a route with wrong responses are not compared: a fast error is no
+    improvement. `only` is the --routes filter of the run: baseline routes
+    outside of it are not reported as removed.
+    """
+    lines, regressions = [], 0
+    old_routes = {key: summary for key, summary in baseline['routes'].items() if not only or only in key}
+    for key, summary in summaries.items():
+        old = old_routes.get(key)
+        problems = status_problems(old, summary)
+        if problems:
+            lines.append(f'{key}: {"; ".join(problems)} REGRESSION')
+            regressions += 1
+            continue
+        if old is None:
+            lines.append(f'{key}: new route')
+            continue
+        notes = []
+        if old['p95_ms'] and summary['p95_ms'] is not None:
+            change = (summary['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+            notes.append(f'p95 {old["p95_ms"]} -> {summary["p95_ms"]} ms ({change:+.0f}%)')
+            if change > threshold:
+                notes[-1] += ' REGRESSION'
+                regressions += 1
+        if old['queries'] is not None and summary['queries'] is not None and summary['queries'] != old['queries']:
+            notes.append(f'queries {old["queries"]} -> {summary["queries"]}')
+            if summary['queries'] > old['queries']:
+                notes[-1] += ' REGRESSION'
+                regressions += 1
+        lines.append(f'{key}: {"; ".join(notes) or "unchanged"}')
+    for key in old_routes.keys() - summaries.keys():
+        lines.append(f'{key}: removed')
+    return lines, regressions
@@ -0,0 +1,120 @@
+"""
+Routes to benchmark and the data to request them with.
+
+Routes are read from the URLconfs, so a new view is benchmarked without
+listing it here. Only the exceptions are declared: routes that need a request
+body or a query string and routes that are not requested at all because they
+change data.
+"""
+import re
+from collections import namedtuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.test import Client
+from rest_framework_simplejwt.tokens import RefreshToken
+
+import api.urls
+import posts.urls
+from posts.models import Post, User, UserStats
+
+# URLconfs and their prefixes in umbrella/urls.py
+URLCONFS = (('/', posts.urls), ('/api/v1/', api.urls))
+
+# Routes that write on GET or have no GET handler: benchmarking them would change the dataset
+SKIP = {
+    '/<str:username>/follow/',
+    '/<str:username>/unfollow/',
+    '/api/v1/posts/bulk/',
+    '/api/v1/posts/<int:post_id>/comments/bulk/',
+    # Placeholder of the live streams, which are long-lived and served by posts.live
+    '/live/<path:feed>',
+}
+
+# Routes requested with POST: pattern -> function(sample) returning the JSON body
+POST = {
+    '/api/v1/token/': lambda sample: {'username': sample.username, 'password': sample.password},
+    '/api/v1/token/refresh/': lambda sample: {'refresh': sample.refresh},
+}
+
+# Query strings of the routes that need one: pattern -> format string of the sample values
+QUERY = {
+    '/search/': '?q={word}',
+    '/api/v1/search/': '?q={word}',
+}
+
+Route = namedtuple('Route', ['pattern', 'method', 'path', 'body'])
+
+# Values of the URL parameters and the credentials of the benchmarking user
+Sample = namedtuple('Sample', ['values', 'username', 'password', 'refresh', 'headers'])
+
+_ROUTE_PARAMETER = re.compile(r'<(?:\w+:)?(\w+)>')
+_WORD = re.compile(r'\w+')
+
+
+def _patterns(prefix, urlconf):
+    for pattern in urlconf.urlpatterns:
+        route = str(pattern.pattern)
+        # Router patterns are regular expressions: '^follow/$'
+        yield prefix + route.lstrip('^').rstrip('$')
+
+
+def get_sample(username=None, password='password', anonymous=False):
+    """
+    Pick the data to request the routes with.
+
+    The default user is the one following the most authors, so the follow feed
+    is as long as it gets. The post is the user's latest post with comments.
+    Without any post in a group the slug is None and the group routes are
+    left out.
+    """
+    if username:
+        user = User.objects.get(username=username)
+    else:
+        stats = UserStats.objects.select_related('user').order_by('-following_count').first()
+        user = stats.user if stats else User.objects.order_by('pk').first()
+    posts = Post.objects.select_related('author', 'group').order_by('-pub_date')
+    post = posts.filter(author=user, comment_count__gt=0).first() or posts.filter(comment_count__gt=0).first() \
+        or posts.first()
+    if post is None:
+        raise ValueError('The database has no posts; fill it with `manage.py seed_load`.')
+    grouped = post if post.group else posts.filter(group__isnull=False).first()
+    values = {
+        'username': post.author.username,
+        'post_id': post.pk,
+        'comment_id': post.comments.values_list('pk', flat=True).first() or 0,
+        'slug': grouped.group.slug if grouped else None,
+        # A word of the post for the search routes
+        'word': quote((_WORD.findall(post.text) or ['post'])[0]),
+    }
+
+    refresh = RefreshToken.for_user(user)
+    headers = {}
+    if not anonymous:
+        client = Client()
+        client.force_login(user)
+        headers['Cookie'] = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        headers['Authorization'] = f'Bearer {refresh.access_token}'
+    return Sample(values, user.username, password, str(refresh), headers)
+
+
+def get_routes(sample, only=None):
+    """
+    Routes of the URLconfs filled with the sample values; `only` keeps patterns
+    containing it. Patterns with a parameter the sample has no value for are
+    left out.
+    """
+    routes = []
+    for prefix, urlconf in URLCONFS:
+        for pattern in _patterns(prefix, urlconf):
+            if pattern in SKIP or (only and only not in pattern):
+                continue
+            if any(sample.values.get(name) is None for name in _ROUTE_PARAMETER.findall(pattern)):
+                continue
+            path = _ROUTE_PARAMETER.sub(lambda match: str(sample.values[match.group(1)]), pattern)
+            path += QUERY.get(pattern, '').format(**sample.values)
+            if pattern in POST:
+                routes.append(Route(pattern, 'POST', path, POST[pattern](sample)))
+            else:
+                routes.append(Route(pattern, 'GET', path, None))
+    return routes
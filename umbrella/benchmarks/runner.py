@@ -0,0 +1,119 @@
+"""
+Run the requests of a route and collect latencies and SQL query counts.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class QueryCounter:
+    """
+    Counts the SQL queries of every database connection of the process.
+
+    Queries are run by the request threads, the ASGI executor or the local
+    server, so the counter is installed on each connection as it is opened.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self._install)
+        for connection in connections.all():
+            self._install(connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self._install)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class RouteResult:
+    """ Latencies (seconds) and response statuses of the measured requests of a route. """
+
+    def __init__(self, route):
+        self.route = route
+        self.latencies = []
+        self.statuses = {}
+        self.failures = 0
+        self.seconds = 0
+        self.queries = None
+        self.lock = threading.Lock()
+
+    def add(self, started, status):
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def fail(self):
+        with self.lock:
+            self.failures += 1
+
+
+def _timed(transport, route, headers, result):
+    started = time.perf_counter()
+    try:
+        status = transport.request(route.method, route.path, headers, route.body)
+    except Exception:
+        result.fail()
+    else:
+        result.add(started, status)
+
+
+async def _timed_async(transport, route, headers, result, semaphore):
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            status = await transport.request(route.method, route.path, headers, route.body)
+        except Exception:
+            result.fail()
+        else:
+            result.add(started, status)
+
+
+def run_route(transport, route, headers, requests, concurrency, warmup, counter=None):
+    """ Send warmup + requests requests of the route, concurrency at a time, and measure the latter. """
+    is_async = asyncio.iscoroutinefunction(transport.request)
+    for _ in range(warmup):
+        if is_async:
+            asyncio.run(transport.request(route.method, route.path, headers, route.body))
+        else:
+            transport.request(route.method, route.path, headers, route.body)
+
+    result = RouteResult(route)
+    queries_before = counter.count if counter else 0
+    started = time.perf_counter()
+    if is_async:
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+            await asyncio.gather(*(_timed_async(transport, route, headers, result, semaphore)
+                                   for _ in range(requests)))
+        asyncio.run(run_all())
+    elif concurrency == 1:
+        for _ in range(requests):
+            _timed(transport, route, headers, result)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(requests):
+                executor.submit(_timed, transport, route, headers, result)
+    result.seconds = time.perf_counter() - started
+    if counter:
+        result.queries = (counter.count - queries_before) / max(len(result.latencies), 1)
+    return result
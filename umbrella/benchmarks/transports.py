@@ -0,0 +1,187 @@
+"""
+Ways to deliver a request to the application.
+
+Every transport has request(method, path, headers, body) returning the status
+code once the whole response body has been read; AsgiTransport's is a
+coroutine.
+"""
+import asyncio
+import http.client
+import json
+import threading
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+
+def _split(path):
+    path, _, query = path.partition('?')
+    return path, query
+
+
+def _encode(body):
+    return b'' if body is None else json.dumps(body).encode()
+
+
+class WsgiTransport:
+    """ Calls the WSGI application in the current thread. """
+
+    def __init__(self, application):
+        self.application = application
+
+    def request(self, method, path, headers, body=None):
+        path, query = _split(path)
+        data = _encode(body)
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(data)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(data),
+            'wsgi.errors': BytesIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        status = []
+        response = self.application(environ, lambda line, response_headers, exc_info=None: status.append(line))
+        try:
+            for _ in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return int(status[0].split()[0])
+
+    def close(self):
+        pass
+
+
+class AsgiTransport:
+    """ Calls the ASGI application on the running event loop. """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def request(self, method, path, headers, body=None):
+        path, query = _split(path)
+        data = _encode(body)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            # Django reads no body without content-length
+            'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'),
+                        (b'content-length', str(len(data)).encode())] +
+                       [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        messages = [{'type': 'http.request', 'body': data, 'more_body': False}]
+        status = []
+        finished = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The request is over once the response is sent
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                finished.set()
+
+        await self.application(scope, receive, send)
+        return status[0]
+
+    def close(self):
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpTransport:
+    """ Sends requests over TCP, each thread keeping its own connection alive. """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+        self.connections = []
+
+    def _connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connections.append(self.local.connection)
+        return self.local.connection
+
+    def request(self, method, path, headers, body=None):
+        data = _encode(body)
+        headers = {'Content-Type': 'application/json', **headers}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=data if body is not None else None, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed a kept-alive connection: reconnect once
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                connection.close()
+                self.local.connection = None
+            return response.status
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+class LocalServer:
+    """ Threaded HTTP server running the WSGI application on a free local port. """
+
+    def __init__(self, application):
+        self.server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler, allow_reuse_address=True)
+        self.server.set_app(application)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
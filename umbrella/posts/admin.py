@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Post, Group
+from . import counters, search
+from .models import Post, Group, Task
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -10,12 +11,25 @@ class PostAdmin(admin.ModelAdmin):
     # Interface for searching in the text of posts
     search_fields = ("text",)
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        # Read the full-text index of posts.search instead of LIKE '%...%' over every post
+        return queryset.filter(pk__in=search.search(search_term, limit=search.MAX_RESULTS)), False
+
     # Ability to filter by date
     list_filter = ("pub_date",)
 
     # This property will work for all empty columns
     empty_value_display = "-empty-"
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Creation and deletion are counted by signals, but moving a post to another author is not
+        if change and 'author' in form.changed_data:
+            counters.change_user_stats(form.initial['author'], post_count=-1)
+            counters.change_user_stats(obj.author_id, post_count=1)
+
 
 # Assign the PostAdmin class as a configuration source for Post model
 admin.site.register(Post, PostAdmin)
@@ -32,3 +46,13 @@ class GroupAdmin(admin.ModelAdmin):
 # Assign the PostAdmin class as a configuration source for Post model
 admin.site.register(Group, GroupAdmin)
 
+
+
+class TaskAdmin(admin.ModelAdmin):
+    # Background tasks are created by the code, the admin only watches the queue
+    list_display = ("pk", "name", "status", "attempts", "run_at", "duration")
+    list_filter = ("status", "name")
+    readonly_fields = ("created", "started", "finished", "duration", "error")
+
+
+admin.site.register(Task, TaskAdmin)
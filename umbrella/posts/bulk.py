@@ -0,0 +1,80 @@
+"""
+Batch writes of posts and comments for the bulk API.
+
+bulk_create() and bulk_update() do not send model signals, so the side effects
+that posts.signals applies to single writes (counters, follow feeds, cache
+versions, thumbnails, live updates, the search index) are applied here once
+per batch. Deletes go through QuerySet.delete(), which sends the signals
+itself.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, counters, live, recent, search, tasks, thumbnails, timeline
+from .models import Post, Comment
+
+# Number of rows per INSERT/UPDATE statement
+BATCH_SIZE = 500
+
+
+def _post_scopes(posts):
+    return [scope for post in posts
+            for scope in (*caching.post_scopes(post.author_id, post.group_id), caching.post_scope(post.pk))]
+
+
+@transaction.atomic
+def create_posts(posts):
+    Post.objects.bulk_create(posts, batch_size=BATCH_SIZE)
+    for author_id, count in Counter(post.author_id for post in posts).items():
+        counters.change_user_stats(author_id, post_count=count)
+    tasks.enqueue(timeline.fan_out, [post.pk for post in posts])
+    tasks.enqueue(search.index_posts, [post.pk for post in posts])
+    live.publish_posts(posts)
+    recent.posts_added(posts)
+    caching.invalidate(*_post_scopes(posts))
+    for post in posts:
+        if post.image:
+            thumbnails.schedule(post.pk)
+    return posts
+
+
+@transaction.atomic
+def update_posts(posts, fields):
+    # auto_now is not applied by bulk_update, but the cached post cards depend on it
+    now = timezone.now()
+    for post in posts:
+        post.updated = now
+    Post.objects.bulk_update(posts, [*fields, 'updated'], batch_size=BATCH_SIZE)
+    if 'text' in fields:
+        tasks.enqueue(search.index_posts, [post.pk for post in posts])
+    scopes = _post_scopes(posts)
+    if 'group' in fields:
+        scopes += [caching.group_scope(post._loaded_group_id) for post in posts if post._loaded_group_id]
+    if 'author' in fields:
+        scopes += [caching.profile_scope(post._loaded_author_id) for post in posts]
+    if 'group' in fields or 'author' in fields:
+        recent.posts_moved(posts)
+    caching.invalidate(*scopes)
+    return posts
+
+
+@transaction.atomic
+def create_comments(post, comments):
+    Comment.objects.bulk_create(comments, batch_size=BATCH_SIZE)
+    counters.change_comment_count(post.pk, len(comments))
+    tasks.enqueue(search.index_comments, [comment.pk for comment in comments])
+    caching.invalidate(*caching.post_scopes(post.author_id, post.group_id), caching.post_scope(post.pk))
+    return comments
+
+
+@transaction.atomic
+def update_comments(comments, fields):
+    # Comment texts are shown only with their post
+    Comment.objects.bulk_update(comments, fields, batch_size=BATCH_SIZE)
+    Post.objects.filter(pk__in={comment.post_id for comment in comments}).touch()
+    if 'text' in fields:
+        tasks.enqueue(search.index_comments, [comment.pk for comment in comments])
+    caching.invalidate(*(caching.post_scope(comment.post_id) for comment in comments))
+    return comments
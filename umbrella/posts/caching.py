@@ -0,0 +1,247 @@
+"""
+Cache of rendered feed pages.
+
+Each feed (the index page, a group, an author's profile) has a version token
+in the cache. Pages are stored under "feed version + requested URL", so a
+write only has to replace the version tokens of the feeds it affects: the old
+pages are never read again and expire on their own. The tokens are changed by
+the signal receivers in posts.signals.
+
+Post cards are cached separately by the {% cache %} tag in post_item.html,
+keyed by the post id, its `updated` marker and everything else the card shows.
+
+The same tokens are the validators of conditional GETs (see conditional()):
+a token holds the time it was created, which is the Last-Modified date of the
+feed, and the ETag is derived from the tokens of everything a response shows.
+"""
+import asyncio
+import datetime
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .models import Group, User
+
+# Lifetime of a cached page. Invalidation is done by versions, this only bounds memory usage
+TIMEOUT = getattr(settings, 'POSTS_CACHE_TIMEOUT', 60 * 5)
+
+INDEX = ('index',)
+# Follow feeds, changed by the timeline copies of posts.timeline after the post itself
+TIMELINES = ('timelines',)
+
+
+def group_scope(group_id):
+    return 'group', group_id
+
+
+def profile_scope(user_id):
+    return 'profile', user_id
+
+
+def post_scope(post_id):
+    """ The post itself and its comments, as returned by the API. """
+    return 'post', post_id
+
+
+def _version_key(scope):
+    return 'posts:version:' + ':'.join(str(part) for part in scope)
+
+
+def _new_version():
+    return f'{int(time.time())}.{uuid.uuid4().hex}'
+
+
+def get_version(scope):
+    return get_versions([scope])[scope]
+
+
+def get_versions(scopes):
+    """ Version tokens of the scopes, created for the scopes that have none yet. """
+    keys = {scope: _version_key(scope) for scope in scopes}
+    found = cache.get_many(keys.values())
+    for scope, key in keys.items():
+        if key not in found:
+            # add() keeps the token of a concurrent request that has already created it
+            cache.add(key, _new_version(), None)
+            found[key] = cache.get(key)
+    return {scope: found[key] for scope, key in keys.items()}
+
+
+def version_time(version):
+    """ When the token was created, i.e. when the feed last changed; None for tokens of an older format. """
+    try:
+        return datetime.datetime.fromtimestamp(int(version.split('.')[0]), tz=datetime.timezone.utc)
+    except ValueError:
+        return None
+
+
+def invalidate(*scopes):
+    """ Replace the version tokens of the feeds, so their cached pages are not served anymore. """
+    cache.set_many({_version_key(scope): _new_version() for scope in set(scopes) if scope}, None)
+
+
+def post_scopes(author_id, group_id=None):
+    """ Feeds that show a post of the author in the group. """
+    scopes = [INDEX, profile_scope(author_id)]
+    if group_id is not None:
+        scopes.append(group_scope(group_id))
+    return scopes
+
+
+def page_key(scope, request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'posts:page:{_version_key(scope)}:{get_version(scope)}:{path}'
+
+
+def resolve_scope(request, scope_func, **kwargs):
+    """ scope_func(**kwargs), looked up once per request by the cache and conditional GET decorators. """
+    resolved = request.__dict__.setdefault('_resolved_scopes', {})
+    if scope_func not in resolved:
+        resolved[scope_func] = scope_func(**kwargs)
+    return resolved[scope_func]
+
+
+def cached_feed(scope_func):
+    """
+    Serve anonymous GET requests of a feed view from the cache.
+
+    scope_func(**view_kwargs) returns the scope of the feed, or None when the
+    page should not be cached (e.g. the group does not exist).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Pages of logged in users contain personal links and forms
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            scope = resolve_scope(request, scope_func, **kwargs)
+            if scope is None:
+                return view(request, *args, **kwargs)
+
+            key = page_key(scope, request)
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response, TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional(scopes_func, per_user=True):
+    """
+    Answer conditional GETs of a view with 304 Not Modified while its scopes are unchanged.
+
+    scopes_func(request, **view_kwargs) returns the scopes the response shows,
+    or None when it has no validators (e.g. the object does not exist). The ETag
+    is a hash of their version tokens, and of the user for pages with personal
+    links; Last-Modified is the latest change of the scopes. Both cost one cache
+    lookup, so a 304 is sent before any query, serializer or template runs.
+    """
+    def get_versions_of(request, **kwargs):
+        # condition() asks for the ETag and the date separately, the versions are looked up once
+        if not hasattr(request, '_conditional_versions'):
+            scopes = scopes_func(request, **kwargs)
+            request._conditional_versions = None if scopes is None else get_versions(scopes)
+        return request._conditional_versions
+
+    def etag(request, *args, **kwargs):
+        versions = get_versions_of(request, **kwargs)
+        if versions is None:
+            return None
+        parts = [versions[scope] for scope in sorted(versions)]
+        if per_user:
+            parts.append(str(request.user.pk))
+        return hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        versions = get_versions_of(request, **kwargs)
+        if not versions:
+            return None
+        times = [version_time(version) for version in versions.values()]
+        return None if None in times else max(times)
+
+    def revalidated(response):
+        if response.has_header('ETag'):
+            # Revalidate every time instead of the heuristic freshness that Last-Modified allows
+            patch_cache_control(response, no_cache=True, private=per_user)
+        return response
+
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            return _async_conditional(view_func, etag, last_modified, revalidated)
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            return revalidated(conditional_view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def _async_conditional(view_func, etag_func, last_modified_func, revalidated):
+    """ condition() for async views, which it does not support in Django 4.1. """
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        def validators():
+            return etag_func(request, **kwargs), last_modified_func(request, **kwargs)
+        etag, last_modified = await sync_to_async(validators)()
+        etag = quote_etag(etag) if etag else None
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await view_func(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            if timestamp and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(timestamp)
+            if etag:
+                response.headers.setdefault('ETag', etag)
+        return revalidated(response)
+    return wrapper
+
+
+def index_scope():
+    return INDEX
+
+
+def group_page_scope(slug):
+    group_id = Group.objects.filter(slug=slug).values_list('pk', flat=True).first()
+    return None if group_id is None else group_scope(group_id)
+
+
+def profile_page_scope(username):
+    user_id = User.objects.filter(username=username).values_list('pk', flat=True).first()
+    return None if user_id is None else profile_scope(user_id)
+
+
+def index_scopes(request):
+    return [INDEX]
+
+
+def group_page_scopes(request, slug):
+    scope = resolve_scope(request, group_page_scope, slug=slug)
+    return None if scope is None else [scope]
+
+
+def profile_page_scopes(request, username):
+    scope = resolve_scope(request, profile_page_scope, username=username)
+    return None if scope is None else [scope]
+
+
+def follow_page_scopes(request):
+    # Any post change reaches INDEX, its copies in the timelines TIMELINES, the user's follows their own profile scope
+    return [INDEX, TIMELINES, profile_scope(request.user.pk)]
+
+
+def post_resource_scopes(request, post_id, **kwargs):
+    return [post_scope(post_id)]
@@ -0,0 +1,71 @@
+"""
+Denormalized counters: Post.comment_count and UserStats.
+
+The counters are changed with atomic UPDATE ... SET x = x + 1 statements from
+the signal receivers (posts.signals), so they stay consistent for writes made
+through the views, the API and the admin. Bulk writes that bypass signals call
+these functions directly; `manage.py recount_stats` rebuilds everything.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Comment, Follow, Post, User, UserStats
+
+
+def _change(queryset, **deltas):
+    """ Atomically add deltas to the counters of the rows; counters never drop below zero. """
+    return queryset.update(**{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()})
+
+
+def change_comment_count(post_id, delta):
+    # The comments are exported with their post (api.views.ExportView), so they change its `updated` too
+    Post.objects.filter(pk=post_id).update(comment_count=Greatest(F('comment_count') + delta, 0),
+                                           updated=timezone.now())
+
+
+def change_user_stats(user_id, **deltas):
+    updated = _change(UserStats.objects.filter(pk=user_id), **deltas)
+    # The user has no stats row yet (e.g. created before the counters existed). Decrements are skipped:
+    # they also come from cascades of a user being deleted, whose row must not be created again.
+    if not updated and any(delta > 0 for delta in deltas.values()):
+        recount_user(user_id)
+
+
+def get_stats(user):
+    """ Stats of the user; a missing row is computed on the fly. """
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return recount_user(user.pk)
+
+
+def recount_user(user_id):
+    """ Recompute the stats of one user from the source tables. """
+    stats, _ = UserStats.objects.update_or_create(user_id=user_id, defaults={
+        'post_count': Post.objects.filter(author_id=user_id).count(),
+        'follower_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    })
+    return stats
+
+
+def _count(queryset, field):
+    """ Correlated subquery counting rows of the queryset whose field points to the outer row. """
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        total=Count('*')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def recount_all():
+    """ Recompute every counter in a handful of UPDATE statements. """
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in User.objects.filter(stats__isnull=True).values_list('pk', flat=True)],
+        batch_size=1000,
+    )
+    Post.objects.update(comment_count=_count(Comment.objects.all(), 'post'))
+    UserStats.objects.update(
+        post_count=_count(Post.objects.all(), 'author'),
+        follower_count=_count(Follow.objects.all(), 'author'),
+        following_count=_count(Follow.objects.all(), 'user'),
+    )
@@ -0,0 +1,48 @@
+"""
+Loading of a single post with everything its page shows.
+
+The post page and the API read a post the same way: the post joined with its
+author, the author's stats and its group in one query, then the first page of
+its comments joined with their authors in one more. The number of queries does
+not depend on the number of comments, and a post is only found under the
+username of its own author.
+"""
+from collections import namedtuple
+
+from . import counters
+from .models import Comment, Post
+from .paginator import CursorPaginator
+
+# Comments shown per page of a post, newest first
+COMMENTS_PER_PAGE = 20
+COMMENT_ORDERING = ('-created', '-id')
+
+PostDetail = namedtuple('PostDetail', ['post', 'stats', 'comments'])
+
+
+def post_query(post_id, username=None):
+    """ The post with its author, the author's stats and its group; only the author's post when username is given. """
+    posts = Post.objects.for_feed().select_related('author__stats').filter(pk=post_id)
+    if username is not None:
+        posts = posts.filter(author__username=username)
+    return posts
+
+
+def comments_paginator(post_id, per_page=COMMENTS_PER_PAGE):
+    return CursorPaginator(Comment.objects.filter(post_id=post_id).select_related('author'), per_page,
+                           ordering=COMMENT_ORDERING)
+
+
+def load(post_id, username=None, comments=True, cursor=None):
+    """
+    PostDetail of the post, or None when there is no such post (of the author).
+
+    comments is the page of comments the cursor points to, or None when they
+    are not needed: two queries with the comments, one without.
+    """
+    try:
+        post = post_query(post_id, username).get()
+    except Post.DoesNotExist:
+        return None
+    page = comments_paginator(post.pk).get_page(cursor) if comments else None
+    return PostDetail(post, counters.get_stats(post.author), page)
@@ -0,0 +1,254 @@
+"""
+Live feed updates over Server-Sent Events.
+
+Feed pages open an EventSource on /live/<feed>/ and show a "new posts" notice
+instead of polling the feed. The stream is a plain ASGI application routed by
+umbrella.asgi, so a waiting client costs an idle coroutine rather than a
+worker thread:
+
+    /live/index/                 every new post
+    /live/group/<slug>/          new posts of the group
+    /live/profile/<username>/    new posts of the author
+    /live/follow/                new posts of the authors the logged in user follows
+
+A new post is published once, after its transaction commits, as
+{"id", "author", "group"}. Each process delivers it to the queues of its own
+subscribers of the matching feeds; a follow stream subscribes to the feeds of
+the followed authors when it opens, so a post costs one message whatever the
+number of followers.
+
+Without settings.LIVE_BROKER_URL events stay in the process that saved the
+post, which is enough when the site is served by a single ASGI process. With
+a Redis URL every process publishes to and listens on one Redis channel.
+"""
+import asyncio
+import json
+import logging
+import threading
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import unquote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.signals import request_finished
+from django.db import transaction
+from django.http import HttpRequest
+
+from .models import Follow, Group, User
+
+logger = logging.getLogger(__name__)
+
+PREFIX = '/live/'
+# Seconds between comments that keep idle connections open through proxies
+KEEPALIVE = 20
+# Milliseconds the browser waits before reconnecting a dropped stream
+RETRY = 5000
+# Events kept for a slow client; further events are dropped until it catches up
+QUEUE_SIZE = 100
+REDIS_CHANNEL = 'posts:live'
+
+INDEX = 'index'
+
+
+def group_channel(group_id):
+    return f'group:{group_id}'
+
+
+def profile_channel(author_id):
+    return f'profile:{author_id}'
+
+
+def post_channels(event):
+    """ Feeds that show the post of the event. """
+    channels = [INDEX, profile_channel(event['author'])]
+    if event['group']:
+        channels.append(group_channel(event['group']))
+    return channels
+
+
+def feed_url(feed, key=None):
+    """ Stream URL of a feed page, e.g. feed_url('group', group.slug). """
+    return f'{PREFIX}{feed}/' if key is None else f'{PREFIX}{feed}/{key}/'
+
+
+class Subscriber:
+    """ Event queue of one stream, bound to the event loop serving it. """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+class Hub:
+    """ Subscribers of this process by channel and the broker the events come through. """
+
+    def __init__(self, broker_url=None):
+        self.broker_url = broker_url
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.listener = None
+        self.redis = None
+
+    def subscribe(self, channels):
+        subscriber = Subscriber(channels)
+        with self.lock:
+            for channel in channels:
+                self.channels.setdefault(channel, set()).add(subscriber)
+        if self.broker_url and self.listener is None:
+            self.listener = subscriber.loop.create_task(self._listen())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            for channel in subscriber.channels:
+                subscribers = self.channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.channels[channel]
+
+    def dispatch(self, event):
+        """ Hand the event to the local subscribers of its feeds; safe to call from any thread. """
+        with self.lock:
+            subscribers = set()
+            for channel in post_channels(event):
+                subscribers.update(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+
+    def publish(self, event):
+        if not self.broker_url:
+            self.dispatch(event)
+            return
+        import redis
+        if self.redis is None:
+            self.redis = redis.Redis.from_url(self.broker_url)
+        try:
+            self.redis.publish(REDIS_CHANNEL, json.dumps(event))
+        except redis.RedisError:
+            # Live updates are a hint, the post itself is saved already
+            logger.warning('Could not publish a live update', exc_info=True)
+
+    async def _listen(self):
+        from redis import asyncio as aioredis
+        while True:
+            try:
+                client = aioredis.Redis.from_url(self.broker_url)
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(REDIS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.dispatch(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning('Live update broker connection lost, reconnecting', exc_info=True)
+                await asyncio.sleep(RETRY / 1000)
+
+
+HUB = Hub(getattr(settings, 'LIVE_BROKER_URL', None))
+
+
+def publish_posts(posts):
+    """ Announce new posts to the streams once the transaction saving them commits. """
+    events = [{'id': post.pk, 'author': post.author_id, 'group': post.group_id} for post in posts]
+
+    def publish():
+        for event in events:
+            HUB.publish(event)
+    transaction.on_commit(publish)
+
+
+def _session_user(headers):
+    cookie = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1'))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value if morsel else None)
+    return get_user(request)
+
+
+def _channels(feed, key, headers):
+    """ Channels of the feed, or None when it does not exist or is not available to the client. """
+    try:
+        return _feed_channels(feed, key, headers)
+    finally:
+        # Release the database connection as the end of a Django request does
+        request_finished.send(sender=None)
+
+
+def _feed_channels(feed, key, headers):
+    if feed == 'index' and key is None:
+        return [INDEX]
+    if feed == 'group' and key is not None:
+        group_id = Group.objects.filter(slug=key).values_list('pk', flat=True).first()
+        return None if group_id is None else [group_channel(group_id)]
+    if feed == 'profile' and key is not None:
+        author_id = User.objects.filter(username=key).values_list('pk', flat=True).first()
+        return None if author_id is None else [profile_channel(author_id)]
+    if feed == 'follow' and key is None:
+        user = _session_user(headers)
+        if not user.is_authenticated:
+            return None
+        authors = Follow.objects.filter(user=user).values_list('author_id', flat=True)
+        return [profile_channel(author_id) for author_id in authors]
+    return None
+
+
+async def _respond(send, status, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def application(scope, receive, send):
+    """ ASGI application streaming the new posts of the feed in the path. """
+    if scope['method'] != 'GET':
+        return await _respond(send, 405)
+    parts = [unquote(part) for part in scope['path'][len(PREFIX):].split('/') if part]
+    channels = None
+    if 1 <= len(parts) <= 2:
+        headers = dict(scope['headers'])
+        channels = await sync_to_async(_channels)(parts[0], parts[1] if len(parts) == 2 else None, headers)
+    if channels is None:
+        return await _respond(send, 404)
+
+    subscriber = HUB.subscribe(channels)
+    disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Stop nginx from buffering the stream
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': f'retry: {RETRY}\n\n'.encode(), 'more_body': True})
+        while True:
+            event = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({event, disconnect}, timeout=KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if event not in done:
+                event.cancel()
+            if disconnect in done:
+                break
+            if event in done:
+                body = f'event: post\nid: {event.result()["id"]}\ndata: {json.dumps(event.result())}\n\n'
+            else:
+                body = ': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+    finally:
+        disconnect.cancel()
+        HUB.unsubscribe(subscriber)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.module_loading import autodiscover_modules
+
+from posts.query_plans import HOT_QUERIES, plan_problems
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN every registered hot query and fail if one reads a table without an index or sorts rows.'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only SQLite query plans can be checked.')
+        # Query registries of all apps (posts.query_plans, api.query_plans, ...)
+        autodiscover_modules('query_plans')
+
+        failed = []
+        for name, (func, ordered_scan) in HOT_QUERIES.items():
+            for queryset in func():
+                plan, problems = plan_problems(queryset, ordered_scan)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{name}:\n{plan}\n')
+                if problems:
+                    failed.append(name)
+                    self.stdout.write(self.style.ERROR(f'{name}: {"; ".join(problems)}'))
+        if failed:
+            raise CommandError(f'{len(failed)} hot queries do not use an index.')
+        self.stdout.write(self.style.SUCCESS(f'All {len(HOT_QUERIES)} hot queries use their indexes.'))
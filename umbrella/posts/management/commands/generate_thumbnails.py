@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Generate the thumbnails of posts whose images are still waiting for them (e.g. after a worker restart).'
+
+    def handle(self, *args, **options):
+        # image__gt='' leaves out both posts without an image: '' and NULL
+        post_ids = Post.objects.filter(image__gt='', thumbnail_ready=False).values_list('pk', flat=True)
+        count = 0
+        for post_id in post_ids.iterator():
+            thumbnails.generate(post_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Thumbnails generated for {count} posts.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of posts and comments from their tables (e.g. after seed_load).'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            posts, comments = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt: {posts} posts, {comments} comments.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized counters: comments of posts and posts/followers/followings of users.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            counters.recount_all()
+        self.stdout.write(self.style.SUCCESS('Counters recomputed.'))
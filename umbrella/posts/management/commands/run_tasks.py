@@ -0,0 +1,75 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts import tasks
+
+# Finished tasks older than tasks.RETENTION are deleted this often, seconds
+PURGE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background tasks (follow feed fan-out, thumbnails) until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the tasks that are due now and exit.')
+        parser.add_argument('--sleep', type=float, default=1, help='Seconds to wait when no task is due.')
+        parser.add_argument('--max-tasks', type=int, help='Exit after running this many tasks.')
+        parser.add_argument('--stats', action='store_true', help='Print the statistics of the tasks and exit.')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            return self.print_stats()
+
+        # One JSON line per task run on stderr; only the failures with verbosity 0
+        handler = logging.StreamHandler()
+        handler.setLevel(logging.INFO if options['verbosity'] else logging.WARNING)
+        level = tasks.logger.level
+        tasks.logger.addHandler(handler)
+        tasks.logger.setLevel(logging.INFO)
+        try:
+            self.work(options)
+        finally:
+            tasks.logger.removeHandler(handler)
+            tasks.logger.setLevel(level)
+        self.stdout.write(self.style.SUCCESS('Worker stopped.'))
+
+    def work(self, options):
+        remaining = options['max_tasks']
+        purged = 0
+        try:
+            while remaining is None or remaining > 0:
+                close_old_connections()
+                tasks.requeue_stale()
+                if time.monotonic() - purged > PURGE_INTERVAL:
+                    tasks.purge()
+                    purged = time.monotonic()
+                count = tasks.run_pending(remaining)
+                if remaining is not None:
+                    remaining -= count
+                if options['once']:
+                    break
+                if not count:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+
+    def print_stats(self):
+        rows = tasks.stats()
+        if not rows:
+            self.stdout.write('No tasks.')
+            return
+        columns = ('name', 'queued', 'running', 'done', 'failed', 'retried', 'avg_ms', 'max_ms', 'lag_s')
+        lines = [columns]
+        for row in rows:
+            lines.append((
+                row['name'], row['queued'], row['running'], row['done'], row['failed'], row['retried'],
+                '-' if row['avg_duration'] is None else f'{row["avg_duration"] * 1000:.1f}',
+                '-' if row['max_duration'] is None else f'{row["max_duration"] * 1000:.1f}',
+                '-' if row['lag'] is None else f'{row["lag"]:.0f}',
+            ))
+        widths = [max(len(str(line[i])) for line in lines) for i in range(len(columns))]
+        for line in lines:
+            self.stdout.write('  '.join(str(value).ljust(width) for value, width in zip(line, widths)).rstrip())
@@ -0,0 +1,189 @@
+import datetime
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from io import BytesIO
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from posts import counters, recent, search, timeline
+from posts.models import Comment, Follow, Group, Post, User
+
+WORDS = ('зонтик', 'дождь', 'город', 'утро', 'кофе', 'книга', 'ветер', 'море', 'кот', 'работа', 'вечер',
+         'музыка', 'дорога', 'письмо', 'солнце', 'сад', 'мост', 'окно', 'поезд', 'снег')
+
+# Rows are committed in transactions of this many batches
+BATCHES_PER_TRANSACTION = 50
+
+
+def skewed(count, skew):
+    """
+    Random index in range(count) following a power law: small indexes are much more likely.
+
+    skew=1 is uniform; with skew=3 the first 0.1% of the range gets 10% of the picks,
+    like the most popular authors get most of the follows.
+    """
+    return min(int(count * random.random() ** skew), count - 1)
+
+
+@contextmanager
+def own_dates(*fields):
+    """ Keep the dates set on the objects instead of auto_now/auto_now_add overwriting them with now(). """
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Generate a large synthetic community for load testing: users, groups, posts, comments and follows '
+            'with power-law popularity. Counters, follow feeds and the search index are filled at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=300000)
+        parser.add_argument('--follows', type=float, default=20, help='Average number of authors a user follows.')
+        parser.add_argument('--skew', type=float, default=3,
+                            help='Power-law exponent of popularity (1 is uniform).')
+        parser.add_argument('--images', type=float, default=0, help='Share of posts with an image, 0..1.')
+        parser.add_argument('--days', type=int, default=365, help='Posts are spread over this many past days.')
+        parser.add_argument('--prefix', default='load', help='Prefix of the generated usernames and group slugs.')
+        parser.add_argument('--password', default='password', help='Password of every generated user.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--timeline-days', type=int, default=30,
+                            help='Posts of the last days copied into the follow feeds of the generated users; '
+                                 'every follow of a popular author copies all of their posts, 0 copies none.')
+        parser.add_argument('--random-seed', type=int, help='Seed of the random generator, for repeatable data.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.batch_size = options['batch_size']
+        random.seed(options['random_seed'])
+        self.now = timezone.now()
+        self.seconds = options['days'] * 24 * 60 * 60
+
+        user_ids = self.insert(User, self.users())
+        group_ids = self.insert(Group, self.groups())
+        self.insert(Follow, self.follows(user_ids))
+        images = self.images()
+        with own_dates(Post._meta.get_field('pub_date'), Post._meta.get_field('updated')):
+            post_ids = self.insert(Post, self.posts(user_ids, group_ids, images))
+        with own_dates(Comment._meta.get_field('created')):
+            self.insert(Comment, self.comments(user_ids, post_ids))
+
+        self.step('Counters', counters.recount_all)
+        if options['timeline_days'] and user_ids:
+            generated = User.objects.filter(pk__gte=min(user_ids), pk__lte=max(user_ids))
+            since = self.now - datetime.timedelta(days=options['timeline_days'])
+            self.step('Timelines', lambda: timeline.fill(generated, since))
+        self.step('Search index', search.rebuild)
+        # The posts were inserted around posts.signals, so the lists of the latest posts are read again
+        self.step('Feed lists', recent.reset)
+        if images:
+            self.stdout.write('Run `manage.py generate_thumbnails` to create the thumbnails of the images.')
+
+    def insert(self, model, objects):
+        """ bulk_create the objects in batches and return their ids. """
+        started = time.monotonic()
+        ids = array('q')
+        objects = iter(objects)
+        done = False
+        while not done:
+            with transaction.atomic():
+                for _ in range(BATCHES_PER_TRANSACTION):
+                    batch = list(islice(objects, self.batch_size))
+                    if not batch:
+                        done = True
+                        break
+                    model.objects.bulk_create(batch, batch_size=self.batch_size)
+                    ids.extend(obj.pk for obj in batch)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {len(ids)} in {time.monotonic() - started:.1f}s')
+        return ids
+
+    def step(self, name, func):
+        started = time.monotonic()
+        with transaction.atomic():
+            func()
+        self.stdout.write(f'{name}: {time.monotonic() - started:.1f}s')
+
+    def text(self, words):
+        return ' '.join(random.choices(WORDS, k=words)).capitalize() + '.'
+
+    def users(self):
+        prefix = self.options['prefix']
+        # Continue the numbering of a previous run with the same prefix
+        start = User.objects.filter(username__startswith=prefix).count()
+        password = make_password(self.options['password'])  # hashed once: hashing every user takes hours
+        for number in range(start, start + self.options['users']):
+            yield User(username=f'{prefix}{number}', password=password, date_joined=self.now)
+
+    def groups(self):
+        prefix = self.options['prefix']
+        start = Group.objects.filter(slug__startswith=prefix).count()
+        for number in range(start, start + self.options['groups']):
+            yield Group(title=f'{prefix} group {number}', slug=f'{prefix}{number}'[:10], description=self.text(12))
+
+    def follows(self, user_ids):
+        count, skew = len(user_ids), self.options['skew']
+        if count < 2:
+            return
+        # Most users follow a few authors, some follow hundreds; popular authors get most of the follows
+        most = self.options['follows'] * (skew + 1)
+        for user_id in user_ids:
+            authors = {user_ids[skewed(count, skew)] for _ in range(int(most * random.random() ** skew))}
+            authors.discard(user_id)
+            for author_id in authors:
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    def images(self):
+        """ Names of a few stored images shared by the posts with an image. """
+        if not self.options['images']:
+            return []
+        names = []
+        for number in range(5):
+            buffer = BytesIO()
+            color = tuple(random.randrange(256) for _ in range(3))
+            Image.new('RGB', (1200, 800), color).save(buffer, 'JPEG')
+            names.append(default_storage.save(f'posts/{self.options["prefix"]}_{number}.jpeg',
+                                              ContentFile(buffer.getvalue())))
+        return names
+
+    def posts(self, user_ids, group_ids, images):
+        users, skew = len(user_ids), self.options['skew']
+        for _ in range(self.options['posts'] if users else 0):
+            pub_date = self.now - datetime.timedelta(seconds=random.randrange(self.seconds))
+            has_image = images and random.random() < self.options['images']
+            yield Post(
+                # Active authors write more, though less unevenly than they are followed
+                author_id=user_ids[skewed(users, max(skew - 1, 1))],
+                group_id=random.choice(group_ids) if group_ids and random.random() < 0.5 else None,
+                text=self.text(random.randint(5, 60)),
+                image=random.choice(images) if has_image else None,
+                pub_date=pub_date,
+                updated=pub_date,
+            )
+
+    def comments(self, user_ids, post_ids):
+        users, posts, skew = len(user_ids), len(post_ids), self.options['skew']
+        for _ in range(self.options['comments'] if posts else 0):
+            yield Comment(
+                # A few posts collect most of the discussion
+                post_id=post_ids[skewed(posts, skew)],
+                author_id=user_ids[skewed(users, skew)],
+                text=self.text(random.randint(3, 30)),
+                created=self.now - datetime.timedelta(seconds=random.randrange(self.seconds)),
+            )
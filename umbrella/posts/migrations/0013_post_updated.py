@@ -0,0 +1,26 @@
+# Generated by Django 4.1.1 on 2026-10-18 19:55
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_pub_date(apps, schema_editor):
+    # The time of the last edit of existing posts is unknown, start from the publication date
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(updated=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, verbose_name='Update date'),
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.1 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    # Thumbnails of existing images were created on demand by the templates, sorl finds them in its key-value store
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.exclude(image='').exclude(image=None).update(thumbnail_ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def queue_rebuild(apps, schema_editor):
+    # The stemmer changes with the code, so the migration does not index the texts itself:
+    # a worker indexes the existing posts and comments with the current posts.search
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Task = apps.get_model('posts', 'Task')
+    if Post.objects.exists() or Comment.objects.exists():
+        Task.objects.create(name='posts.search.rebuild_index', args=[], run_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_task'),
+    ]
+
+    operations = [
+        # Full-text indexes of posts.search; the texts are stemmed before they are written,
+        # the tokenizer only splits them by spaces and keeps the letters as they are
+        migrations.RunSQL(
+            "CREATE VIRTUAL TABLE posts_search_post USING fts5(text, tokenize='unicode61 remove_diacritics 0')",
+            'DROP TABLE posts_search_post',
+        ),
+        migrations.RunSQL(
+            "CREATE VIRTUAL TABLE posts_search_comment "
+            "USING fts5(text, post_id UNINDEXED, tokenize='unicode61 remove_diacritics 0')",
+            'DROP TABLE posts_search_comment',
+        ),
+        # Search finds nothing until the rebuild has run: by the worker (manage.py run_tasks),
+        # or at once with `manage.py rebuild_search_index`
+        migrations.RunPython(queue_rebuild, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -14,6 +15,17 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """ Posts with everything post_item.html needs, so a feed page renders in a constant number of queries. """
+        # The number of comments is read from the denormalized Post.comment_count
+        return self.select_related('author', 'group')
+
+    def touch(self):
+        """ Mark the posts as changed, e.g. when their comments change: they are exported with them. """
+        return self.update(updated=timezone.now())
+
+
 class Post(models.Model):
     author = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='posts')
     group = models.ForeignKey(to=Group, on_delete=models.CASCADE, related_name='posts', blank=True, null=True,
@@ -25,9 +37,50 @@ class Post(models.Model):
     image = models.ImageField(upload_to='posts/', blank=True, null=True,
                               verbose_name='Изображение')
 
+    # Whether the thumbnails of the image are generated (see posts.thumbnails)
+    thumbnail_ready = models.BooleanField(default=False, editable=False)
+    # Changes on every save; part of the cache key of the rendered post card
+    updated = models.DateTimeField('Update date', auto_now=True)
+    # Maintained by posts.counters on every comment write
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        # Every feed is read in the (pub_date, id) key order of posts.paginator.CursorPaginator,
+        # these indexes turn each of them into a range read without sorting
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='posts_post_feed_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'], name='posts_post_author_feed_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'], name='posts_post_group_feed_idx'),
+            # Incremental export (api.views.ExportView)
+            models.Index(fields=['updated', 'id'], name='posts_post_updated_idx'),
+        ]
+
     def __str__(self):
         return self.text
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        # Remember the group the post was loaded with: moving the post changes the old group feed too
+        instance._loaded_group_id = loaded.get('group_id')
+        # and the author, as the admin can give a post to another author
+        instance._loaded_author_id = loaded.get('author_id')
+        # and the image, whose thumbnails have to be generated again when it is replaced
+        instance._loaded_image = loaded.get('image')
+        # and the text, which is indexed again by posts.search when it changes
+        instance._loaded_text = loaded.get('text')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # comment_count is changed by atomic UPDATEs, so a regular save must not write back a stale value
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'comment_count']
+        super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
@@ -38,6 +91,10 @@ class Comment(models.Model):
     # Sort queryset at the model level
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # Comments of a post in either direction of the ordering
+            models.Index(fields=['post', '-created', '-id'], name='posts_comment_post_idx'),
+        ]
 
     def __str__(self):
         return f'Comment to "{self.post}" from "{self.author}"'
@@ -55,3 +112,69 @@ class Follow(models.Model):
 
     def __str__(self):
         return f'"{self.user}" follows "{self.author}"'
+
+
+class TimelineEntry(models.Model):
+    """ Materialized follow feed: one row per post of every author the user is subscribed to. """
+    # The reader whose follow feed contains the post
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copy of post.author and post.pub_date, so the feed can be read and trimmed without joining posts_post
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [
+            # The follow page is a single range read over this index
+            models.Index(fields=['user', '-pub_date', '-post'], name='posts_timeline_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f'Post "{self.post_id}" in the feed of "{self.user_id}"'
+
+
+class UserStats(models.Model):
+    """ Counters shown on the profile and post pages, maintained by posts.counters on every write. """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    post_count = models.PositiveIntegerField(default=0)
+    # Number of users subscribed to this user
+    follower_count = models.PositiveIntegerField(default=0)
+    # Number of authors this user is subscribed to
+    following_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'Stats of "{self.user}"'
+
+
+class Task(models.Model):
+    """ Background job of posts.tasks: a registered function and its JSON arguments. """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    # Dotted path of the function, e.g. posts.timeline.fan_out
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # Not run before this moment: a retry waits longer after every failure
+    run_at = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # Seconds taken by the last attempt
+    duration = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers read the due tasks in this order
+            models.Index(fields=['status', 'run_at', 'id'], name='posts_task_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)} ({self.status})'
@@ -0,0 +1,233 @@
+"""
+Keyset (cursor) pagination for the feeds.
+
+Django's Paginator runs COUNT(*) and reads pages with OFFSET, so deep pages get
+slower as the table grows. CursorPaginator continues from the last seen row
+instead: a page is "rows after (pub_date, id) of the previous page", which is a
+range read over the ordering index and costs the same on every page.
+"""
+import base64
+import datetime
+import heapq
+import json
+import math
+from itertools import islice
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+
+# Integers of a cursor are ids or dates of 64-bit columns: larger ones overflow when the query runs
+MAX_INTEGER = 2 ** 63 - 1
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """ DjangoJSONEncoder truncates datetimes to milliseconds; the cursor key must be exact. """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorPage:
+    """ Page of a CursorPaginator. Iterated in templates like a regular paginator page. """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate a queryset by a unique ordering key, e.g. ('-pub_date', '-id').
+
+    Cursors are opaque url-safe tokens holding the direction and the key of the
+    row the page starts after. The key values are read from the attributes named
+    like the ordering fields, so they must be selected (or annotated) on each row.
+    """
+    # Direction markers stored in the cursor
+    NEXT = 'n'
+    PREVIOUS = 'p'
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.descending = ordering[0].startswith('-')
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, field) for field in self.fields]
+        raw = json.dumps([direction] + values, cls=CursorEncoder)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """ Return (direction, values) of a cursor, or None if it is missing or malformed. """
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, *values = json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+        if direction not in (self.NEXT, self.PREVIOUS) or len(values) != len(self.fields):
+            return None
+        if not all(map(self._storable, values)):
+            return None
+        return direction, values
+
+    @staticmethod
+    def _storable(value):
+        """ Whether a key value of a cursor fits the database columns. """
+        if isinstance(value, int):
+            return abs(value) <= MAX_INTEGER
+        if isinstance(value, float):
+            return math.isfinite(value)
+        return True
+
+    def _after(self, values, forward):
+        """ Condition selecting rows that follow the key in the requested direction. """
+        lookup = 'lt' if forward == self.descending else 'gt'
+        condition = Q()
+        for position, field in enumerate(self.fields):
+            # (a < x) OR (a = x AND b < y) OR ... for every field of the key
+            equal = {f: v for f, v in zip(self.fields[:position], values)}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[position]})
+        return condition
+
+    def _order(self, forward):
+        reverse = forward != self.descending
+        return [field if reverse else f'-{field}' for field in self.fields]
+
+    def _page_queryset(self, decoded):
+        forward = decoded is None or decoded[0] == self.NEXT
+        queryset = self.object_list.order_by(*self._order(forward))
+        if decoded is not None:
+            queryset = queryset.filter(self._after(decoded[1], forward))
+        # One extra row tells whether there is anything beyond this page
+        return queryset[:self.per_page + 1]
+
+    def rows_after(self, cursor):
+        """ object_list without the rows up to the key of a next-page cursor, or None when the cursor is malformed. """
+        decoded = self.decode_cursor(cursor)
+        if decoded is None or decoded[0] != self.NEXT:
+            return None
+        return self.object_list.filter(self._after(decoded[1], True))
+
+    def page_queryset(self, cursor=None):
+        """ The query get_page() runs for the cursor, not evaluated (e.g. to EXPLAIN it). """
+        return self._page_queryset(self.decode_cursor(cursor))
+
+    def get_page(self, cursor=None):
+        """ Return the page the cursor points to; a missing or broken cursor yields the first page. """
+        decoded = self.decode_cursor(cursor)
+        try:
+            queryset = self._page_queryset(decoded)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            # Key values of a forged cursor could not be converted to the field types
+            return self.get_page()
+        return self._make_page(list(queryset), decoded)
+
+    async def aget_page(self, cursor=None):
+        """ get_page() for async views, reading the rows with the async ORM. """
+        decoded = self.decode_cursor(cursor)
+        try:
+            queryset = self._page_queryset(decoded)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            return await self.aget_page()
+        return self._make_page([row async for row in queryset], decoded)
+
+    def _make_page(self, rows, decoded):
+        forward = decoded is None or decoded[0] == self.NEXT
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return CursorPage(rows)
+
+        if forward:
+            has_next, has_previous = has_more, decoded is not None
+        else:
+            has_next, has_previous = True, has_more
+        return CursorPage(
+            rows,
+            next_cursor=self.encode_cursor(self.NEXT, rows[-1]) if has_next else None,
+            previous_cursor=self.encode_cursor(self.PREVIOUS, rows[0]) if has_previous else None,
+        )
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """
+    Paginate several sources with the same ordering key as one list.
+
+    A queryset is read like a CursorPaginator page, at most per_page + 1 rows
+    from its own index range. Any other source provides page_rows(decoded,
+    forward) returning at most per_page + 1 rows sorted in the direction of the
+    page, and may provide hydrate(rows) to complete the rows that made it to the
+    page (e.g. posts.recent.AuthorsPart). The rows are merged by the key, so a
+    page costs one bounded read per source however many rows they have in total;
+    when hydrate() drops rows, the sources are read again after the last row to
+    fill the page.
+    """
+
+    def __init__(self, sources, per_page, ordering=('-pub_date', '-id')):
+        super().__init__(None, per_page, ordering)
+        self.parts = [CursorPaginator(source, per_page, ordering) if isinstance(source, QuerySet) else source
+                      for source in sources]
+
+    def page_querysets(self, cursor=None):
+        """ The queries get_page() runs for the queryset sources and the cursor. """
+        decoded = self.decode_cursor(cursor)
+        return [part._page_queryset(decoded) for part in self.parts if isinstance(part, CursorPaginator)]
+
+    def _part_rows(self, part, decoded, forward):
+        if isinstance(part, CursorPaginator):
+            return list(part._page_queryset(decoded))
+        return part.page_rows(decoded, forward)
+
+    def _hydrate(self, rows):
+        for part in self.parts:
+            if hasattr(part, 'hydrate'):
+                rows = part.hydrate(rows)
+        return rows
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor)
+        forward = decoded is None or decoded[0] == self.NEXT
+        rows, position = [], decoded
+        while True:
+            try:
+                sources = [self._part_rows(part, position, forward) for part in self.parts]
+            except (ValidationError, TypeError, ValueError, OverflowError):
+                return self.get_page()
+            # Every part is sorted in the direction of the page: descending for next pages of a descending key
+            merged = heapq.merge(*sources, key=attrgetter(*self.fields), reverse=forward == self.descending)
+            wanted = self.per_page + 1 - len(rows)
+            batch = list(islice(merged, wanted))
+            # hydrate() drops the rows whose objects are gone, the page is refilled after the last row read
+            rows += self._hydrate(batch)
+            if len(rows) > self.per_page or len(batch) < wanted:
+                break
+            position = self.decode_cursor(self.encode_cursor(position[0] if position else self.NEXT, batch[-1]))
+        return self._make_page(rows, decoded)
@@ -0,0 +1,124 @@
+"""
+Registry of the hot queries and the check of their plans.
+
+Every query that serves a feed page, an API list or an export is registered
+here, built by the same code the views use. `manage.py check_query_plans` runs
+EXPLAIN on each of them and fails when SQLite would read a whole table or sort
+rows in a temporary B-tree, i.e. when a query has lost its index.
+
+Apps register their own queries in a query_plans module, which the command
+imports like the admin imports admin modules:
+
+    @hot_query('api: posts of a group')
+    def api_group_posts():
+        return [...querysets...]
+"""
+import re
+from types import SimpleNamespace
+
+from django.utils import timezone
+
+from . import detail, recent, tasks, timeline
+from .models import Post, Comment
+from .paginator import CursorPaginator, MergedCursorPaginator
+
+# name -> (function returning the querysets, whether an ordered index scan is fine)
+HOT_QUERIES = {}
+
+# "7 0 0 SCAN posts_post USING INDEX ..." -> "SCAN posts_post USING INDEX ..."
+_PLAN_LINE = re.compile(r'^(?:\d+ ){3}')
+
+
+def hot_query(name, ordered_scan=False):
+    """
+    Register a function returning the querysets of a hot query.
+
+    ordered_scan allows walking a whole index in its order: an unfiltered feed
+    stops after a page of rows, so it never reads more than it returns.
+    """
+    def decorator(func):
+        HOT_QUERIES[name] = (func, ordered_scan)
+        return func
+    return decorator
+
+
+def plan_problems(queryset, ordered_scan=False):
+    """ Return (plan, lines of the plan that read without an index or sort). """
+    plan = queryset.explain()
+    problems = []
+    for line in plan.splitlines():
+        detail = _PLAN_LINE.sub('', line.strip())
+        if 'TEMP B-TREE' in detail:
+            problems.append(detail)
+        elif detail.startswith('SCAN ') and not (ordered_scan and ' INDEX ' in detail):
+            problems.append(detail)
+    return plan, problems
+
+
+def pages(paginator, **key):
+    """ Queries of the first page and of a page continued after the key. """
+    cursor = paginator.encode_cursor(paginator.NEXT, SimpleNamespace(**key))
+    return [paginator.page_queryset(), paginator.page_queryset(cursor)]
+
+
+@hot_query('index feed', ordered_scan=True)
+def index_feed():
+    return pages(CursorPaginator(Post.objects.for_feed(), 10), pub_date=timezone.now(), id=1)
+
+
+@hot_query('group feed')
+def group_feed():
+    return pages(CursorPaginator(Post.objects.filter(group_id=1).for_feed(), 5), pub_date=timezone.now(), id=1)
+
+
+@hot_query('profile feed')
+def profile_feed():
+    return pages(CursorPaginator(Post.objects.filter(author_id=1).for_feed(), 5), pub_date=timezone.now(), id=1)
+
+
+@hot_query('follow feed')
+def follow_feed():
+    paginator = CursorPaginator(timeline.feed(1), 5, ordering=timeline.FEED_ORDERING)
+    return pages(paginator, feed_date=timezone.now(), feed_id=1)
+
+
+@hot_query('follow feed with popular authors')
+def hybrid_follow_feed():
+    paginator = MergedCursorPaginator([timeline.feed(1, exclude_authors=[2, 3])], 5, ordering=timeline.FEED_ORDERING)
+    cursor = paginator.encode_cursor(paginator.NEXT, SimpleNamespace(feed_date=timezone.now(), feed_id=1))
+    return [*paginator.page_querysets(), *paginator.page_querysets(cursor)]
+
+
+@hot_query('latest posts of the index', ordered_scan=True)
+def recent_index():
+    return [recent.query(recent.INDEX)]
+
+
+@hot_query('latest posts of a group or an author')
+def recent_lists():
+    return [recent.query(recent.group_scope(1)), recent.query(recent.author_scope(1)),
+            recent.AuthorsPart.older(1, (timezone.now(), 1), 6),
+            recent.AuthorsPart.newer(1, (timezone.now(), 1), 6)]
+
+
+@hot_query('first page from the latest posts')
+def recent_first_page():
+    return [recent.FeedPaginator(scope, posts.for_feed(), 10).recent_rows((timezone.now(), 1))
+            for scope, posts in [(recent.INDEX, Post.objects.all()),
+                                 (recent.group_scope(1), Post.objects.filter(group_id=1)),
+                                 (recent.author_scope(1), Post.objects.filter(author_id=1))]]
+
+
+@hot_query('comments of a post')
+def post_comments():
+    return [Comment.objects.filter(post_id=1)]
+
+
+@hot_query('post page')
+def post_page():
+    return [detail.post_query(1, 'author'), *pages(detail.comments_paginator(1), created=timezone.now(), id=1)]
+
+
+@hot_query('due background tasks')
+def due_tasks():
+    return [tasks.due_tasks().values_list('id', flat=True)[:tasks.BATCH_SIZE]]
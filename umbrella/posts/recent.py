@@ -0,0 +1,386 @@
+"""
+Lists of the latest posts of the feeds, kept in memory.
+
+Most requests of the index, group and profile pages are for their first page,
+and the follow feed merges in the latest posts of the popular authors
+(posts.timeline). Instead of reading them from posts_post with ORDER BY, every
+feed keeps the (pub_date, id) keys of its latest LENGTH posts:
+
+    INDEX                       all posts
+    group_scope(group_id)       posts of a group
+    author_scope(author_id)     posts of an author
+
+Every list has a generation, a counter in the shared cache incremented by each
+change. Generation n of a list is stored in the shared cache once and never
+changes, and every process keeps the lists it has read as ring buffers
+(deques with maxlen=LENGTH) while their generation is current. Reading a list
+then costs one cache lookup of its generation, and the posts of a page are
+loaded by id in one query (FeedPaginator, AuthorsPart).
+
+posts.signals and posts.bulk apply new, moved and deleted posts to the lists
+once their transaction commits: generation n + 1 is generation n with the
+change applied, so a write does not read the table again. When generation n is
+not at hand, e.g. because two posts were published at once, generation n + 1 is
+read from the table on the next request. The first page is checked against the
+table, so a list that is out of date is dropped and the page falls back to the
+regular query instead of showing the wrong posts. Code writing posts around
+posts.signals and posts.bulk, like seed_load, drops all lists with reset().
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from itertools import islice
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Post
+from .paginator import CursorPaginator
+
+# Keys of the latest posts kept per list
+LENGTH = 200
+# Lists nobody reads are dropped from the shared cache after this time, seconds
+TIMEOUT = 24 * 60 * 60
+# Lists kept in memory by a process; the least recently read ones are dropped first
+MAX_BUFFERS = 1000
+
+INDEX = ('recent', 'index')
+
+
+def group_scope(group_id):
+    return 'recent', 'group', group_id
+
+
+def author_scope(author_id):
+    return 'recent', 'author', author_id
+
+
+def post_scopes(author_id, group_id=None):
+    """ Lists that contain a post of the author in the group. """
+    scopes = [INDEX, author_scope(author_id)]
+    if group_id is not None:
+        scopes.append(group_scope(group_id))
+    return scopes
+
+
+def post_key(post):
+    return post.pub_date, post.pk
+
+
+def query(scope):
+    """ Keys of the latest posts of the list, newest first, one more than a list keeps. """
+    posts = Post.objects.all()
+    if scope[1] == 'group':
+        posts = posts.filter(group_id=scope[2])
+    elif scope[1] == 'author':
+        posts = posts.filter(author_id=scope[2])
+    return posts.order_by('-pub_date', '-id').values_list('pub_date', 'id')[:LENGTH + 1]
+
+
+def _generation_key(scope):
+    # Under the prefix of the posts.caching versions, so the counters bypass the in-process cache
+    return 'posts:version:' + ':'.join(str(part) for part in scope)
+
+
+def _list_key(scope, generation):
+    return 'posts:' + ':'.join(str(part) for part in (*scope, *generation))
+
+
+# Counter shared by all lists, incremented by reset()
+_EPOCH_KEY = _generation_key(('recent', 'epoch'))
+
+
+# scope -> (generation, deque of keys in ascending order, complete); the deques are never changed in place
+_buffers = OrderedDict()
+_lock = threading.Lock()
+
+
+def _remember(scope, generation, keys, complete):
+    with _lock:
+        _buffers[scope] = (generation, keys, complete)
+        _buffers.move_to_end(scope)
+        while len(_buffers) > MAX_BUFFERS:
+            _buffers.popitem(last=False)
+
+
+def _remembered(scope, generation):
+    with _lock:
+        buffer = _buffers.get(scope)
+        if buffer is None or buffer[0] != generation:
+            return None
+        _buffers.move_to_end(scope)
+        return buffer[1], buffer[2]
+
+
+def _start_counter(key):
+    # Counted from the time rather than 0: a counter evicted from the cache
+    # must not return to generations whose lists are still stored
+    cache.add(key, time.time_ns() // 1000, None)
+    return cache.get(key)
+
+
+def generations(scopes):
+    """ scope -> (epoch, generation) of the lists, read with one cache lookup. """
+    keys = {scope: _generation_key(scope) for scope in scopes}
+    found = cache.get_many([_EPOCH_KEY, *keys.values()])
+    for key in [_EPOCH_KEY, *keys.values()]:
+        if key not in found:
+            found[key] = _start_counter(key)
+    return {scope: (found[_EPOCH_KEY], found[key]) for scope, key in keys.items()}
+
+
+def reset():
+    """ Drop all lists, e.g. after posts were written without posts.signals or posts.bulk. """
+    _start_counter(_EPOCH_KEY)
+    try:
+        cache.incr(_EPOCH_KEY)
+    except ValueError:  # evicted since it was started, so it starts again from the time
+        pass
+    with _lock:
+        _buffers.clear()
+
+
+def discard(scope):
+    """ Drop the list, which is read from the table again on the next request. """
+    try:
+        cache.incr(_generation_key(scope))
+    except ValueError:  # evicted, so it starts again from the time
+        pass
+
+
+def get_lists(scopes):
+    """
+    scope -> (keys, complete) of the lists.
+
+    keys are (pub_date, id) of the latest posts in ascending order; complete
+    tells whether they are all posts of the list or only the latest LENGTH.
+    """
+    lists, missing = {}, {}
+    for scope, generation in generations(scopes).items():
+        remembered = _remembered(scope, generation)
+        if remembered is None:
+            missing[scope] = generation
+        else:
+            lists[scope] = remembered
+    if missing:
+        keys = {scope: _list_key(scope, generation) for scope, generation in missing.items()}
+        found = cache.get_many(keys.values())
+        for scope, key in keys.items():
+            if key not in found:
+                rows = list(query(scope))
+                found[key] = (tuple(rows[:LENGTH][::-1]), len(rows) <= LENGTH)
+                # A writer may have stored this generation with its post applied in the meantime
+                cache.add(key, found[key], TIMEOUT)
+            stored, complete = found[key]
+            lists[scope] = (deque(stored, maxlen=LENGTH), complete)
+            _remember(scope, missing[scope], *lists[scope])
+    return lists
+
+
+def _apply(scope, added, removed):
+    """ Store the next generation of the list, with the keys added and the post ids removed. """
+    epoch, generation = generations([scope])[scope]
+    current = _remembered(scope, (epoch, generation)) or cache.get(_list_key(scope, (epoch, generation)))
+    try:
+        next_generation = cache.incr(_generation_key(scope))
+    except ValueError:  # the counter was evicted since it was read
+        return
+    if current is None or next_generation != generation + 1:
+        # Another change came in between: the list is read from the table when it is needed
+        return
+    keys, complete = current
+    keys = [key for key in keys if key[1] not in removed]
+    for key in added:
+        if key in keys:  # already read from the table
+            continue
+        if not complete and (not keys or key < keys[0]):
+            # Older than the kept posts, it would hide the ones in between
+            continue
+        bisect.insort(keys, key)
+    if len(keys) > LENGTH:
+        complete = False
+    buffer = deque(keys, maxlen=LENGTH)
+    cache.set(_list_key(scope, (epoch, next_generation)), (tuple(buffer), complete), TIMEOUT)
+    _remember(scope, (epoch, next_generation), buffer, complete)
+
+
+def _change(added=None, removed=None):
+    """
+    Apply the change to the lists once the transaction commits.
+
+    Published earlier, a request reading the table before the commit would
+    store generation n + 1 without the change, or the transaction could roll
+    back with the change applied.
+    """
+    added, removed = added or {}, removed or {}
+
+    def publish():
+        for scope in {*added, *removed}:
+            _apply(scope, added.get(scope, []), removed.get(scope, set()))
+
+    transaction.on_commit(publish)
+
+
+def posts_added(posts):
+    added = defaultdict(list)
+    for post in posts:
+        for scope in post_scopes(post.author_id, post.group_id):
+            added[scope].append(post_key(post))
+    _change(added=added)
+
+
+def posts_removed(posts):
+    removed = defaultdict(set)
+    for post in posts:
+        for scope in post_scopes(post.author_id, post.group_id):
+            removed[scope].add(post.pk)
+    _change(removed=removed)
+
+
+def posts_moved(posts):
+    """
+    Move the posts between the group and author lists; _loaded_group_id and
+    _loaded_author_id are the group and the author they were loaded with.
+    """
+    added, removed = defaultdict(list), defaultdict(set)
+    for post in posts:
+        loaded_group_id = getattr(post, '_loaded_group_id', post.group_id)
+        if loaded_group_id != post.group_id:
+            if loaded_group_id is not None:
+                removed[group_scope(loaded_group_id)].add(post.pk)
+            if post.group_id is not None:
+                added[group_scope(post.group_id)].append(post_key(post))
+        loaded_author_id = getattr(post, '_loaded_author_id', post.author_id)
+        if loaded_author_id != post.author_id:
+            removed[author_scope(loaded_author_id)].add(post.pk)
+            added[author_scope(post.author_id)].append(post_key(post))
+    _change(added, removed)
+
+
+class FeedPaginator(CursorPaginator):
+    """
+    CursorPaginator of a feed with a list, ordered by ('-pub_date', '-id').
+
+    The first page is made of the newest keys of the list, loaded by one
+    range query from the oldest of them without ORDER BY (recent_rows()).
+    When the rows found are not the keys of the list, e.g. a post was written
+    around the lists, the list is discarded. Other pages, and first pages the
+    list cannot serve, are read as usual.
+    """
+
+    def __init__(self, scope, object_list, per_page):
+        super().__init__(object_list, per_page)
+        self.scope = scope
+
+    def first_page_rows(self):
+        """ Rows of the first page read by the list, or None when it cannot tell them. """
+        keys, complete = get_lists([self.scope])[self.scope]
+        if len(keys) <= self.per_page and not complete:
+            return None
+        keys = list(islice(reversed(keys), self.per_page + 1))
+        oldest = keys[-1] if len(keys) > self.per_page else None
+        rows = sorted(self.recent_rows(oldest), key=post_key, reverse=True)
+        if [post_key(row) for row in rows] != keys:
+            discard(self.scope)
+            return None
+        return rows
+
+    def recent_rows(self, oldest=None):
+        """
+        Rows of the page from its oldest key on, in no particular order. One
+        row more than the page is read, so a post missing from the list shows.
+        """
+        rows = self.object_list.order_by()
+        if oldest is not None:
+            date, post_id = oldest
+            rows = rows.filter(Q(pub_date__gt=date) | Q(pub_date=date, id__gte=post_id))
+        return rows[:self.per_page + 2]
+
+    def get_page(self, cursor=None):
+        if not cursor:
+            rows = self.first_page_rows()
+            if rows is not None:
+                return self._make_page(rows, None)
+        return super().get_page(cursor)
+
+
+class AuthorsPart:
+    """
+    Posts of several authors as a part of a paginator.MergedCursorPaginator with
+    the ('-feed_date', '-feed_id') ordering of the follow feed.
+
+    page_rows() returns placeholders holding only the keys; hydrate() replaces
+    the ones that made it to the page by their posts.
+    """
+
+    def __init__(self, author_ids, per_page, posts=None):
+        self.author_ids = author_ids
+        self.per_page = per_page
+        self.posts = Post.objects.all() if posts is None else posts
+
+    def page_rows(self, decoded, forward):
+        key = None
+        if decoded is not None:
+            date, post_id = decoded[1]
+            key = (parse_datetime(date), int(post_id))
+            if key[0] is None:
+                raise ValueError('Malformed cursor date.')
+        limit = self.per_page + 1
+        sources = []
+        lists = get_lists([author_scope(author_id) for author_id in self.author_ids])
+        for author_id in self.author_ids:
+            keys, complete = lists[author_scope(author_id)]
+            keys = list(keys)
+            if forward:
+                # Older than the cursor, newest first
+                end = len(keys) if key is None else bisect.bisect_left(keys, key)
+                rows = keys[max(end - limit, 0):end][::-1]
+                if len(rows) < limit and not complete:
+                    rows = list(self.older(author_id, key, limit))
+            elif not complete and (not keys or key < keys[0]):
+                # Newer than a cursor past the end of the list, oldest first
+                rows = list(self.newer(author_id, key, limit))
+            else:
+                # Newer than the cursor, oldest first; the newest posts are always in the list
+                start = bisect.bisect_right(keys, key)
+                rows = keys[start:start + limit]
+            sources.append(rows)
+        merged = heapq.merge(*sources, reverse=forward)
+        return [SimpleNamespace(feed_date=date, feed_id=post_id, placeholder=True)
+                for date, post_id in islice(merged, limit)]
+
+    @staticmethod
+    def older(author_id, key, limit):
+        """ Keys of the author's posts older than the key, read past the end of the list. """
+        posts = Post.objects.filter(author_id=author_id)
+        if key is not None:
+            posts = posts.filter(Q(pub_date__lt=key[0]) | Q(pub_date=key[0], id__lt=key[1]))
+        return posts.order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit]
+
+    @staticmethod
+    def newer(author_id, key, limit):
+        """ Keys of the author's posts newer than a key older than the list, oldest first. """
+        posts = Post.objects.filter(author_id=author_id)
+        posts = posts.filter(Q(pub_date__gt=key[0]) | Q(pub_date=key[0], id__gt=key[1]))
+        return posts.order_by('pub_date', 'id').values_list('pub_date', 'id')[:limit]
+
+    def hydrate(self, rows):
+        post_ids = [row.feed_id for row in rows if getattr(row, 'placeholder', False)]
+        if not post_ids:
+            return rows
+        found = self.posts.in_bulk(post_ids)
+        hydrated = []
+        for row in rows:
+            if getattr(row, 'placeholder', False):
+                post = found.get(row.feed_id)
+                if post is None or post.pub_date != row.feed_date:  # deleted after the list was read
+                    continue
+                post.feed_date, post.feed_id = row.feed_date, row.feed_id
+                row = post
+            hydrated.append(row)
+        return hydrated
@@ -0,0 +1,234 @@
+"""
+Full-text search of posts by their text and the text of their comments.
+
+The texts are kept in two SQLite FTS5 tables (migration 0017), an inverted
+index from every word to the rows containing it, so a query reads the lists of
+its words instead of scanning posts with LIKE '%...%':
+
+    posts_search_post       rowid = post id, text
+    posts_search_comment    rowid = comment id, text, post_id (not indexed)
+
+SQLite has no Russian stemmer, so documents and queries are reduced to word
+stems here (the Snowball algorithm for Russian) before FTS5 sees them:
+"зонтики" and "зонтиком" are both stored and searched as "зонтик". FTS5 only
+splits the stems by spaces.
+
+A post matches when its text or one of its comments contains all words of the
+query; results are ranked by BM25, a match in the post text weighing more than
+one in a comment. The index is updated by tasks (posts.tasks) queued by
+posts.signals and posts.bulk, so it follows the writes with the delay of the
+worker; `manage.py rebuild_search_index` rebuilds it from the tables.
+"""
+import re
+from functools import lru_cache
+
+from django.db import connection
+
+from .models import Comment, Post
+from .tasks import task
+
+POST_TABLE = 'posts_search_post'
+COMMENT_TABLE = 'posts_search_comment'
+# BM25 scores of post texts are multiplied by this, so they rank above equal matches in comments
+POST_WEIGHT = 2.0
+# Results beyond this rank are not returned: deep pages sort all matches again and nobody reads them
+MAX_RESULTS = 1000
+# Rows read and written per statement when the index is rebuilt
+BATCH_SIZE = 1000
+
+_WORD = re.compile(r'\w+')
+_CYRILLIC = re.compile(r'^[а-я]+$')
+
+# Snowball Russian stemmer, https://snowballstem.org/algorithms/russian/stemmer.html.
+# Every step is a list of (endings, whether the ending must follow "а" or "я").
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = [(('в', 'вши', 'вшись'), True),
+                      (('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'), False)]
+_ADJECTIVE = [(('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'его', 'ого',
+                'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'), False)]
+_PARTICIPLE = [(('ем', 'нн', 'вш', 'ющ', 'щ'), True),
+               (('ивш', 'ывш', 'ующ'), False)]
+_REFLEXIVE = [(('ся', 'сь'), False)]
+_VERB = [(('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'), True),
+         (('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило',
+           'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'), False)]
+_NOUN = [(('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+           'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья',
+           'я'), False)]
+_DERIVATIONAL = ('ост', 'ость')
+_SUPERLATIVE = [(('ейш', 'ейше'), False)]
+
+
+def _strip(word, groups):
+    """ The word without its longest ending of the groups, or None when it has none. """
+    found = None
+    for endings, after_a in groups:
+        for ending in endings:
+            if word.endswith(ending) and (found is None or len(ending) > len(found[0])):
+                found = (ending, after_a)
+    if found is None:
+        return None
+    ending, after_a = found
+    stem = word[:-len(ending)]
+    if after_a and not stem.endswith(('а', 'я')):
+        return None
+    return stem
+
+
+def _region(word, start):
+    """ Position after the first non-vowel following a vowel, both at or after start. """
+    for i in range(start + 1, len(word)):
+        if word[i - 1] in _VOWELS and word[i] not in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """ Stem of a lowercase Russian word. """
+    word = word.replace('ё', 'е')
+    rv_start = next((i + 1 for i, letter in enumerate(word) if letter in _VOWELS), len(word))
+    r2_start = _region(word, _region(word, 0))
+    # All endings are removed from RV, the part after the first vowel
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Step 1
+    stripped = _strip(rv, _PERFECTIVE_GERUND)
+    if stripped is None:
+        reflexive = _strip(rv, _REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        stripped = _strip(rv, _ADJECTIVE)
+        if stripped is not None:
+            participle = _strip(stripped, _PARTICIPLE)
+            stripped = stripped if participle is None else participle
+        else:
+            stripped = _strip(rv, _VERB)
+            if stripped is None:
+                stripped = _strip(rv, _NOUN)
+    if stripped is not None:
+        rv = stripped
+    # Step 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    # Step 3: derivational endings only from R2
+    for ending in _DERIVATIONAL:
+        if rv.endswith(ending) and rv_start + len(rv) - len(ending) >= r2_start:
+            rv = rv[:-len(ending)]
+            break
+    # Step 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _strip(rv, _SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith('нн') else superlative
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def terms(text):
+    """ Index terms of a text: stems of Russian words, other words (numbers, Latin) as they are. """
+    result = []
+    for word in _WORD.findall(text.lower()):
+        word = word.replace('ё', 'е')
+        result.append(stem(word) if _CYRILLIC.match(word) else word)
+    return result
+
+
+def normalize(text):
+    """ The text as it is stored in the index. """
+    return ' '.join(terms(text))
+
+
+def match_expression(query):
+    """ FTS5 query matching the rows that contain all words of the query, or None when it has no words. """
+    words = dict.fromkeys(terms(query))
+    if not words:
+        return None
+    # Every term is quoted, so words like AND, NOT or NEAR are searched rather than parsed as operators
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def search(query, offset=0, limit=20):
+    """ Ids of the posts matching the query, best first. """
+    expression = match_expression(query)
+    limit = min(limit, MAX_RESULTS - offset)
+    if expression is None or limit <= 0:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT post_id FROM ('
+            f' SELECT rowid AS post_id, bm25({POST_TABLE}) * %s AS score FROM {POST_TABLE}'
+            f' WHERE {POST_TABLE} MATCH %s'
+            f' UNION ALL'
+            f' SELECT post_id, bm25({COMMENT_TABLE}) AS score FROM {COMMENT_TABLE}'
+            f' WHERE {COMMENT_TABLE} MATCH %s'
+            f') GROUP BY post_id ORDER BY min(score), post_id DESC LIMIT %s OFFSET %s',
+            [POST_WEIGHT, expression, expression, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def find(query, offset=0, limit=20, posts=None):
+    """ Posts matching the query, best first, read with the posts queryset. """
+    post_ids = search(query, offset, limit)
+    found = (Post.objects.all() if posts is None else posts).in_bulk(post_ids)
+    # A post deleted before its index task ran is skipped
+    return [found[pk] for pk in post_ids if pk in found]
+
+
+def _write(table, ids, rows, columns):
+    """ Replace the index rows with the rowids by the rows (rowid, *columns) that still exist. """
+    placeholders = ', '.join(['%s'] * (len(columns) + 1))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {table} WHERE rowid = %s', [(pk,) for pk in ids])
+        cursor.executemany(f'INSERT INTO {table} (rowid, {", ".join(columns)}) VALUES ({placeholders})', rows)
+
+
+def _post_rows(posts):
+    return [(pk, normalize(text)) for pk, text in posts.values_list('pk', 'text')]
+
+
+def _comment_rows(comments):
+    return [(pk, normalize(text), post_id) for pk, text, post_id in comments.values_list('pk', 'text', 'post_id')]
+
+
+@task
+def index_posts(post_ids):
+    """ Task bringing the index rows of the posts up to date; deleted posts are removed from the index. """
+    _write(POST_TABLE, post_ids, _post_rows(Post.objects.filter(pk__in=post_ids)), ['text'])
+
+
+@task
+def index_comments(comment_ids):
+    """ Task bringing the index rows of the comments up to date; deleted comments are removed from the index. """
+    _write(COMMENT_TABLE, comment_ids, _comment_rows(Comment.objects.filter(pk__in=comment_ids)), ['text', 'post_id'])
+
+
+@task
+def rebuild_index():
+    """ Task of rebuild(), queued by the migration that creates the index. """
+    rebuild()
+
+
+def rebuild():
+    """ Index all posts and comments again; returns the numbers of indexed posts and comments. """
+    counts = []
+    for table, model, rows, columns in ((POST_TABLE, Post, _post_rows, ['text']),
+                                        (COMMENT_TABLE, Comment, _comment_rows, ['text', 'post_id'])):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table}')
+        count = last = 0
+        while True:
+            batch = rows(model.objects.filter(pk__gt=last).order_by('pk')[:BATCH_SIZE])
+            if not batch:
+                break
+            _write(table, [], batch, columns)
+            count += len(batch)
+            last = batch[-1][0]
+        with connection.cursor() as cursor:
+            # Merge the segments written by the batches into one b-tree per term
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+        counts.append(count)
+    return tuple(counts)
@@ -4,7 +4,17 @@ from rest_framework.validators import UniqueTogetherValidator
 from .models import User, Post, Comment, Follow, Group
 
 
-class PostSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """ Serialize only the given subset of fields: PostSerializer(posts, many=True, fields=['id', 'text']). """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = serializers.ReadOnlyField(source='author.username')
 
     class Meta:
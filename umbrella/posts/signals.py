@@ -0,0 +1,124 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import caching, counters, live, recent, search, tasks, thumbnails, timeline
+from .models import Post, Comment, Follow, Group, User, UserStats
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    elif update_fields is None or set(update_fields) != {'last_login'}:
+        # Names are shown on the profile page, the feeds and the posts and comments of the API
+        posts = Post.objects.filter(author=instance).order_by().values_list('pk', 'group_id')
+        commented = Comment.objects.filter(author=instance).order_by().values_list('post_id', flat=True).distinct()
+        caching.invalidate(caching.INDEX, caching.profile_scope(instance.pk),
+                           *(caching.group_scope(group_id) for _, group_id in posts if group_id),
+                           *(caching.post_scope(post_id) for post_id, _ in posts),
+                           *(caching.post_scope(post_id) for post_id in commented))
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, raw=False, **kwargs):
+    # A new or replaced image has no thumbnails yet
+    if not raw and (instance.image.name or None) != getattr(instance, '_loaded_image', None):
+        instance.thumbnail_ready = False
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.image and not instance.thumbnail_ready:
+        thumbnails.schedule(instance.pk)
+    instance._loaded_image = instance.image.name or None
+    if instance.text != getattr(instance, '_loaded_text', None):
+        tasks.enqueue(search.index_posts, [instance.pk])
+    instance._loaded_text = instance.text
+    scopes = [*caching.post_scopes(instance.author_id, instance.group_id), caching.post_scope(instance.pk)]
+    if created:
+        counters.change_user_stats(instance.author_id, post_count=1)
+        # Fan the new post out to the followers of its author
+        tasks.enqueue(timeline.fan_out, [instance.pk])
+        live.publish_posts([instance])
+        recent.posts_added([instance])
+    else:
+        if getattr(instance, '_loaded_group_id', None) is not None:
+            scopes.append(caching.group_scope(instance._loaded_group_id))
+        if getattr(instance, '_loaded_author_id', None) not in (None, instance.author_id):
+            scopes.append(caching.profile_scope(instance._loaded_author_id))
+        recent.posts_moved([instance])
+    instance._loaded_group_id = instance.group_id
+    instance._loaded_author_id = instance.author_id
+    caching.invalidate(*scopes)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, post_count=-1)
+    tasks.enqueue(search.index_posts, [instance.pk])
+    recent.posts_removed([instance])
+    caching.invalidate(*caching.post_scopes(instance.author_id, instance.group_id), caching.post_scope(instance.pk))
+
+
+def _comment_changed(comment):
+    # The number of comments is shown on the post card in every feed of the post
+    try:
+        post = comment.post
+    except ObjectDoesNotExist:  # the post is being deleted together with its comments
+        return
+    caching.invalidate(*caching.post_scopes(post.author_id, post.group_id), caching.post_scope(post.pk))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    tasks.enqueue(search.index_comments, [instance.pk])
+    if created:
+        counters.change_comment_count(instance.post_id, 1)
+        _comment_changed(instance)
+    else:
+        Post.objects.filter(pk=instance.post_id).touch()
+        # Comment texts are shown only with their post
+        caching.invalidate(caching.post_scope(instance.post_id))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_comment_count(instance.post_id, -1)
+    tasks.enqueue(search.index_comments, [instance.pk])
+    _comment_changed(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_stats(instance.user_id, following_count=1)
+        counters.change_user_stats(instance.author_id, follower_count=1)
+        tasks.enqueue(timeline.backfill, instance.user_id, instance.author_id)
+        caching.invalidate(caching.profile_scope(instance.user_id), caching.profile_scope(instance.author_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_stats(instance.user_id, following_count=-1)
+    counters.change_user_stats(instance.author_id, follower_count=-1)
+    timeline.trim(instance.user_id, instance.author_id)
+    timeline.follower_removed(instance.author_id)
+    caching.invalidate(caching.profile_scope(instance.user_id), caching.profile_scope(instance.author_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # The group title is shown on the cards of its posts in the index and on the authors' profiles
+    authors = Post.objects.filter(group=instance).order_by().values_list('author_id', flat=True).distinct()
+    caching.invalidate(caching.INDEX, caching.group_scope(instance.pk),
+                       *(caching.profile_scope(author_id) for author_id in authors))
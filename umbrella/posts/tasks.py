@@ -0,0 +1,157 @@
+"""
+Durable background tasks stored in the database.
+
+Side effects that may take long (follow feed fan-out, thumbnails) are not run
+by the request that causes them. The request inserts a Task row in its own
+transaction, so the task exists exactly when the write is committed, and a
+worker (manage.py run_tasks) runs it later:
+
+    @task
+    def fan_out(post_ids):
+        ...
+
+    tasks.enqueue(fan_out, [post.pk])
+
+Arguments must be JSON-serializable, so tasks take ids rather than model
+instances and re-read the rows they need. A failed task is retried with
+exponential backoff up to its max_attempts; the finished rows keep the
+duration of every task for RETENTION, which stats() summarizes per task name.
+
+With settings.TASKS_EAGER the task runs in the process instead, e.g. in
+development without a worker, once the transaction of the request commits like
+a worker would see it.
+"""
+import datetime
+import json
+import logging
+import time
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Delay of the first retry, seconds; doubled after every further failure
+RETRY_DELAY = 10
+# A running task whose worker has not finished it for this long is run again, seconds
+STALE_AFTER = 10 * 60
+# Finished tasks are kept for the statistics this long, seconds
+RETENTION = 24 * 60 * 60
+# Due tasks claimed by a worker per query
+BATCH_SIZE = 100
+
+
+def task(func=None, *, max_attempts=5):
+    """ Register a function as a task, so that workers agree to run it by name. """
+    def register(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        return func
+    return register if func is None else register(func)
+
+
+def enqueue(func, *args, delay=0):
+    """
+    Run func(*args) in a worker once the current transaction commits; with
+    TASKS_EAGER in this process right after the commit, ignoring the delay.
+    """
+    if getattr(settings, 'TASKS_EAGER', False):
+        transaction.on_commit(lambda: func(*args))
+        return None
+    return Task.objects.create(name=func.task_name, args=list(args), max_attempts=func.max_attempts,
+                               run_at=timezone.now() + datetime.timedelta(seconds=delay))
+
+
+def resolve(name):
+    func = import_string(name)
+    if getattr(func, 'task_name', None) != name:
+        raise ValueError(f'{name} is not a registered task')
+    return func
+
+
+def _claim(task_id):
+    """ Mark a queued task as running; False when another worker has claimed it first. """
+    return Task.objects.filter(pk=task_id, status=Task.QUEUED).update(
+        status=Task.RUNNING, attempts=F('attempts') + 1, started=timezone.now()) == 1
+
+
+def run(task_row):
+    """ Run a claimed task and record its outcome. """
+    started = time.perf_counter()
+    try:
+        func = resolve(task_row.name)
+        with transaction.atomic():
+            func(*task_row.args)
+    except Exception:
+        duration = time.perf_counter() - started
+        logger.exception('Task %s%s failed', task_row.name, tuple(task_row.args))
+        changes = {'duration': duration, 'error': traceback.format_exc()}
+        if task_row.attempts >= task_row.max_attempts:
+            changes.update(status=Task.FAILED, finished=timezone.now())
+        else:
+            delay = RETRY_DELAY * 2 ** (task_row.attempts - 1)
+            changes.update(status=Task.QUEUED, run_at=timezone.now() + datetime.timedelta(seconds=delay))
+    else:
+        duration = time.perf_counter() - started
+        changes = {'status': Task.DONE, 'finished': timezone.now(), 'duration': duration, 'error': ''}
+    Task.objects.filter(pk=task_row.pk).update(**changes)
+    logger.info(json.dumps({'task': task_row.name, 'status': changes['status'], 'attempt': task_row.attempts,
+                            'ms': round(duration * 1000, 1)}))
+    return changes['status']
+
+
+def due_tasks():
+    return Task.objects.filter(status=Task.QUEUED, run_at__lte=timezone.now()).order_by('run_at', 'id')
+
+
+def run_pending(limit=None):
+    """ Run the tasks that are due, oldest first; returns the number of tasks run. """
+    count = 0
+    while limit is None or count < limit:
+        task_ids = list(due_tasks().values_list('id', flat=True)[:BATCH_SIZE])
+        if not task_ids:
+            break
+        for task_id in task_ids:
+            if limit is not None and count >= limit:
+                break
+            if _claim(task_id):
+                run(Task.objects.get(pk=task_id))
+                count += 1
+    return count
+
+
+def requeue_stale():
+    """ Queue again the tasks of workers that were killed while running them. """
+    stale = timezone.now() - datetime.timedelta(seconds=STALE_AFTER)
+    return Task.objects.filter(status=Task.RUNNING, started__lt=stale).update(status=Task.QUEUED)
+
+
+def purge():
+    """ Delete the finished tasks that are older than RETENTION. """
+    old = timezone.now() - datetime.timedelta(seconds=RETENTION)
+    return Task.objects.filter(status=Task.DONE, finished__lt=old).delete()[0]
+
+
+def stats():
+    """ Per task name: the number of tasks in every status, the durations and the wait of the oldest queued one. """
+    rows = Task.objects.values('name').order_by('name').annotate(
+        queued=Count('id', filter=Q(status=Task.QUEUED)),
+        running=Count('id', filter=Q(status=Task.RUNNING)),
+        done=Count('id', filter=Q(status=Task.DONE)),
+        failed=Count('id', filter=Q(status=Task.FAILED)),
+        retried=Count('id', filter=Q(attempts__gt=1)),
+        avg_duration=Avg('duration', filter=Q(status=Task.DONE)),
+        max_duration=Max('duration', filter=Q(status=Task.DONE)),
+        oldest_queued=Min('created', filter=Q(status=Task.QUEUED)),
+    )
+    now = timezone.now()
+    for row in rows:
+        oldest = row.pop('oldest_queued')
+        row['lag'] = (now - oldest).total_seconds() if oldest else None
+    return list(rows)
@@ -0,0 +1,20 @@
+from django import template
+from django.templatetags.static import static
+
+from .. import thumbnails
+
+register = template.Library()
+
+
+@register.filter
+def is_author(post, user):
+    """ Whether the user wrote the post: the edit link is shown only to the author. """
+    return post.author_id == user.pk
+
+
+@register.simple_tag
+def post_image_url(post, rendition):
+    """ URL of the image rendition, or of a placeholder while the thumbnails are being generated. """
+    if not post.thumbnail_ready:
+        return static('img/post_placeholder.svg')
+    return thumbnails.get_rendition(post.image, rendition).url
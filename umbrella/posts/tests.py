@@ -8,10 +8,37 @@
 # Каждый отдельный метод в наборе тестов должен начинаться со слова test
 # таких методов-тестов в наборе может быть множество.
 
-from django.test import TestCase, Client
+import asyncio
+import base64
+import json
+import tempfile
+import time
+from collections import namedtuple
+from datetime import timedelta
+from io import BytesIO, StringIO
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-from posts.models import Post, Group, User, Follow
+from api.async_views import AsyncCommentView, AsyncGroupView, AsyncPostView
+from benchmarks import report, routes, runner, transports
+from posts import bulk, caching, counters, detail, live, recent, search, tasks, thumbnails, timeline
+from posts.models import Post, Group, User, Follow, Comment, Task, TimelineEntry, UserStats
+from posts.query_plans import plan_problems
 
 
 def get_post_urls(user):
@@ -181,6 +208,7 @@ class CacheTest(TestCase):
                                                        'email': 'test@mail.com'})
 
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.signup_test_user()
         self.user = User.objects.get(username='test_user')
@@ -188,13 +216,47 @@ class CacheTest(TestCase):
 
     def test_cache_index_page(self):
         ugly_text = 'Test cache.-24$-41a-'
-        # Первый запрос на главную страницу, кэш сохраняется на 20 секунд.
-        self.client.get(path=reverse('index'))
+        guest = Client()
+        # Первый запрос гостя на главную страницу сохраняет ее в кэш.
+        guest.get(path=reverse('index'))
+        response = guest.get(path=reverse('index'))
+        # Второй запрос отдается из кэша: шаблон не рендерится.
+        self.assertIsNone(response.context)
+        # Новая запись сбрасывает кэш ленты, поэтому гость сразу ее видит.
         self.client.post(path=reverse('post_new'), data={'text': ugly_text})
-        # Второй запрос, следующий сразу за первым, поэтому новой записи не будет.
-        response = self.client.get(path=reverse('index'))
-        # self.assertNotContains(response, ugly_text)
-        # При включенном кеше ломаются другие тесты.
+        response = guest.get(path=reverse('index'))
+        self.assertContains(response, ugly_text)
+
+    # Кэшируются только ленты, затронутые изменением: запись без группы не сбрасывает кэш группы.
+    def test_cache_invalidates_only_affected_feeds(self):
+        group = Group.objects.create(title='Test Group', slug='test', description='Test description.')
+        guest = Client()
+        group_url = reverse('group', kwargs={'slug': 'test'})
+        profile_url = reverse('profile', kwargs={'username': 'test_user'})
+        guest.get(group_url)
+        guest.get(profile_url)
+
+        self.client.post(path=reverse('post_new'), data={'text': 'Без группы'})
+        self.assertIsNone(guest.get(group_url).context)
+        self.assertContains(guest.get(profile_url), 'Без группы')
+
+        # Переименование группы обновляет ее страницу и карточки ее записей
+        self.client.post(path=reverse('post_new'), data={'text': 'В группе', 'group': group.pk})
+        guest.get(reverse('index'))
+        group.title = 'Renamed Group'
+        group.save()
+        self.assertContains(guest.get(group_url), 'Renamed Group')
+        self.assertContains(guest.get(reverse('index')), 'Renamed Group')
+
+    # Новый комментарий обновляет счетчик комментариев в закэшированной ленте.
+    def test_cache_comment_updates_feed(self):
+        self.client.post(path=reverse('post_new'), data={'text': 'Запись'})
+        post = Post.objects.get(author=self.user)
+        guest = Client()
+        self.assertContains(guest.get(reverse('index')), 'Добавить комментарий')
+        self.client.post(reverse('add_comment', kwargs={'username': 'test_user', 'post_id': post.pk}),
+                         {'text': 'Комментарий'})
+        self.assertContains(guest.get(reverse('index')), '1 комментариев')
 
 
 class FollowTest(TestCase):
@@ -240,6 +302,8 @@ class FollowTest(TestCase):
         self.client_garry.post(path=reverse('profile_follow', kwargs={'username': 'arnold'}))
         # Арнольд выкладывает новый пост.
         self.client_arnold.post(path=reverse('post_new'), data={'text': 'Привет Гарри =)'})
+        # Воркер раскладывает пост по лентам подписчиков.
+        tasks.run_pending()
         # Новый пост Арнольда видно на странице подписок у Гарри.
         response = self.client_garry.get(path=reverse('follow_index'))
         self.assertContains(response=response, text='Привет Гарри =)')
@@ -275,3 +339,1425 @@ class FollowTest(TestCase):
         # Арнольд НЕ видит новых комментариев Гарри под своим постом.
         response = self.client_arnold.get(path=reverse('post', kwargs={'username': 'arnold', 'post_id': 1}))
         self.assertNotContains(response=response, text='Здравствуй, Арнольд.')
+
+    # Записи, опубликованные до подписки, попадают в ленту подписок (backfill).
+    def test_old_posts_appear_after_follow(self):
+        self.client_arnold.post(path=reverse('post_new'), data={'text': 'Старая запись'})
+        self.client_garry.post(path=reverse('profile_follow', kwargs={'username': 'arnold'}))
+        tasks.run_pending()
+        response = self.client_garry.get(path=reverse('follow_index'))
+        self.assertContains(response=response, text='Старая запись')
+
+    # После отписки записи автора пропадают из ленты подписок.
+    def test_posts_disappear_after_unfollow(self):
+        self.client_garry.post(path=reverse('profile_follow', kwargs={'username': 'arnold'}))
+        self.client_arnold.post(path=reverse('post_new'), data={'text': 'Привет Гарри =)'})
+        self.client_garry.post(path=reverse('profile_unfollow', kwargs={'username': 'arnold'}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user_garry).exists())
+        response = self.client_garry.get(path=reverse('follow_index'))
+        self.assertNotContains(response=response, text='Привет Гарри =)')
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='test_user', password='Hgj-15Jkf324-tu')
+        for number in range(23):
+            Post.objects.create(author=self.user, text=f'Запись номер {number:02d}.')
+
+    def walk(self, url, cursor_name):
+        """ Проходит по страницам ленты по курсорам и возвращает список страниц. """
+        pages = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            page = response.context['page']
+            pages.append([post.pk for post in page])
+            cursor = getattr(page, cursor_name)
+            if cursor is None:
+                return pages, page
+
+    # Переход по курсорам вперед показывает каждую запись ровно один раз, от новых к старым.
+    def test_index_pages_cover_all_posts(self):
+        pages, _ = self.walk(reverse('index'), 'next_cursor')
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual([len(page) for page in pages], [10, 10, 3])
+        self.assertEqual(ids, list(Post.objects.order_by('-pub_date', '-id').values_list('id', flat=True)))
+
+    # Кнопка «Предыдущая» возвращает на ту же страницу, что была раньше.
+    def test_previous_cursor_returns_same_page(self):
+        first = self.client.get(reverse('index')).context['page']
+        second = self.client.get(reverse('index'), {'cursor': first.next_cursor}).context['page']
+        back = self.client.get(reverse('index'), {'cursor': second.previous_cursor}).context['page']
+        self.assertEqual([post.pk for post in back], [post.pk for post in first])
+        self.assertFalse(back.has_previous())
+
+    # Испорченный курсор не ломает страницу, а показывает первую страницу.
+    def test_broken_cursor_shows_first_page(self):
+        response = self.client.get(reverse('profile', kwargs={'username': 'test_user'}), {'cursor': 'broken!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Запись номер 22.')
+
+    # Курсор с id за пределами 64-битного целого тоже считается испорченным.
+    def test_cursor_with_huge_id_shows_first_page(self):
+        date = Post.objects.first().pub_date.isoformat()
+        for value in (2 ** 64, 10 ** 400):
+            cursor = base64.urlsafe_b64encode(json.dumps(['n', date, value]).encode()).decode()
+            response = self.client.get(reverse('index'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.context['page'].has_previous())
+            response = self.client.get('/api/v1/posts/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+
+
+class FeedQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='test_user', password='Hgj-15Jkf324-tu')
+        self.reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        self.group = Group.objects.create(title='Test Group', slug='test', description='Test description.')
+        Follow.objects.create(user=self.reader, author=self.user)
+
+    def add_posts(self, count):
+        # Списки последних записей меняются после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(count):
+                post = Post.objects.create(author=self.user, group=self.group, text=f'Запись {number}.')
+                Comment.objects.create(post=post, author=self.reader, text='Комментарий.')
+
+    def count_queries(self, url):
+        # Первый запрос читает из базы список последних записей ленты (posts.recent)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context)
+
+    # Количество запросов к базе на страницу ленты не зависит от числа записей на ней.
+    def test_feed_queries_do_not_grow_with_posts(self):
+        self.client.force_login(self.reader)
+        urls = (
+            reverse('index'),
+            reverse('group', kwargs={'slug': 'test'}),
+            reverse('profile', kwargs={'username': 'test_user'}),
+            reverse('follow_index'),
+        )
+        self.add_posts(1)
+        few = [self.count_queries(url) for url in urls]
+        self.add_posts(9)
+        many = [self.count_queries(url) for url in urls]
+        self.assertEqual(few, many)
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        self.client.force_login(self.reader)
+        self.api = APIClient()
+        self.api.force_authenticate(self.author)
+
+    def assertStats(self, user, posts, followers, followings):
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual((stats.post_count, stats.follower_count, stats.following_count),
+                         (posts, followers, followings))
+
+    # Счетчики подписок меняются при подписке и отписке.
+    def test_follow_counters(self):
+        self.client.get(reverse('profile_follow', kwargs={'username': 'author'}))
+        self.assertStats(self.author, 0, 1, 0)
+        self.assertStats(self.reader, 0, 0, 1)
+        self.client.get(reverse('profile_unfollow', kwargs={'username': 'author'}))
+        self.assertStats(self.author, 0, 0, 0)
+        self.assertStats(self.reader, 0, 0, 0)
+
+    # Счетчики записей и комментариев меняются при работе через API и отображаются на страницах.
+    def test_post_and_comment_counters(self):
+        response = self.api.post('/api/v1/posts/', {'text': 'Запись через API'})
+        post_id = response.data['id']
+        self.client.post(reverse('add_comment', kwargs={'username': 'author', 'post_id': post_id}),
+                         {'text': 'Комментарий'})
+        self.assertStats(self.author, 1, 0, 0)
+        self.assertEqual(Post.objects.get(pk=post_id).comment_count, 1)
+        response = self.client.get(reverse('post', kwargs={'username': 'author', 'post_id': post_id}))
+        self.assertContains(response, 'Записей: 1')
+        self.assertContains(response, '1 комментариев')
+
+        # Редактирование записи не затирает счетчик комментариев
+        self.api.patch(f'/api/v1/posts/{post_id}/', {'text': 'Исправленная запись'})
+        self.assertEqual(Post.objects.get(pk=post_id).comment_count, 1)
+
+        self.api.delete(f'/api/v1/posts/{post_id}/')
+        self.assertStats(self.author, 0, 0, 0)
+
+    # Команда recount_stats восстанавливает испорченные счетчики.
+    def test_recount_command(self):
+        post = Post.objects.create(author=self.author, text='Запись')
+        Comment.objects.create(post=post, author=self.reader, text='Комментарий')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.update(comment_count=5)
+        UserStats.objects.update(post_count=7, follower_count=7, following_count=7)
+
+        call_command('recount_stats', stdout=StringIO())
+        self.assertEqual(Post.objects.get(pk=post.pk).comment_count, 1)
+        self.assertStats(self.author, 1, 1, 0)
+        self.assertStats(self.reader, 0, 0, 1)
+
+
+@override_settings(CACHES={
+    # Два воркера: у каждого свой локальный кэш L1 и общий кэш L2
+    'worker_a': {'BACKEND': 'umbrella.cache.TieredCache',
+                 'OPTIONS': {'LOCAL': 'local_a', 'SHARED': 'shared', 'SHARED_ONLY_PREFIXES': ['version:']}},
+    'worker_b': {'BACKEND': 'umbrella.cache.TieredCache',
+                 'OPTIONS': {'LOCAL': 'local_b', 'SHARED': 'shared', 'SHARED_ONLY_PREFIXES': ['version:']}},
+    'local_a': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'local_a'},
+    'local_b': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'local_b'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+})
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        for alias in ('local_a', 'local_b', 'shared'):
+            caches[alias].clear()
+        self.worker_a = caches['worker_a']
+        self.worker_b = caches['worker_b']
+
+    # Значение, записанное одним воркером, видно другому через общий кэш и попадает в его L1.
+    def test_value_is_shared_between_workers(self):
+        self.worker_a.set('page', 'content')
+        self.assertEqual(self.worker_b.get('page'), 'content')
+        self.assertEqual(caches['local_b'].get('page'), 'content')
+        self.assertEqual(self.worker_b.get_many(['page', 'missing']), {'page': 'content'})
+
+    # Ключи версий не кэшируются локально, поэтому сброс версии сразу виден всем воркерам.
+    def test_shared_only_keys_bypass_local_cache(self):
+        self.worker_a.set('version:index', 1)
+        self.assertEqual(self.worker_b.get('version:index'), 1)
+        self.worker_a.set('version:index', 2)
+        self.assertEqual(self.worker_b.get('version:index'), 2)
+        self.assertIsNone(caches['local_b'].get('version:index'))
+
+    # Удаление и счетчики работают с общим кэшем.
+    def test_delete_and_incr(self):
+        self.worker_a.set('counter', 1)
+        self.assertEqual(self.worker_b.get('counter'), 1)
+        self.assertEqual(self.worker_a.incr('counter'), 2)
+        self.worker_b.delete('counter')
+        self.assertIsNone(self.worker_a.get('counter'))
+
+
+class ApiPostsListTest(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.other = User.objects.create_user(username='other', password='Hgj-15Jkf324-tu')
+        self.group = Group.objects.create(title='Test Group', slug='test', description='Test description.')
+        for number in range(5):
+            Post.objects.create(author=self.author, group=self.group, text=f'Запись {number}')
+        Post.objects.create(author=self.other, text='Чужая запись')
+
+    # Список постов отдается страницами, переход по ссылке next возвращает следующую страницу.
+    def test_posts_are_paginated(self):
+        response = self.api.get('/api/v1/posts/', {'limit': 4})
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertIsNone(response.data['previous'])
+        response = self.api.get(response.data['next'])
+        self.assertEqual([post['text'] for post in response.data['results']], ['Запись 1', 'Запись 0'])
+        self.assertIsNone(response.data['next'])
+
+    # Фильтры по группе, автору и дате публикации.
+    def test_posts_filters(self):
+        response = self.api.get('/api/v1/posts/', {'group': self.group.pk})
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.api.get('/api/v1/posts/', {'author': 'other'})
+        self.assertEqual([post['text'] for post in response.data['results']], ['Чужая запись'])
+        since = Post.objects.get(text='Запись 3').pub_date.isoformat()
+        response = self.api.get('/api/v1/posts/', {'since': since})
+        self.assertEqual([post['text'] for post in response.data['results']], ['Чужая запись', 'Запись 4'])
+        response = self.api.get('/api/v1/posts/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        # Надстрочная цифра и слишком большое число — не id группы
+        for group in ('²', str(2 ** 63)):
+            self.assertEqual(self.api.get('/api/v1/posts/', {'group': group}).status_code, 400)
+
+    # Параметр fields оставляет в ответе только запрошенные поля.
+    def test_posts_sparse_fields(self):
+        response = self.api.get('/api/v1/posts/', {'fields': 'id,text', 'limit': 1})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'text'})
+        response = self.api.get('/api/v1/posts/', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ApiExportTest(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.api.force_authenticate(self.author)
+        self.first = Post.objects.create(author=self.author, text='Первая')
+        self.second = Post.objects.create(author=self.author, text='Вторая')
+        Comment.objects.create(post=self.first, author=self.author, text='Комментарий')
+
+    def export(self, **params):
+        response = self.api.get('/api/v1/export/', params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    # Экспорт отдает все записи построчно, с комментариями по запросу.
+    def test_export_posts_with_comments(self):
+        lines = self.export(comments=1)
+        # Комментарий изменил первую запись позже, чем была создана вторая
+        self.assertEqual([line['text'] for line in lines], ['Вторая', 'Первая'])
+        self.assertEqual([comment['text'] for comment in lines[1]['comments']], ['Комментарий'])
+        self.assertNotIn('comments', self.export()[0])
+
+    # Отметка updated последней строки служит началом следующей выгрузки: в нее попадают только изменения.
+    def test_export_since_watermark(self):
+        watermark = self.export()[-1]['updated']
+        self.assertEqual(self.export(since=watermark), [])
+        self.first.text = 'Первая, исправленная'
+        self.first.save()
+        self.assertEqual([line['text'] for line in self.export(since=watermark)], ['Первая, исправленная'])
+
+    # Курсор строки продолжает выгрузку и внутри пакета записей с одинаковым updated.
+    def test_export_cursor_within_bulk_update(self):
+        third = Post.objects.create(author=self.author, text='Третья')
+        response = self.api.patch('/api/v1/posts/bulk/', [{'id': post.pk, 'text': f'Пакет {post.pk}'}
+                                                           for post in (self.first, self.second, third)], format='json')
+        self.assertEqual([item['status'] for item in response.data], [200] * 3)
+        lines = self.export()
+        self.assertEqual(len({line['updated'] for line in lines}), 1)
+        resumed = self.export(cursor=lines[0]['cursor'])
+        self.assertEqual([line['id'] for line in resumed], [line['id'] for line in lines[1:]])
+        self.assertEqual(self.export(cursor=lines[-1]['cursor']), [])
+        self.assertEqual(self.api.get('/api/v1/export/', {'cursor': 'broken'}).status_code, 400)
+        huge = base64.urlsafe_b64encode(json.dumps(['n', lines[0]['updated'], 2 ** 64]).encode()).decode()
+        self.assertEqual(self.api.get('/api/v1/export/', {'cursor': huge}).status_code, 400)
+
+    # Новый, измененный или удаленный комментарий снова выгружает свою запись.
+    def test_export_after_comment_changes(self):
+        cursor = self.export(comments=1)[-1]['cursor']
+        comment = Comment.objects.create(post=self.first, author=self.author, text='Новый комментарий')
+        lines = self.export(comments=1, cursor=cursor)
+        self.assertEqual([line['text'] for line in lines], ['Первая'])
+        self.assertEqual([item['text'] for item in lines[0]['comments']], ['Комментарий', 'Новый комментарий'])
+
+        cursor = lines[-1]['cursor']
+        comment.text = 'Исправленный комментарий'
+        comment.save()
+        cursor, = [line['cursor'] for line in self.export(cursor=cursor)]
+        comment.delete()
+        self.assertEqual([line['text'] for line in self.export(cursor=cursor)], ['Первая'])
+
+
+class ApiBulkTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.api.force_authenticate(self.author)
+
+    # Пакет постов создается одним запросом, ошибки валидации возвращаются для каждого элемента отдельно.
+    def test_bulk_create_posts(self):
+        response = self.api.post('/api/v1/posts/bulk/', [{'text': 'Первый'}, {}, {'text': 'Второй'}], format='json')
+        self.assertEqual([item['status'] for item in response.data], [201, 400, 201])
+        self.assertEqual(response.data[2]['data']['text'], 'Второй')
+        # Побочные эффекты обычного создания: счетчики и лента подписчиков (через очередь задач)
+        self.assertEqual(UserStats.objects.get(user=self.author).post_count, 2)
+        tasks.run_pending()
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 2)
+
+    # Пакетное изменение и удаление разрешены только для своих постов.
+    def test_bulk_update_and_delete_posts(self):
+        own = Post.objects.create(author=self.author, text='Свой')
+        alien = Post.objects.create(author=self.reader, text='Чужой')
+        response = self.api.patch('/api/v1/posts/bulk/', [{'id': own.pk, 'text': 'Исправлен'},
+                                                          {'id': alien.pk, 'text': 'Взломан'},
+                                                          {'id': 100500, 'text': 'Нет такого'}], format='json')
+        self.assertEqual([item['status'] for item in response.data], [200, 403, 404])
+        self.assertEqual(Post.objects.get(pk=own.pk).text, 'Исправлен')
+        self.assertEqual(Post.objects.get(pk=alien.pk).text, 'Чужой')
+
+        response = self.api.delete('/api/v1/posts/bulk/', [own.pk, alien.pk], format='json')
+        self.assertEqual([item['status'] for item in response.data], [204, 403])
+        self.assertFalse(Post.objects.filter(pk=own.pk).exists())
+        self.assertEqual(UserStats.objects.get(user=self.author).post_count, 0)
+
+    # Пакет комментариев к посту обновляет счетчик комментариев.
+    def test_bulk_comments(self):
+        post = Post.objects.create(author=self.reader, text='Запись')
+        response = self.api.post(f'/api/v1/posts/{post.pk}/comments/bulk/', [{'text': 'Раз'}, {'text': 'Два'}],
+                                 format='json')
+        self.assertEqual([item['status'] for item in response.data], [201, 201])
+        self.assertEqual(Post.objects.get(pk=post.pk).comment_count, 2)
+        comment_id = response.data[0]['data']['id']
+        response = self.api.patch(f'/api/v1/posts/{post.pk}/comments/bulk/', [{'id': comment_id, 'text': 'Три'}],
+                                  format='json')
+        self.assertEqual(Comment.objects.get(pk=comment_id).text, 'Три')
+        self.api.delete(f'/api/v1/posts/{post.pk}/comments/bulk/', [comment_id], format='json')
+        self.assertEqual(Post.objects.get(pk=post.pk).comment_count, 1)
+
+    # Вместо списка или при превышении лимита возвращается ошибка 400.
+    def test_bulk_rejects_bad_payload(self):
+        self.assertEqual(self.api.post('/api/v1/posts/bulk/', {'text': 'Не список'}, format='json').status_code, 400)
+        response = self.api.post('/api/v1/posts/bulk/', [{'text': 'x'}] * 1001, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    # Id, который не является целым числом (объект, список, строка, true), дает ошибку 400 для своего элемента.
+    def test_bulk_rejects_bad_ids(self):
+        own = Post.objects.create(author=self.author, text='Свой')
+        response = self.api.delete('/api/v1/posts/bulk/', [{'id': own.pk}, [own.pk], str(own.pk), True, own.pk],
+                                   format='json')
+        self.assertEqual([item['status'] for item in response.data], [400, 400, 400, 400, 204])
+        self.assertEqual(response.data[0]['id'], {'id': own.pk})
+        response = self.api.patch('/api/v1/posts/bulk/', [{'id': [1], 'text': 'Список'}, {'id': True, 'text': 'Да'},
+                                                          {'text': 'Без id'}], format='json')
+        self.assertEqual([item['status'] for item in response.data], [400, 400, 400])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+
+    def make_image(self, name='image.jpeg'):
+        buffer = BytesIO()
+        Image.new('RGB', (100, 100), 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    # Пока миниатюра не готова, в карточке выводится заглушка, после генерации — сама миниатюра.
+    def test_placeholder_until_generated(self):
+        post = Post.objects.create(author=self.author, text='С картинкой', image=self.make_image())
+        self.assertFalse(post.thumbnail_ready)
+        self.assertContains(self.client.get(reverse('index')), 'post_placeholder.svg')
+
+        thumbnails.generate(post.pk)
+        self.assertTrue(Post.objects.get(pk=post.pk).thumbnail_ready)
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'post_placeholder.svg')
+        self.assertContains(response, '<img class="card-img"')
+
+    # Новая картинка снова требует генерации миниатюр, правка текста — нет.
+    def test_new_image_resets_ready_flag(self):
+        post = Post.objects.create(author=self.author, text='С картинкой', image=self.make_image())
+        thumbnails.generate(post.pk)
+        post = Post.objects.get(pk=post.pk)
+        post.text = 'Исправлен'
+        post.save()
+        self.assertTrue(Post.objects.get(pk=post.pk).thumbnail_ready)
+        post.image = self.make_image('other.jpeg')
+        post.save()
+        self.assertFalse(Post.objects.get(pk=post.pk).thumbnail_ready)
+
+    # Команда не трогает записи без картинки, ни с пустой строкой, ни с NULL.
+    def test_command_skips_posts_without_image(self):
+        # Миниатюры еще не готовы, но генерировать их не из чего
+        empty = Post.objects.create(author=self.author, text='Без картинки')
+        null = Post.objects.create(author=self.author, text='Картинка NULL')
+        Post.objects.filter(pk=null.pk).update(image=None)
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('for 0 posts', out.getvalue())
+
+
+class QueryPlansTest(TestCase):
+    # Все зарегистрированные горячие запросы читают данные по индексам.
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('use their indexes', out.getvalue())
+
+    # Полный просмотр таблицы и сортировка во временном B-дереве считаются ошибкой.
+    def test_problems_are_detected(self):
+        _, problems = plan_problems(Post.objects.filter(text='Запись'))
+        self.assertTrue(any(line.startswith('SCAN posts_post') for line in problems))
+        _, problems = plan_problems(Post.objects.filter(author_id=1).order_by('text'))
+        self.assertTrue(any('TEMP B-TREE' in line for line in problems))
+
+
+# Бюджеты запросов и времени страниц и API.
+#
+# Тесты проверяют, что страница верна, BUDGETS — во что она обходится: каждая
+# строка — адрес с наибольшим числом SQL-запросов и миллисекунд на один запрос
+# к данным seed_budget_data(). N+1, добавленный в post_item.html или в
+# сериализатор, умножает запросы страницы на ее размер и роняет BudgetTest.
+# Запросы измеряются с холодным кэшем, чтобы кэш лент и карточек не скрывал
+# стоимость их отрисовки. На медленных машинах бюджеты времени умножаются на
+# settings.POSTS_BUDGET_TIME_FACTOR.
+
+# path may contain the placeholders of seed_budget_data(); data is the JSON body or a function of them.
+# ms=None leaves the time unchecked, e.g. where it is spent on password hashing on purpose.
+Budget = namedtuple('Budget', ['path', 'queries', 'ms', 'method', 'data'], defaults=('get', None))
+
+BUDGETS = [
+    # Pages
+    # With a cold cache the feeds read the keys of their latest posts (posts.recent) before loading the first page
+    Budget('/', queries=4, ms=300),
+    # The group and profile pages look up the id of their feed for the conditional GET validators
+    Budget('/group/{slug}/', queries=6, ms=300),
+    Budget('/{username}/', queries=7, ms=300),
+    # The post with its author, stats and group, then a page of comments with their authors (posts.detail)
+    Budget('/{username}/{post_id}/', queries=4, ms=300),
+    # Fragment with a page of comments, appended by the "load more" link of the post page
+    Budget('/{username}/{post_id}/comments/', queries=2, ms=200),
+    # The follow page looks up the followed popular authors whose posts are merged in (posts.timeline)
+    Budget('/follow/', queries=4, ms=300),
+    # Every seeded post matches: the ranking sorts all of them
+    Budget('/search/?q=post', queries=4, ms=300),
+    # API: reads
+    Budget('/api/v1/posts/', queries=1, ms=200),
+    Budget('/api/v1/posts/?group=1&limit=100', queries=1, ms=300),
+    Budget('/api/v1/posts/{post_id}/', queries=1, ms=100),
+    Budget('/api/v1/posts/{post_id}/comments/', queries=2, ms=100),
+    Budget('/api/v1/posts/{post_id}/comments/{comment_id}/', queries=2, ms=100),
+    Budget('/api/v1/group/', queries=1, ms=100),
+    Budget('/api/v1/follow/', queries=1, ms=200),
+    Budget('/api/v1/search/?q=comment', queries=2, ms=200),
+    Budget('/api/v1/export/', queries=1, ms=1000),
+    Budget('/api/v1/export/?comments=1', queries=2, ms=1500),
+    # API: writes, measured after the reads as they change the data;
+    # a write queues its follow feed and search index tasks (posts.tasks)
+    Budget('/api/v1/token/', queries=1, ms=None, method='post', data={'username': 'reader', 'password': 'password'}),
+    Budget('/api/v1/token/refresh/', queries=0, ms=100, method='post',
+           data=lambda context: {'refresh': context['refresh']}),
+    Budget('/api/v1/posts/', queries=4, ms=200, method='post', data={'text': 'Новая запись'}),
+    Budget('/api/v1/posts/{own_post_id}/', queries=4, ms=200, method='put', data={'text': 'Исправленная запись'}),
+    Budget('/api/v1/posts/{own_post_id}/', queries=3, ms=200, method='patch', data={'text': 'Исправленная запись'}),
+    Budget('/api/v1/posts/bulk/', queries=6, ms=500, method='post', data=[{'text': 'Пакет'}] * 50),
+    Budget('/api/v1/posts/bulk/', queries=5, ms=500, method='patch',
+           data=lambda context: [{'id': post_id, 'text': 'Пакет'} for post_id in context['own_post_ids']]),
+    Budget('/api/v1/posts/{post_id}/comments/', queries=4, ms=200, method='post', data={'text': 'Комментарий'}),
+    # A comment edit also touches its post, so the export sees it (api.views.ExportView)
+    Budget('/api/v1/posts/{own_post_id}/comments/{own_comment_id}/', queries=6, ms=200, method='patch',
+           data={'text': 'Исправленный комментарий'}),
+    Budget('/api/v1/posts/{post_id}/comments/bulk/', queries=6, ms=500, method='post',
+           data=[{'text': 'Пакет'}] * 50),
+    Budget('/api/v1/posts/{bulk_post_id}/comments/bulk/', queries=7, ms=500, method='patch',
+           data=lambda context: [{'id': context['bulk_comment_id'], 'text': 'Пакет'}]),
+    Budget('/api/v1/group/', queries=2, ms=100, method='post',
+           data={'title': 'Новая группа', 'slug': 'new', 'description': 'Группа'}),
+    # The follow also updates the counters of both users and queues the backfill of the follow feed
+    Budget('/api/v1/follow/', queries=6, ms=200, method='post',
+           data=lambda context: {'author': context['unfollowed']}),
+    # Deletes last, they remove the objects the other requests use. QuerySet.delete() sends the
+    # signals of every deleted row, so a post costs about 3 queries more per comment (5 here)
+    Budget('/api/v1/posts/{own_post_id}/comments/{own_comment_id}/', queries=7, ms=200, method='delete'),
+    Budget('/api/v1/posts/{bulk_post_id}/comments/bulk/', queries=9, ms=500, method='delete',
+           data=lambda context: [context['bulk_comment_id']]),
+    Budget('/api/v1/posts/bulk/', queries=42, ms=500, method='delete',
+           data=lambda context: context['own_post_ids'][1:3]),
+    Budget('/api/v1/posts/{own_post_id}/', queries=20, ms=200, method='delete'),
+]
+
+# Result of one measured request
+Measurement = namedtuple('Measurement', ['response', 'queries', 'ms'])
+
+
+def seed_budget_data(users=20, groups=3, posts_per_user=15, comments_per_post=5, follows_per_user=5):
+    """
+    Create a community to measure on and return the values of the BUDGETS placeholders.
+
+    The first user, "reader", follows the next follows_per_user users; every
+    user writes posts_per_user posts spread over the groups.
+    """
+    password = make_password('password')  # hashing once keeps seeding fast
+    authors = User.objects.bulk_create(
+        [User(username='reader', password=password)] +
+        [User(username=f'author{number}', password=password) for number in range(1, users)]
+    )
+    group_list = Group.objects.bulk_create(
+        [Group(title=f'Group {number}', slug=f'group{number}', description='Seeded group.')
+         for number in range(1, groups + 1)]
+    )
+    Follow.objects.bulk_create([Follow(user=authors[0], author=author)
+                                for author in authors[1:follows_per_user + 1]])
+    posts = [Post(author=author, group=group_list[number % groups] if number % 2 else None,
+                  text=f'Post {number} of {author.username}')
+             for author in authors for number in range(posts_per_user)]
+    # Fills the follow feeds and the post counters like the bulk API
+    bulk.create_posts(posts)
+    comments = Comment.objects.bulk_create([Comment(post=post, author=authors[number % users], text=f'Comment {number}')
+                                            for post in posts for number in range(comments_per_post)])
+    counters.recount_all()
+    # Follow feeds and the search index are written by tasks, as a worker would run them
+    tasks.run_pending()
+    search.index_comments([comment.pk for comment in comments])
+
+    post = posts[-1]
+    # The reader's own posts and comment, which the write budgets change and delete
+    own_posts = [own.pk for own in posts if own.author_id == authors[0].pk]
+    own_comments = dict(Comment.objects.filter(author=authors[0]).values_list('post_id', 'pk'))
+    return {'username': post.author.username, 'post_id': post.pk, 'slug': group_list[0].slug,
+            'comment_id': post.comments.values_list('pk', flat=True)[0],
+            'own_post_id': own_posts[0], 'own_comment_id': own_comments[own_posts[0]], 'own_post_ids': own_posts,
+            'bulk_post_id': own_posts[-1], 'bulk_comment_id': own_comments[own_posts[-1]],
+            'unfollowed': authors[-1].username, 'refresh': str(RefreshToken.for_user(authors[0]))}
+
+
+def measure_budget(client, budget, context):
+    """ Run the request of the budget with a cold cache and return its response, query count and time. """
+    path = budget.path.format(**context)
+    data = budget.data(context) if callable(budget.data) else budget.data
+    request = getattr(client, budget.method)
+    cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = request(path, data, format='json') if data is not None else request(path)
+        if response.streaming:
+            # A streaming response runs its queries while the body is consumed
+            b''.join(response.streaming_content)
+        ms = (time.perf_counter() - started) * 1000
+    return Measurement(response, len(queries), ms)
+
+
+def budget_time_limit(budget):
+    """ Allowed milliseconds of the budget on this machine, or None if time is not checked. """
+    if budget.ms is None:
+        return None
+    return budget.ms * getattr(settings, 'POSTS_BUDGET_TIME_FACTOR', 1)
+
+
+class BudgetTest(TestCase):
+    """ Число запросов и время ответа страниц и API не превышают бюджетов BUDGETS. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.context = seed_budget_data()
+
+    def setUp(self):
+        self.client = APIClient()
+        reader = User.objects.get(username='reader')
+        self.client.force_login(reader)
+        self.client.force_authenticate(reader)
+
+    def test_budgets(self):
+        # Первые запросы компилируют шаблоны и импортируют модули: их время не показательно
+        for budget in BUDGETS:
+            if budget.method == 'get':
+                measure_budget(self.client, budget, self.context)
+
+        for budget in BUDGETS:
+            with self.subTest(method=budget.method, path=budget.path):
+                result = measure_budget(self.client, budget, self.context)
+                self.assertLess(result.response.status_code, 400)
+                self.assertLessEqual(result.queries, budget.queries, msg='Превышен бюджет запросов')
+                limit = budget_time_limit(budget)
+                if limit is not None:
+                    self.assertLessEqual(result.ms, limit, msg='Превышен бюджет времени')
+
+
+class SeedLoadTest(TestCase):
+    # Команда создает данные в заданном объеме, а счетчики и ленты подписок согласованы с ними.
+    def test_seed_load(self):
+        call_command('seed_load', users=30, groups=3, posts=200, comments=300, follows=5, random_seed=1,
+                     stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='load').count(), 30)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertTrue(Follow.objects.exists())
+
+        stats = UserStats.objects.get(user=Post.objects.first().author)
+        self.assertEqual(stats.post_count, Post.objects.filter(author_id=stats.user_id).count())
+        follow = Follow.objects.first()
+        self.assertEqual(TimelineEntry.objects.filter(user_id=follow.user_id, author_id=follow.author_id).count(),
+                         Post.objects.filter(author_id=follow.author_id,
+                                             pub_date__gt=timezone.now() - timedelta(days=30)).count())
+
+
+class BenchmarksTest(TestCase):
+    # Каждый маршрут, найденный пакетом benchmarks, отвечает без ошибок сервера, запросы к БД подсчитываются.
+    def test_routes_smoke(self):
+        seed_budget_data()
+        sample = routes.get_sample('reader')
+        transport = transports.WsgiTransport(WSGIHandler())
+        with runner.QueryCounter() as counter:
+            for route in routes.get_routes(sample):
+                with self.subTest(route=route.pattern):
+                    result = runner.run_route(transport, route, sample.headers, requests=2, concurrency=1,
+                                              warmup=0, counter=counter)
+                    summary = report.summarize(result)
+                    self.assertEqual(summary['failures'], 0)
+                    self.assertTrue(all(int(status) < 500 for status in summary['statuses']))
+                    self.assertIsNotNone(summary['p95_ms'])
+        self.assertGreater(counter.count, 0)
+
+    # Без записей в группах маршруты групп пропускаются, остальные измеряются.
+    def test_routes_without_groups(self):
+        author = User.objects.create_user(username='author', password='password')
+        Post.objects.create(author=author, text='Запись без группы')
+        patterns = [route.pattern for route in routes.get_routes(routes.get_sample('author'))]
+        self.assertIn('/<str:username>/<int:post_id>/', patterns)
+        self.assertFalse([pattern for pattern in patterns if '<slug:slug>' in pattern])
+
+    # Тело запроса под ASGI доходит до представления: токен выдается по логину и паролю.
+    def test_asgi_transport_sends_body(self):
+        from umbrella.asgi import application
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        transport = transports.AsgiTransport(application)
+        status = async_to_sync(transport.request)('POST', '/api/v1/token/', {},
+                                                  {'username': 'reader', 'password': 'Hgj-15Jkf324-tu'})
+        self.assertEqual(status, 200)
+
+    # Ошибки и изменившиеся коды ответа считаются регрессией, даже если маршрут стал быстрее.
+    def test_compare_flags_statuses(self):
+        def summary(statuses, p95=10.0):
+            return {'statuses': statuses, 'failures': 0, 'p95_ms': p95, 'queries': 2}
+
+        baseline = {'routes': {'GET /': summary({'200': 5}), 'POST /token/': summary({'200': 5})}}
+        lines, regressions = report.compare(baseline, {'GET /': summary({'200': 5}, p95=9.0),
+                                                       'POST /token/': summary({'400': 5}, p95=1.0)}, 20)
+        self.assertEqual(regressions, 1)
+        self.assertIn('REGRESSION', lines[1])
+        self.assertNotIn('p95', lines[1])
+        lines, regressions = report.compare({'routes': {}}, {'GET /': summary({'200': 3, '500': 2})}, 20)
+        self.assertEqual(regressions, 1)
+
+
+@override_settings(REQUEST_METRICS=True)
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='admin', password='Hgj-15Jkf324-tu', is_staff=True)
+        Post.objects.create(author=self.user, text='Запись')
+
+    # Ответ содержит заголовок Server-Timing, а в лог пишется JSON-строка с метриками запроса.
+    def test_server_timing_and_log(self):
+        with self.assertLogs('umbrella.metrics', 'INFO') as logs:
+            response = Client().get(reverse('index'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['route'], 'index')
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['template_ms'], 0)
+        self.assertGreater(line['cache_misses'], 0)
+
+    # Страница статистики доступна персоналу и показывает маршруты.
+    def test_stats_page(self):
+        client = Client()
+        with self.assertLogs('umbrella.metrics', 'INFO'):
+            client.get(reverse('index'))
+            self.assertEqual(client.get(reverse('admin_metrics')).status_code, 302)
+            client.force_login(self.user)
+            response = client.get(reverse('admin_metrics'))
+        self.assertContains(response, '<td>index</td>', html=False)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.post = Post.objects.create(author=self.user, text='Запись')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    # Повторный запрос с ETag получает 304 без единого SQL-запроса, новая запись меняет ETag.
+    def test_index_not_modified(self):
+        guest = Client()
+        response = guest.get(reverse('index'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = guest.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Post.objects.create(author=self.user, text='Новая запись')
+        response = guest.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    # Страницы вошедших пользователей содержат личные ссылки, поэтому их ETag зависит от пользователя.
+    def test_etag_depends_on_user(self):
+        guest_etag = Client().get(reverse('index'))['ETag']
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(reverse('follow_index'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotEqual(client.get(reverse('index'))['ETag'], guest_etag)
+
+    # Список записей API отвечает 304 и на If-Modified-Since.
+    def test_api_posts_if_modified_since(self):
+        response = self.client.get('/api/v1/posts/')
+        last_modified = response['Last-Modified']
+        response = self.client.get('/api/v1/posts/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    # Новый или измененный комментарий меняет ETag комментариев записи, но не других записей.
+    def test_api_comments_etag(self):
+        other = Post.objects.create(author=self.user, text='Другая запись')
+        url = f'/api/v1/posts/{self.post.pk}/comments/'
+        other_url = f'/api/v1/posts/{other.pk}/comments/'
+        etag, other_etag = self.client.get(url)['ETag'], self.client.get(other_url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        comment = Comment.objects.create(post=self.post, author=self.user, text='Комментарий')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(other_url, HTTP_IF_NONE_MATCH=other_etag).status_code, 304)
+
+        etag = response['ETag']
+        comment.text = 'Исправленный комментарий'
+        comment.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class LiveUpdatesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.group = Group.objects.create(title='Test Group', slug='test', description='Test description.')
+        # Как и тестовый клиент Django, не закрываем соединение с базой в конце потока
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+    def stream(self, path, scenario, headers=()):
+        """ Открывает поток path, выполняет scenario(sent) и возвращает отправленные приложением сообщения. """
+        sent, disconnected = [], asyncio.Event()
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async def run():
+            scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': list(headers)}
+            task = asyncio.ensure_future(live.application(scope, receive, send))
+            while len(sent) < 2 and not task.done():
+                await asyncio.sleep(0.01)
+            if not task.done():
+                await scenario(sent)
+                disconnected.set()
+            await asyncio.wait_for(task, 5)
+
+        async_to_sync(run)()
+        return sent
+
+    # Новая запись группы приходит в поток группы после фиксации транзакции.
+    def test_group_stream_receives_new_post(self):
+        def create_post():
+            with self.captureOnCommitCallbacks(execute=True):
+                return Post.objects.create(author=self.user, text='Новая запись', group=self.group)
+
+        async def scenario(sent):
+            post = await sync_to_async(create_post)()
+            while b'event: post' not in sent[-1].get('body', b''):
+                await asyncio.sleep(0.01)
+            self.assertIn(f'"id": {post.pk}'.encode(), sent[-1]['body'])
+
+        sent = self.stream(f'/live/group/{self.group.slug}/', scenario)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        # Отключившийся клиент отписан от всех каналов.
+        self.assertEqual(live.HUB.channels, {})
+
+    # Поток подписок получает записи авторов, на которых подписан пользователь, и только их.
+    def test_follow_stream(self):
+        reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        other = User.objects.create_user(username='other', password='Hgj-15Jkf324-tu')
+        Follow.objects.create(user=reader, author=self.user)
+        client = Client()
+        client.force_login(reader)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.session.session_key}'.encode()
+
+        async def scenario(sent):
+            live.HUB.dispatch({'id': 1, 'author': other.pk, 'group': None})
+            live.HUB.dispatch({'id': 2, 'author': self.user.pk, 'group': None})
+            while b'event: post' not in sent[-1].get('body', b''):
+                await asyncio.sleep(0.01)
+
+        sent = self.stream('/live/follow/', scenario, headers=[(b'cookie', cookie)])
+        events = [message['body'] for message in sent[1:] if b'event: post' in message['body']]
+        self.assertEqual(len(events), 1)
+        self.assertIn(b'id: 2', events[0])
+
+    # Несуществующая лента и лента подписок без входа отвечают 404.
+    def test_unknown_feed(self):
+        async def scenario(sent):
+            pass
+
+        for path in ('/live/group/missing/', '/live/follow/', '/live/unknown/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.stream(path, scenario)[0]['status'], 404)
+
+
+class AsyncApiViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.group = Group.objects.create(title='Test Group', slug='test', description='Test description.')
+        for number in range(3):
+            Post.objects.create(author=self.author, group=self.group, text=f'Запись {number}')
+        self.post = Post.objects.create(author=self.author, text='Запись с комментариями')
+        for number in range(2):
+            Comment.objects.create(post=self.post, author=self.author, text=f'Комментарий {number}')
+        self.token = str(AccessToken.for_user(self.author))
+        self.api = APIClient()
+        self.api.force_authenticate(self.author)
+
+    def call(self, view, method, path, data=None, token=True, **kwargs):
+        """ Запрос к асинхронному представлению в обход URLconf, который выбирает синхронные представления. """
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {self.token}'} if token else {}
+        factory = RequestFactory()
+        if data is None:
+            request = getattr(factory, method)(path, **headers)
+        else:
+            request = getattr(factory, method)(path, data, content_type='application/json', **headers)
+        return async_to_sync(view.as_view())(request, **kwargs)
+
+    # Асинхронные представления отдают тот же JSON, что и синхронные, включая страницы и выбор полей.
+    def test_same_data_as_sync_views(self):
+        for path, view, kwargs in (('/api/v1/posts/?limit=2', AsyncPostView, {}),
+                                   ('/api/v1/posts/?fields=id,text&group=1', AsyncPostView, {}),
+                                   (f'/api/v1/posts/{self.post.pk}/comments/', AsyncCommentView,
+                                    {'post_id': self.post.pk}),
+                                   ('/api/v1/group/', AsyncGroupView, {})):
+            with self.subTest(path=path):
+                response = self.call(view, 'get', path, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), self.api.get(path).json())
+
+    # Чтение комментариев требует входа, отсутствующая запись и неверные параметры дают ошибки DRF.
+    def test_errors(self):
+        path = f'/api/v1/posts/{self.post.pk}/comments/'
+        response = self.call(AsyncCommentView, 'get', path, token=False, post_id=self.post.pk)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+        response = self.call(AsyncCommentView, 'get', '/api/v1/posts/0/comments/', post_id=0)
+        self.assertEqual(response.status_code, 404)
+        response = self.call(AsyncPostView, 'get', '/api/v1/posts/?fields=password', token=False)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', json.loads(response.content))
+        response = self.call(AsyncPostView, 'get', '/api/v1/posts/?group=%C2%B2', token=False)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('group', json.loads(response.content))
+
+    # Комментарии читаются теми же двумя запросами, повторный запрос с ETag получает 304.
+    def test_comments_queries_and_etag(self):
+        path = f'/api/v1/posts/{self.post.pk}/comments/'
+        self.call(AsyncCommentView, 'get', path, post_id=self.post.pk)
+        with self.assertNumQueries(3):  # пользователь токена, запись и комментарии
+            response = self.call(AsyncCommentView, 'get', path, post_id=self.post.pk)
+        request = RequestFactory().get(path, HTTP_AUTHORIZATION=f'Bearer {self.token}',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        response = async_to_sync(AsyncCommentView.as_view())(request, post_id=self.post.pk)
+        self.assertEqual(response.status_code, 304)
+
+    # Запись и браузерный API передаются синхронному представлению DRF.
+    def test_writes_are_delegated(self):
+        response = self.call(AsyncPostView, 'post', '/api/v1/posts/', data={'text': 'Новая запись'})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Post.objects.filter(text='Новая запись').exists())
+        request = RequestFactory().get('/api/v1/group/', HTTP_ACCEPT='text/html')
+        response = async_to_sync(AsyncGroupView.as_view())(request)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+    # Потоковый ответ экспорта работает и под ASGI: его запросы выполняются не в цикле событий.
+    def test_export_under_asgi(self):
+        from umbrella.asgi import application
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        transport = transports.AsgiTransport(application)
+        status = async_to_sync(transport.request)('GET', '/api/v1/export/?comments=1',
+                                                  {'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(status, 200)
+
+
+def failing_task(message):
+    raise ValueError(message)
+
+
+failing_task = tasks.task(max_attempts=2)(failing_task)
+
+
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        Follow.objects.create(user=self.reader, author=self.author)
+        # Подписка ставит в очередь заполнение ленты, тесты начинают с пустой очереди.
+        Task.objects.all().delete()
+
+    # Новая запись ставит раскладку по лентам в очередь, воркер выполняет ее и запоминает время.
+    def test_fan_out_runs_in_worker(self):
+        post = Post.objects.create(author=self.author, text='Запись')
+        task = Task.objects.get(name='posts.timeline.fan_out')
+        self.assertEqual(task.args, [[post.pk]])
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+
+        index_version = caching.get_version(caching.INDEX)
+        timelines_version = caching.get_version(caching.TIMELINES)
+        self.assertEqual(tasks.run_pending(), 2)  # раскладка по лентам и индекс поиска
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+        # Раскладка сбрасывает только ленты подписок: главную уже сбросила сама запись
+        self.assertEqual(caching.get_version(caching.INDEX), index_version)
+        self.assertNotEqual(caching.get_version(caching.TIMELINES), timelines_version)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.DONE, 1))
+        self.assertIsNotNone(task.duration)
+
+    # С TASKS_EAGER задача выполняется сразу после фиксации транзакции, без строки в очереди.
+    @override_settings(TASKS_EAGER=True)
+    def test_eager(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.author, text='Запись')
+            self.assertFalse(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+        self.assertFalse(Task.objects.exists())
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+
+    # Упавшая задача откладывается и повторяется, после max_attempts она помечается как FAILED.
+    def test_retry_then_fail(self):
+        task = tasks.enqueue(failing_task, 'сбой')
+        with self.assertLogs('posts.tasks', 'ERROR'):
+            tasks.run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('ValueError: сбой', task.error)
+        # Повтор еще не наступил.
+        self.assertEqual(tasks.run_pending(), 0)
+
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        with self.assertLogs('posts.tasks', 'ERROR'):
+            tasks.run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+
+    # Задача воркера, который не завершил ее, снова ставится в очередь.
+    def test_requeue_stale(self):
+        task = tasks.enqueue(timeline.fan_out, [])
+        Task.objects.filter(pk=task.pk).update(status=Task.RUNNING,
+                                               started=timezone.now() - timedelta(seconds=tasks.STALE_AFTER + 1))
+        self.assertEqual(tasks.requeue_stale(), 1)
+        self.assertEqual(tasks.run_pending(), 1)
+
+    # Команда run_tasks выполняет очередь и выводит статистику по задачам.
+    def test_command(self):
+        Post.objects.create(author=self.author, text='Запись')
+        out = StringIO()
+        call_command('run_tasks', '--once', verbosity=0, stdout=out)
+        self.assertIn('Worker stopped.', out.getvalue())
+        self.assertFalse(Task.objects.exclude(status=Task.DONE).exists())
+
+        out = StringIO()
+        call_command('run_tasks', '--stats', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('name'))
+        self.assertTrue(any(line.startswith('posts.timeline.fan_out') for line in lines[1:]))
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.umbrella = Post.objects.create(author=self.author, text='Забыл зонтик в поезде')
+        self.rain = Post.objects.create(author=self.author, text='Дождь идет весь день')
+        Comment.objects.create(post=self.rain, author=self.author, text='Без зонтика не выйти')
+        tasks.run_pending()
+
+    # Слова сводятся к основам: разные формы слова находят друг друга.
+    def test_stemming(self):
+        self.assertEqual(search.stem('зонтиками'), search.stem('зонтик'))
+        self.assertEqual(search.stem('книги'), search.stem('книга'))
+        self.assertEqual(search.terms('Ёлки, Python 3!'), ['елк', 'python', '3'])
+
+    # Совпадение в тексте записи ранжируется выше совпадения в комментарии, нужны все слова запроса.
+    def test_ranking(self):
+        self.assertEqual(search.search('зонтики'), [self.umbrella.pk, self.rain.pk])
+        self.assertEqual(search.search('зонтик поезд'), [self.umbrella.pk])
+        self.assertEqual(search.search('NEAR OR'), [])
+        self.assertEqual(search.search('...'), [])
+
+    # Правка и удаление записи обновляют индекс через очередь задач.
+    def test_index_follows_writes(self):
+        self.umbrella.text = 'Нашел книгу'
+        self.umbrella.save()
+        tasks.run_pending()
+        self.assertEqual(search.search('книги'), [self.umbrella.pk])
+        self.assertEqual(search.search('поезд'), [])
+        self.rain.delete()
+        tasks.run_pending()
+        self.assertEqual(search.search('зонтик'), [])
+
+        Post.objects.create(author=self.author, text='Зонтик')
+        self.assertEqual(search.rebuild(), (2, 0))
+        self.assertEqual(len(search.search('зонтик')), 1)
+
+    # Страница поиска выводит найденные записи постранично.
+    def test_page(self):
+        for number in range(10):
+            Post.objects.create(author=self.author, text=f'Зонтик номер {number}')
+        tasks.run_pending()
+        response = self.client.get(reverse('search'), {'q': 'зонтик'})
+        self.assertEqual(len(response.context['posts']), 10)
+        self.assertEqual(response.context['next_page'], 2)
+        response = self.client.get(reverse('search'), {'q': 'зонтик', 'page': 2})
+        self.assertEqual(len(response.context['posts']), 2)
+        self.assertIsNone(response.context['next_page'])
+        self.assertContains(self.client.get(reverse('search'), {'q': 'снег'}), 'Ничего не найдено.')
+
+    # API поиска возвращает страницу публикаций со ссылками по смещению и требует запрос.
+    def test_api(self):
+        api = APIClient()
+        response = api.get('/api/v1/search/', {'q': 'зонтики', 'limit': 1, 'fields': 'id,text'})
+        self.assertEqual(response.data['results'], [{'id': self.umbrella.pk, 'text': self.umbrella.text}])
+        self.assertIn('offset=1', response.data['next'])
+        self.assertIsNone(response.data['previous'])
+        response = api.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['id'], self.rain.pk)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(api.get('/api/v1/search/').status_code, 400)
+
+    # Поиск в админке тоже использует полнотекстовый индекс.
+    def test_admin(self):
+        admin_user = User.objects.create_superuser(username='admin', password='Hgj-15Jkf324-tu')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/posts/post/', {'q': 'поезда'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+@override_settings(POSTS_TIMELINE_PULL_THRESHOLD=2)
+class HybridTimelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        self.other = User.objects.create_user(username='other', password='Hgj-15Jkf324-tu')
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.star = User.objects.create_user(username='star', password='Hgj-15Jkf324-tu')
+        Follow.objects.create(user=self.reader, author=self.author)
+        # У звезды два подписчика — это порог, ее записи не копируются в ленты.
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.other, author=self.star)
+        self.client.force_login(self.reader)
+
+    def publish(self):
+        """ Записи автора и звезды вперемешку, от старых к новым. """
+        posts = []
+        for number in range(8):
+            author = self.star if number % 2 else self.author
+            posts.append(Post.objects.create(author=author, text=f'Запись {number}',
+                                             pub_date=timezone.now() - timedelta(minutes=10 - number)))
+        tasks.run_pending()
+        return posts
+
+    # Записи популярного автора не копируются в ленты, а подмешиваются при чтении в порядке публикации.
+    def test_pull_and_merge(self):
+        posts = self.publish()
+        self.assertFalse(TimelineEntry.objects.filter(author=self.star).exists())
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader, author=self.author).count(), 4)
+
+        # Список популярных авторов, лента, последние записи звезды и сами записи на странице
+        with self.assertNumQueries(4):
+            page = timeline.paginator(self.reader, 5).get_page()
+        # Ключи последних записей звезды уже в кэше
+        with self.assertNumQueries(3):
+            self.assertEqual(list(timeline.paginator(self.reader, 5).get_page()), list(page))
+        self.assertEqual([post.pk for post in page], [post.pk for post in reversed(posts)][:5])
+        next_page = timeline.paginator(self.reader, 5).get_page(page.next_cursor)
+        self.assertEqual([post.pk for post in next_page], [post.pk for post in reversed(posts)][5:])
+        self.assertFalse(next_page.has_next())
+        previous_page = timeline.paginator(self.reader, 5).get_page(next_page.previous_cursor)
+        self.assertEqual([post.pk for post in previous_page], [post.pk for post in page])
+
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, 'Запись 7')
+        self.assertContains(response, 'Запись 6')
+
+    # Когда подписчиков становится меньше порога, записи автора копируются в ленты подписчиков.
+    def test_author_below_threshold_is_pushed(self):
+        self.publish()
+        Follow.objects.get(user=self.other, author=self.star).delete()
+        tasks.run_pending()
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader, author=self.star).count(), 4)
+        self.assertEqual(timeline.pulled_authors(self.reader), [])
+        page = timeline.paginator(self.reader, 10).get_page()
+        self.assertEqual(len(page), 8)
+
+    # Новая запись звезды сбрасывает закэшированный список ее последних записей.
+    def test_recent_list_invalidated(self):
+        self.publish()
+        timeline.paginator(self.reader, 5).get_page()
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.star, text='Свежая запись')
+        self.assertEqual(timeline.paginator(self.reader, 5).get_page()[0], post)
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertNotIn(post, timeline.paginator(self.reader, 5).get_page())
+
+    # Устаревшие ключи списка звезды не укорачивают страницу: она дочитывается после них.
+    def test_stale_keys_do_not_shorten_page(self):
+        posts = self.publish()
+        timeline.paginator(self.reader, 5).get_page()
+        # Дата записи звезды изменена в обход сигналов: ключ в списке больше не совпадает с записью
+        stale = posts[5]
+        Post.objects.filter(pk=stale.pk).update(pub_date=stale.pub_date - timedelta(days=1))
+        # Список звезды не знает новой даты, поэтому запись пропадает из ленты до его обновления
+        expected = [post.pk for post in reversed(posts) if post != stale]
+        paginator = timeline.paginator(self.reader, 5)
+        page = paginator.get_page()
+        self.assertEqual([post.pk for post in page], expected[:5])
+        self.assertTrue(page.has_next())
+        page = paginator.get_page(page.next_cursor)
+        self.assertEqual([post.pk for post in page], expected[5:])
+
+    # Страницы дальше закэшированных записей автора читаются из таблицы записей.
+    def test_pages_beyond_recent_list(self):
+        posts = self.publish()
+        length = recent.LENGTH
+        recent.LENGTH = 2
+        self.addCleanup(setattr, recent, 'LENGTH', length)
+        cache.clear()
+        paginator = timeline.paginator(self.reader, 3)
+        page, pks = paginator.get_page(), []
+        while True:
+            pks += [post.pk for post in page]
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual(pks, [post.pk for post in reversed(posts)])
+
+    # Предыдущие страницы за концом списка тоже читаются из таблицы, ни одна запись не пропускается.
+    def test_previous_pages_beyond_recent_list(self):
+        self.publish()
+        length = recent.LENGTH
+        recent.LENGTH = 2
+        self.addCleanup(setattr, recent, 'LENGTH', length)
+        cache.clear()
+        paginator = timeline.paginator(self.reader, 3)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        for page, previous in zip(reversed(pages), reversed(pages[:-1])):
+            self.assertEqual([post.pk for post in paginator.get_page(page.previous_cursor)],
+                             [post.pk for post in previous])
+
+    # Новому подписчику популярного автора не копируются его старые записи.
+    def test_no_backfill_of_pulled_author(self):
+        self.publish()
+        newcomer = User.objects.create_user(username='newcomer', password='Hgj-15Jkf324-tu')
+        Follow.objects.create(user=newcomer, author=self.star)
+        tasks.run_pending()
+        self.assertFalse(TimelineEntry.objects.filter(user=newcomer).exists())
+        self.assertEqual(len(timeline.paginator(newcomer, 10).get_page()), 4)
+
+
+class RecentListsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.group = Group.objects.create(title='Test Group', slug='test', description='Test description.')
+        self.other_group = Group.objects.create(title='Other Group', slug='other', description='Other description.')
+        self.posts = [Post.objects.create(author=self.author, group=self.group, text=f'Запись {number}')
+                      for number in range(12)]
+
+    def page(self, scope, posts):
+        return [post.pk for post in recent.FeedPaginator(scope, posts.for_feed(), 10).get_page()]
+
+    # Первая страница собирается по ключам списка одним запросом по диапазону, без сортировки записей.
+    def test_first_page_from_list(self):
+        expected = [post.pk for post in reversed(self.posts)][:10]
+        # Пустой кэш: список читается из таблицы один раз
+        with self.assertNumQueries(1):
+            recent.get_lists([recent.INDEX])
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.page(recent.INDEX, Post.objects.all()), expected)
+        self.assertEqual(len(context), 1)
+        self.assertNotIn('ORDER BY', context[0]['sql'])
+        self.assertEqual(self.page(recent.group_scope(self.group.pk), self.group.posts.all()), expected)
+        self.assertEqual(self.page(recent.author_scope(self.author.pk), self.author.posts.all()), expected)
+
+        # Другой процесс берет списки из общего кэша, не читая таблицу
+        recent._buffers.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.page(recent.INDEX, Post.objects.all()), expected)
+
+    # Публикация, перенос и удаление записи меняют списки без повторного чтения таблицы.
+    def test_lists_follow_writes(self):
+        scopes = [recent.INDEX, recent.group_scope(self.group.pk), recent.group_scope(self.other_group.pk)]
+        recent.get_lists(scopes)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.author, group=self.group, text='Свежая запись')
+        with self.assertNumQueries(0):
+            lists = recent.get_lists(scopes)
+        self.assertEqual(lists[recent.INDEX][0][-1], recent.post_key(post))
+        self.assertEqual(lists[recent.group_scope(self.group.pk)][0][-1], recent.post_key(post))
+
+        post.group = self.other_group
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        with self.assertNumQueries(0):
+            lists = recent.get_lists(scopes)
+        self.assertNotIn(recent.post_key(post), lists[recent.group_scope(self.group.pk)][0])
+        self.assertEqual(list(lists[recent.group_scope(self.other_group.pk)][0]), [recent.post_key(post)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        with self.assertNumQueries(0):
+            lists = recent.get_lists(scopes)
+        self.assertNotIn(recent.post_key(post), lists[recent.INDEX][0])
+        self.assertEqual(self.page(recent.INDEX, Post.objects.all()), [post.pk for post in reversed(self.posts)][:10])
+
+    # Запись, переданная другому автору, переходит из списка старого автора в список нового.
+    def test_lists_follow_author_change(self):
+        other = User.objects.create_user(username='other', password='Hgj-15Jkf324-tu')
+        scopes = [recent.author_scope(self.author.pk), recent.author_scope(other.pk)]
+        recent.get_lists(scopes)
+        post = Post.objects.get(pk=self.posts[-1].pk)
+        post.author = other
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        with self.assertNumQueries(0):
+            lists = recent.get_lists(scopes)
+        self.assertNotIn(recent.post_key(post), lists[recent.author_scope(self.author.pk)][0])
+        self.assertEqual(list(lists[recent.author_scope(other.pk)][0]), [recent.post_key(post)])
+        self.assertEqual(self.page(recent.author_scope(self.author.pk), self.author.posts.all()),
+                         [post.pk for post in reversed(self.posts[:-1])][:10])
+
+    # Списки меняются только после фиксации транзакции.
+    def test_lists_change_after_commit(self):
+        recent.get_lists([recent.INDEX])
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = Post.objects.create(author=self.author, text='Свежая запись')
+            self.assertNotEqual(recent.get_lists([recent.INDEX])[recent.INDEX][0][-1], recent.post_key(post))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(recent.get_lists([recent.INDEX])[recent.INDEX][0][-1], recent.post_key(post))
+
+    # Устаревший список не показывает чужие записи: страница читается обычным запросом.
+    def test_stale_list_falls_back_to_query(self):
+        recent.get_lists([recent.INDEX])
+        newest = self.posts[-1]
+        Post.objects.filter(pk=newest.pk).update(pub_date=newest.pub_date - timedelta(days=1))
+        expected = [post.pk for post in reversed(self.posts[:-1])][:10]
+        self.assertEqual(self.page(recent.INDEX, Post.objects.all()), expected)
+
+    # Запись, добавленная в обход списков, видна на первой странице, а устаревший список сбрасывается.
+    def test_missing_post_discards_list(self):
+        recent.get_lists([recent.INDEX])
+        post, = Post.objects.bulk_create([Post(author=self.author, text='Запись в обход списков')])
+        expected = [post.pk, *[post.pk for post in reversed(self.posts)][:9]]
+        self.assertEqual(self.page(recent.INDEX, Post.objects.all()), expected)
+        # Следующий запрос читает список из таблицы заново
+        self.assertEqual(recent.get_lists([recent.INDEX])[recent.INDEX][0][-1], recent.post_key(post))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.page(recent.INDEX, Post.objects.all()), expected)
+        self.assertNotIn('ORDER BY', context[0]['sql'])
+
+    # После массовой загрузки записей в обход сигналов все списки читаются из таблицы заново.
+    def test_reset(self):
+        recent.get_lists([recent.INDEX])
+        post, = Post.objects.bulk_create([Post(author=self.author, text='Загруженная запись')])
+        recent.reset()
+        with self.assertNumQueries(1):
+            lists = recent.get_lists([recent.INDEX])
+        self.assertEqual(lists[recent.INDEX][0][-1], recent.post_key(post))
+
+
+class PostDetailTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        self.post = Post.objects.create(author=self.author, text='Запись автора')
+
+    def add_comments(self, count):
+        for number in range(count):
+            Comment.objects.create(post=self.post, author=self.reader, text=f'Комментарий {number}')
+
+    # Запись, статистика автора и комментарии с авторами загружаются за два запроса при любом числе комментариев.
+    def test_queries_do_not_grow_with_comments(self):
+        self.add_comments(3)
+        with self.assertNumQueries(2):
+            post_detail = detail.load(self.post.pk, 'author')
+            self.assertEqual(post_detail.stats.post_count, 1)
+            self.assertEqual([comment.author.username for comment in post_detail.comments], ['reader'] * 3)
+        self.add_comments(detail.COMMENTS_PER_PAGE)
+        with self.assertNumQueries(2):
+            post_detail = detail.load(self.post.pk, 'author')
+            self.assertEqual(post_detail.post.author.username, 'author')
+            self.assertEqual(len([comment.author.username for comment in post_detail.comments]),
+                             detail.COMMENTS_PER_PAGE)
+        self.assertTrue(post_detail.comments.has_next())
+
+    # Страница записи под именем другого пользователя не найдена.
+    def test_post_of_another_author(self):
+        response = self.client.get(reverse('post', kwargs={'username': 'reader', 'post_id': self.post.pk}))
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(detail.load(self.post.pk, 'reader'))
+
+    # Комментарии на странице записи идут от новых к старым, следующая страница открывается по курсору.
+    def test_comment_pages(self):
+        self.add_comments(detail.COMMENTS_PER_PAGE + 1)
+        url = reverse('post', kwargs={'username': 'author', 'post_id': self.post.pk})
+        response = self.client.get(url)
+        self.assertContains(response, f'Комментарий {detail.COMMENTS_PER_PAGE}<')
+        self.assertNotContains(response, 'Комментарий 0<')
+        cursor = response.context['items'].next_cursor
+        response = self.client.get(url, {'cursor': cursor})
+        self.assertContains(response, 'Комментарий 0<')
+
+    # API читает запись тем же загрузчиком, одним запросом вместе с автором.
+    def test_api_detail(self):
+        api = APIClient()
+        api.force_authenticate(self.reader)
+        with self.assertNumQueries(1):
+            response = api.get(f'/api/v1/posts/{self.post.pk}/')
+        self.assertEqual(response.json()['author'], 'author')
+        self.assertEqual(api.get('/api/v1/posts/0/').status_code, 404)
+
+
+class CommentPagesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='Hgj-15Jkf324-tu')
+        self.reader = User.objects.create_user(username='reader', password='Hgj-15Jkf324-tu')
+        self.post = Post.objects.create(author=self.author, text='Запись автора')
+        self.comments = [Comment.objects.create(post=self.post, author=self.reader, text=f'Комментарий {number}')
+                         for number in range(detail.COMMENTS_PER_PAGE * 2 + 1)]
+        self.api = APIClient()
+        self.api.force_authenticate(self.reader)
+
+    # Страница записи показывает первую страницу комментариев и ссылку на фрагмент со следующей.
+    def test_load_more_fragments(self):
+        url = reverse('post', kwargs={'username': 'author', 'post_id': self.post.pk})
+        fragment_url = reverse('post_comments', kwargs={'username': 'author', 'post_id': self.post.pk})
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['items']), detail.COMMENTS_PER_PAGE)
+        self.assertContains(response, f'data-fragment="{fragment_url}?cursor=')
+
+        shown = []
+        cursor = response.context['items'].next_cursor
+        while cursor:
+            response = self.client.get(fragment_url, {'cursor': cursor})
+            self.assertTemplateUsed(response, 'comment_items.html')
+            self.assertTemplateNotUsed(response, 'base.html')
+            shown += [comment.pk for comment in response.context['items']]
+            cursor = response.context['items'].next_cursor
+        self.assertEqual(shown, [comment.pk for comment in reversed(self.comments)][detail.COMMENTS_PER_PAGE:])
+        self.assertNotContains(response, 'Показать ещё')
+
+        other_url = reverse('post_comments', kwargs={'username': 'reader', 'post_id': self.post.pk})
+        self.assertEqual(self.client.get(other_url).status_code, 404)
+
+    # API отдает комментарии страницами по курсору, от новых к старым.
+    def test_api_pages(self):
+        url = f'/api/v1/posts/{self.post.pk}/comments/'
+        shown = []
+        while url:
+            data = self.api.get(url, {'limit': 15} if not shown else None).json()
+            shown += [comment['id'] for comment in data['results']]
+            self.assertLessEqual(len(data['results']), 15)
+            url = data['next']
+        self.assertEqual(shown, [comment.pk for comment in reversed(self.comments)])
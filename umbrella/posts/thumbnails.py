@@ -0,0 +1,44 @@
+"""
+Background generation of post image thumbnails.
+
+Decoding and resizing a JPEG takes far longer than rendering a page, so the
+renditions configured in settings.POSTS_THUMBNAILS are created by a background
+task (posts.tasks) after a post with a new image is saved. Until they are
+ready Post.thumbnail_ready is False and templates show a placeholder, so
+image processing never happens inside a page render.
+"""
+from django.conf import settings
+from sorl.thumbnail import get_thumbnail
+
+from . import caching
+from .models import Post
+from .tasks import enqueue, task
+
+# Rendition name -> (geometry, sorl options)
+RENDITIONS = getattr(settings, 'POSTS_THUMBNAILS', {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+})
+
+
+def get_rendition(image, name):
+    """ Thumbnail of the image by the rendition name (created if it does not exist yet). """
+    geometry, options = RENDITIONS[name]
+    return get_thumbnail(image, geometry, **options)
+
+
+@task
+def generate(post_id):
+    """ Create all renditions of the post image and mark them ready. """
+    post = Post.objects.filter(pk=post_id).only('id', 'image', 'author_id', 'group_id').first()
+    if post is None or not post.image:
+        return
+    for name in RENDITIONS:
+        get_rendition(post.image, name)
+    # The image could have been replaced while its previous version was processed
+    if Post.objects.filter(pk=post_id, image=post.image.name).update(thumbnail_ready=True):
+        caching.invalidate(*caching.post_scopes(post.author_id, post.group_id))
+
+
+def schedule(post_id):
+    """ Generate the thumbnails of the post in a worker. """
+    enqueue(generate, post_id)
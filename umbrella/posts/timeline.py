@@ -0,0 +1,176 @@
+"""
+Hybrid push/pull follow feed.
+
+Posts of most authors are pushed: every new post is copied into the timeline
+of each follower of its author, so the follow page is read from
+posts_timelineentry by a single index range instead of joining all posts of
+all followed authors. The copies are written by background tasks
+(posts.tasks), so an author with many followers does not make the
+publishing request slow.
+
+Copying costs one row per follower, which does not scale to authors followed
+by hundreds of thousands of users. Posts of authors with at least
+settings.POSTS_TIMELINE_PULL_THRESHOLD followers are not copied; the follow
+page pulls them at read time from the cached lists of their latest posts
+(posts.recent) and merges them with the timeline
+(paginator.MergedCursorPaginator). A page then costs one range read of page
+size for the timeline and one query for the posts of the popular authors on
+it, whatever the number of followers or followed authors.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+from . import caching, recent
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginator import CursorPaginator, MergedCursorPaginator
+from .tasks import enqueue, task
+
+# Number of timeline rows written per INSERT statement
+BATCH_SIZE = 1000
+
+
+def _bulk_insert(entries):
+    """ Insert timeline entries in batches without materializing the whole iterable. """
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, BATCH_SIZE))
+        if not batch:
+            break
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def pull_threshold():
+    return getattr(settings, 'POSTS_TIMELINE_PULL_THRESHOLD', 10000)
+
+
+def is_pulled(author_id):
+    """ Whether the posts of the author are merged into the follow feeds at read time instead of copied. """
+    return UserStats.objects.filter(pk=author_id, follower_count__gte=pull_threshold()).exists()
+
+
+def pulled_authors(user):
+    """ Ids of the authors the user follows whose posts are not in the user's timeline. """
+    return list(Follow.objects.filter(user=user, author__stats__follower_count__gte=pull_threshold())
+                .values_list('author_id', flat=True))
+
+
+@task
+def fan_out(post_ids):
+    """ Task writing new posts into the timelines of the followers of their authors. """
+    # A post deleted before the task ran is skipped
+    push_posts(Post.objects.filter(pk__in=post_ids).only('id', 'author_id', 'pub_date'))
+    # The follow pages validated before the copies were written are stale now; the other
+    # feeds were invalidated by posts.signals when the posts were written
+    caching.invalidate(caching.TIMELINES)
+
+
+def push_posts(posts):
+    """ Write new posts into the timelines of the followers of their authors, reading each follower list once. """
+    by_author = {}
+    for post in posts:
+        by_author.setdefault(post.author_id, []).append(post)
+    pulled = set(UserStats.objects.filter(pk__in=by_author, follower_count__gte=pull_threshold())
+                 .values_list('pk', flat=True))
+    for author_id, author_posts in by_author.items():
+        if author_id in pulled:
+            continue
+        followers = Follow.objects.filter(author_id=author_id).values_list('user_id', flat=True)
+        _bulk_insert(
+            TimelineEntry(user_id=user_id, post_id=post.pk, author_id=author_id, pub_date=post.pub_date)
+            for user_id in followers.iterator(chunk_size=BATCH_SIZE)
+            for post in author_posts
+        )
+
+
+@task
+def backfill(user_id, author_id):
+    """ Copy already published posts of the author into the timeline of a new follower. """
+    # The user could have unsubscribed before the task ran; posts of popular authors are read on the feed page
+    if not Follow.objects.filter(user_id=user_id, author_id=author_id).exists() or is_pulled(author_id):
+        return
+    posts = list(Post.objects.filter(author_id=author_id).values_list('id', 'pub_date'))
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id, pub_date=pub_date)
+        for post_id, pub_date in posts
+    )
+    caching.invalidate(caching.profile_scope(user_id))
+
+
+@task
+def push_author(author_id):
+    """ Copy the posts of an author who is no longer pulled into the timelines of all followers. """
+    if is_pulled(author_id):
+        return
+    followers = Follow.objects.filter(author_id=author_id).values_list('user_id', flat=True)
+    posts = list(Post.objects.filter(author_id=author_id).values_list('id', 'pub_date'))
+    # Posts copied before the author became popular are in the timelines already: _bulk_insert ignores them
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id, pub_date=pub_date)
+        for user_id in followers.iterator(chunk_size=BATCH_SIZE)
+        for post_id, pub_date in posts
+    )
+    caching.invalidate(caching.TIMELINES)
+
+
+def follower_removed(author_id):
+    """ Start copying the posts of an author again once their followers drop below the threshold. """
+    if UserStats.objects.filter(pk=author_id, follower_count=pull_threshold() - 1).exists():
+        enqueue(push_author, author_id)
+
+
+def fill(users, since=None):
+    """
+    Materialize the timelines of the users from their follows in one INSERT ... SELECT.
+
+    For data loaded with bulk_create (e.g. by `manage.py seed_load`), which sends no signals.
+    The timelines of the users are expected to be empty and the counters up to date:
+    posts of pulled authors are not copied. With `since` only posts published after
+    it are copied, which bounds the number of rows for popular authors.
+    """
+    users_sql, params = users.values('pk').query.sql_with_params()
+    quote = connection.ops.quote_name
+    sql = (
+        f'INSERT INTO {quote(TimelineEntry._meta.db_table)} (user_id, post_id, author_id, pub_date) '
+        f'SELECT follow.user_id, post.id, post.author_id, post.pub_date '
+        f'FROM {quote(Follow._meta.db_table)} follow '
+        f'JOIN {quote(Post._meta.db_table)} post ON post.author_id = follow.author_id '
+        f'WHERE follow.user_id IN ({users_sql}) AND follow.author_id NOT IN '
+        f'(SELECT user_id FROM {quote(UserStats._meta.db_table)} WHERE follower_count >= %s)'
+    )
+    params = (*params, pull_threshold())
+    if since is not None:
+        sql += ' AND post.pub_date > %s'
+        params = (*params, since)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def trim(user_id, author_id):
+    """ Remove posts of the author from the timeline of a user who unsubscribed. """
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+# Ordering of feed() for CursorPaginator: it follows the timeline index, not posts_post
+FEED_ORDERING = ('-feed_date', '-feed_id')
+
+
+def feed(user, exclude_authors=()):
+    """ Posts of the user's timeline annotated with the timeline key (feed_date, feed_id). """
+    posts = Post.objects.for_feed().filter(timeline_entries__user=user)
+    if exclude_authors:
+        posts = posts.exclude(author_id__in=exclude_authors)
+    return posts.annotate(feed_date=F('timeline_entries__pub_date'), feed_id=F('timeline_entries__post'))
+
+
+def paginator(user, per_page):
+    """ Paginator of the user's follow feed: the timeline merged with the posts of the pulled authors. """
+    pulled = pulled_authors(user)
+    if not pulled:
+        return CursorPaginator(feed(user), per_page, ordering=FEED_ORDERING)
+    # Copies made before an author became popular are skipped, their posts come from the cached author lists
+    return MergedCursorPaginator([feed(user, exclude_authors=pulled),
+                                  recent.AuthorsPart(pulled, per_page, Post.objects.for_feed())],
+                                 per_page, ordering=FEED_ORDERING)
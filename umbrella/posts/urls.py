@@ -9,10 +9,14 @@ urlpatterns = [
     path("group/<slug:slug>/", views.group_posts, name="group"),
 
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.post_search, name="search"),
+    # Served by posts.live under ASGI; reserved here so it never reaches the profile routes
+    path("live/<path:feed>", views.live_unavailable),
 
     # The author's username will be used as the address of the author's personal page
     path('<str:username>/', views.profile, name='profile'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    path('<str:username>/<int:post_id>/comments/', views.post_comments, name='post_comments'),
     path('<str:username>/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path("<str:username>/<int:post_id>/comment/", views.add_comment, name="add_comment"),
 
@@ -1,77 +1,90 @@
-from django.core.paginator import Paginator
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
 
-from .models import Post, Group, User, Comment, Follow
+from . import counters, detail, live, recent, search, timeline
+from .caching import (cached_feed, conditional, index_scope, group_page_scope, profile_page_scope,
+                      index_scopes, group_page_scopes, profile_page_scopes, follow_page_scopes)
+from .models import Post, Group, User, Follow
 from .forms import PostForm, CommentForm
 
 
-# @cache_page(timeout=20, key_prefix='index_page')
+# Anonymous visitors are served from the cache, which is invalidated by posts.signals;
+# browsers that already have the page get 304 Not Modified while it is unchanged
+@conditional(index_scopes)
+@cached_feed(index_scope)
 def index(request):
-    post_list = Post.objects.order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10)  # show 10 posts per page
-    page_number = request.GET.get('page')  # URL parameter with requested page number
-    page = paginator.get_page(page_number)  # get records with desired offset
+    post_list = Post.objects.for_feed()
+    # show 10 posts per page; the first one is read by id from the in-memory list of the latest posts
+    paginator = recent.FeedPaginator(recent.INDEX, post_list, 10)
+    cursor = request.GET.get('cursor')  # URL parameter with an opaque token of the requested page
+    page = paginator.get_page(cursor)  # get records following the cursor key
     return render(request, 'index.html', {'page': page,
-                                          'paginator': paginator})
+                                          'paginator': paginator,
+                                          'live_url': live.feed_url('index')})
 
 
 # Community page view-function
+@conditional(group_page_scopes)
+@cached_feed(group_page_scope)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)  # get a group instance by its slug, or throw a 404 error
-    posts = group.posts.all().order_by("-pub_date")
-    paginator = Paginator(posts, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = group.posts.for_feed()
+    paginator = recent.FeedPaginator(recent.group_scope(group.pk), posts, 5)
+    page = paginator.get_page(request.GET.get('cursor'))
     return render(request, "group.html", {"group": group,
                                           "page": page,
-                                          "paginator": paginator})
+                                          "paginator": paginator,
+                                          "live_url": live.feed_url('group', group.slug)})
 
 
+@conditional(profile_page_scopes)
+@cached_feed(profile_page_scope)
 def profile(request, username):
-    profile_user = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=profile_user).order_by("-pub_date")  # all posts owned by the user
-    paginator = Paginator(posts, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    # Number of posts - paginator.count in the template.
+    profile_user = get_object_or_404(User.objects.select_related('stats'), username=username)
+    posts = Post.objects.filter(author=profile_user).for_feed()  # all posts owned by the user
+    paginator = recent.FeedPaginator(recent.author_scope(profile_user.pk), posts, 5)
+    page = paginator.get_page(request.GET.get('cursor'))
+    # Number of posts and subscriptions / subscribers are maintained counters
+    stats = counters.get_stats(profile_user)
     # Checking subscription to display on the page
     is_follow = False
     if request.user.is_authenticated:
         is_follow = request.user.follower.filter(author=profile_user).exists()
 
-    # Count the number of subscriptions / subscribers
-    followings_count = profile_user.follower.count()
-    followers_count = profile_user.following.count()
-
     return render(request, 'profile.html', {'profile_user': profile_user,
                                             'page': page,
                                             'paginator': paginator,
+                                            'posts_count': stats.post_count,
                                             'is_follow': is_follow,
-                                            'followers': followers_count,
-                                            'followings': followings_count})
+                                            'followers': stats.follower_count,
+                                            'followings': stats.following_count,
+                                            'live_url': live.feed_url('profile', profile_user.username)})
 
 
 def post_view(request, username, post_id):
-    profile_user = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=profile_user)
-    posts_count = posts.count()
-    post = Post.objects.get(id=post_id)
-    comments = Comment.objects.filter(post=post)  # get a queryset of comments for a post
+    # The post with its author, the author's stats and a page of comments, in two queries
+    post_detail = detail.load(post_id, username, cursor=request.GET.get('cursor'))
+    if post_detail is None:
+        raise Http404
+    stats = post_detail.stats
     form = CommentForm()
 
-    # Count the number of subscriptions / subscribers
-    followings_count = profile_user.follower.count()
-    followers_count = profile_user.following.count()
-
-    return render(request, 'post.html', {'profile_user': profile_user,
-                                         'posts_count': posts_count,
-                                         'post': post,
-                                         'items': comments,
+    return render(request, 'post.html', {'profile_user': post_detail.post.author,
+                                         'posts_count': stats.post_count,
+                                         'post': post_detail.post,
+                                         'items': post_detail.comments,
                                          'form': form,
-                                         'followers': followers_count,
-                                         'followings': followings_count})
+                                         'followers': stats.follower_count,
+                                         'followings': stats.following_count})
+
+
+def post_comments(request, username, post_id):
+    """ A page of comments of the post, the fragment the "load more" link of post.html appends. """
+    post_detail = detail.load(post_id, username, cursor=request.GET.get('cursor'))
+    if post_detail is None:
+        raise Http404
+    return render(request, 'comment_items.html', {'post': post_detail.post, 'items': post_detail.comments})
 
 
 @login_required()
@@ -127,22 +140,43 @@ def add_comment(request, username, post_id):
 
 # View-function of the page where will be displayed the posts of the authors to which the current user is subscribed
 @login_required
+@conditional(follow_page_scopes)
 def follow_index(request):
-    subs = get_object_or_404(User, username=request.user.username).follower.all()
-    posts = Post.objects.filter(author__in=subs.values_list('author')).order_by('-pub_date')
-    paginator = Paginator(posts, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    # The feed is materialized on write (see posts.timeline), except for the posts of popular authors
+    # that are merged in here: a range read of the timeline and one per followed popular author
+    paginator = timeline.paginator(request.user, 5)
+    page = paginator.get_page(request.GET.get('cursor'))
     return render(request, "follow.html", {'page': page,
-                                           'paginator': paginator})
+                                           'paginator': paginator,
+                                           'live_url': live.feed_url('follow')})
+
+
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    size = 10
+    # One post more than the page tells whether there is a next page without counting the matches
+    posts = search.find(query, (page - 1) * size, size + 1, Post.objects.for_feed()) if query else []
+    return render(request, 'search.html', {'query': query,
+                                           'posts': posts[:size],
+                                           'previous_page': page - 1 if page > 1 else None,
+                                           'next_page': page + 1 if len(posts) > size else None})
+
+
+def live_unavailable(request, feed):
+    # Live streams need the ASGI application (umbrella.asgi), the pages work without them
+    raise Http404
 
 
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    if request.user != author and author.following.filter(user=request.user).count() == 0:
+    if request.user != author and not author.following.filter(user=request.user).exists():
         # Here we subscribe the user to another author
-        Follow.objects.create(user=request.user, author=author).save()
+        Follow.objects.create(user=request.user, author=author)
     return redirect('profile', username=username)
 
 
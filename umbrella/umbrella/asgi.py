@@ -8,9 +8,52 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 """
 
 import os
+from itertools import islice
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'umbrella.settings')
+# Read-heavy API endpoints are served by async views (see api.async_views)
+os.environ.setdefault('ASYNC_API_VIEWS', '1')
 
-application = get_asgi_application()
+# Parts of a streaming response read per switch to the sync thread
+STREAMING_BATCH = 100
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    Django 4.1 iterates streaming responses in the event loop, where the
+    queries of a generator body (e.g. the API export) are not allowed; the
+    parts are read in the sync thread instead.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                    for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        parts = iter(response)
+        # Parts are often small (a line of the export), a batch of them is read per thread switch
+        next_parts = sync_to_async(lambda: list(islice(parts, STREAMING_BATCH)), thread_sensitive=True)
+        while batch := await next_parts():
+            for chunk, _ in self.chunk_bytes(b''.join(batch)):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+django.setup(set_prefix=False)
+django_application = StreamingASGIHandler()
+
+from posts import live  # noqa: E402 (needs the apps loaded by django.setup())
+
+
+async def application(scope, receive, send):
+    # Live feed streams are served without the Django request cycle
+    if scope['type'] == 'http' and scope['path'].startswith(live.PREFIX):
+        return await live.application(scope, receive, send)
+    return await django_application(scope, receive, send)
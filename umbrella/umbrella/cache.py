@@ -0,0 +1,131 @@
+"""
+Two-level cache backend: a small in-process cache (L1) in front of a shared one (L2).
+
+Every gunicorn worker keeps its own L1, so hot entries are served without a
+network round trip, while all workers share L2 (Redis in production). Writes go
+to both levels; an entry changed by another worker is seen by this one at the
+latest after LOCAL_TIMEOUT seconds. Keys starting with one of the
+SHARED_ONLY_PREFIXES bypass L1 entirely: they are mutable pointers (e.g. the
+feed version tokens of posts.caching) that must be consistent across workers,
+while the entries they point to never change and are safe to keep in L1.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'umbrella.cache.TieredCache',
+            'OPTIONS': {'LOCAL': 'local', 'SHARED': 'shared', 'LOCAL_TIMEOUT': 5},
+        },
+        'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://...'},
+    }
+
+Key prefixes and versions are applied by the LOCAL and SHARED caches themselves.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.functional import cached_property
+
+from .metrics import record_cache
+
+# Marks a missing value, because None can be cached as well
+MISSING = object()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.local_alias = options.get('LOCAL', 'local')
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.shared_only_prefixes = tuple(options.get('SHARED_ONLY_PREFIXES', ()))
+
+    @cached_property
+    def local(self):
+        return caches[self.local_alias]
+
+    @cached_property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _is_local(self, key):
+        return not key.startswith(self.shared_only_prefixes)
+
+    def _local_timeout(self, timeout):
+        # L1 entries are never kept longer than LOCAL_TIMEOUT, nor longer than the L2 entry
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and self._is_local(key):
+            self.local.set(key, value, self._local_timeout(timeout), version=version)
+        return added
+
+    def get(self, key, default=None, version=None):
+        if self._is_local(key):
+            value = self.local.get(key, MISSING, version=version)
+            if value is not MISSING:
+                record_cache(1, 0)
+                return value
+        value = self.shared.get(key, MISSING, version=version)
+        if value is MISSING:
+            record_cache(0, 1)
+            return default
+        record_cache(1, 0)
+        if self._is_local(key):
+            self.local.set(key, value, self.local_timeout, version=version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self._is_local(key):
+            self.local.set(key, value, self._local_timeout(timeout), version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._is_local(key):
+            self.local.touch(key, self._local_timeout(timeout), version=version)
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.delete(key, version=version)
+
+    def get_many(self, keys, version=None):
+        found = self.local.get_many([key for key in keys if self._is_local(key)], version=version)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            shared = self.shared.get_many(missing, version=version)
+            self.local.set_many({key: value for key, value in shared.items() if self._is_local(key)},
+                                self.local_timeout, version=version)
+            found.update(shared)
+        record_cache(len(found), len(keys) - len(found))
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        self.local.set_many({key: value for key, value in data.items() if self._is_local(key)},
+                            self._local_timeout(timeout), version=version)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.local.delete_many(keys, version=version)
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        return (self._is_local(key) and self.local.has_key(key, version=version)) or \
+            self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        # Counters live in L2 only, otherwise workers would increment their own copies
+        self.local.delete(key, version=version)
+        return self.shared.incr(key, delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.local.close(**kwargs)
+        self.shared.close(**kwargs)
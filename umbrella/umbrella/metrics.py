@@ -0,0 +1,248 @@
+"""
+Opt-in per-request instrumentation: SQL queries, database time, template
+rendering time and cache hits and misses of every request.
+
+Enabled with REQUEST_METRICS=1 in the environment (settings.REQUEST_METRICS).
+The numbers of a request are
+
+* sent back in a Server-Timing header, shown by the Network tab of the browser
+  developer tools next to the request;
+* logged as one JSON line by the "umbrella.metrics" logger;
+* aggregated per URL name for the staff page /admin/metrics/. Every process
+  keeps its own totals and publishes them to the cache, so the page shows all
+  workers.
+
+Queries of a streaming response that run while its body is sent are not counted.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.shortcuts import render
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+# Totals of a process are published to the cache at most this often, seconds
+PUBLISH_INTERVAL = 10
+# Published totals of a process that stopped are dropped after this time, seconds
+PUBLISH_TIMEOUT = 60 * 60
+
+PROCESSES_KEY = 'metrics:processes'
+
+_current = ContextVar('request_metrics', default=None)
+_installed = False
+
+
+class RequestMetrics:
+    """ Counters of the request being processed. """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0
+        self.template_time = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rendering = False
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+
+def record_cache(hits, misses):
+    """ Count cache lookups of the current request; called by umbrella.cache.TieredCache. """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def _add_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _timed_render(render_template):
+    def render(self, *args, **kwargs):
+        metrics = _current.get()
+        # A template rendered inside another one is already timed by the outer one
+        if metrics is None or metrics.rendering:
+            return render_template(self, *args, **kwargs)
+        metrics.rendering = True
+        started = time.perf_counter()
+        try:
+            return render_template(self, *args, **kwargs)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+            metrics.rendering = False
+    return render
+
+
+def install():
+    """ Hook the recorders into the database connections and the template engine, once per process. """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(_add_query_recorder)
+    for connection in connections.all():
+        _add_query_recorder(connection)
+    django_backend.Template.render = _timed_render(django_backend.Template.render)
+
+
+class RouteStats:
+    """ Totals of the requests of one process per URL name. """
+    FIELDS = ('requests', 'time', 'max_time', 'queries', 'db_time', 'template_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.process = f'{socket.gethostname()}:{os.getpid()}'
+        self.published = 0
+
+    def add(self, name, metrics, total_time):
+        with self.lock:
+            totals = self.routes.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+            totals['requests'] += 1
+            totals['time'] += total_time
+            totals['max_time'] = max(totals['max_time'], total_time)
+            totals['queries'] += metrics.queries
+            totals['db_time'] += metrics.db_time
+            totals['template_time'] += metrics.template_time
+            totals['cache_hits'] += metrics.cache_hits
+            totals['cache_misses'] += metrics.cache_misses
+
+    def publish(self, force=False):
+        """ Store the totals of this process in the cache, where the stats page of any worker reads them. """
+        now = time.monotonic()
+        if not force and now - self.published < PUBLISH_INTERVAL:
+            return
+        self.published = now
+        with self.lock:
+            snapshot = {name: dict(totals) for name, totals in self.routes.items()}
+        cache.set(f'metrics:process:{self.process}', snapshot, PUBLISH_TIMEOUT)
+        processes = cache.get(PROCESSES_KEY) or set()
+        if self.process not in processes:
+            cache.set(PROCESSES_KEY, processes | {self.process}, PUBLISH_TIMEOUT)
+
+    @staticmethod
+    def collect():
+        """ Totals per URL name summed over every process that has published them. """
+        processes = cache.get(PROCESSES_KEY) or set()
+        snapshots = cache.get_many([f'metrics:process:{process}' for process in processes])
+        routes = {}
+        for snapshot in snapshots.values():
+            for name, totals in snapshot.items():
+                summed = routes.setdefault(name, dict.fromkeys(RouteStats.FIELDS, 0))
+                for field, value in totals.items():
+                    summed[field] = max(summed[field], value) if field == 'max_time' else summed[field] + value
+        return routes, len(snapshots)
+
+
+STATS = RouteStats()
+
+
+def _route_name(request):
+    match = request.resolver_match
+    if match is None:
+        return '<unresolved>'
+    return match.view_name if match.url_name else match.route
+
+
+def server_timing(metrics, total_time):
+    return ', '.join((
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+        f'tpl;dur={metrics.template_time * 1000:.1f};desc="templates"',
+        f'cache;desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+        f'total;dur={total_time * 1000:.1f}',
+    ))
+
+
+class RequestMetricsMiddleware:
+    """ Measure every request; goes first in MIDDLEWARE so the other middleware is measured too. """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_time = metrics.total_time
+
+        response['Server-Timing'] = server_timing(metrics, total_time)
+        name = _route_name(request)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'route': name,
+            'status': response.status_code,
+            'ms': round(total_time * 1000, 1),
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'template_ms': round(metrics.template_time * 1000, 1),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+        }))
+        STATS.add(name, metrics, total_time)
+        STATS.publish()
+        return response
+
+
+@staff_member_required
+def stats_view(request):
+    """ Admin page with the average cost of the requests per URL name, slowest in total first. """
+    STATS.publish(force=True)
+    routes, processes = RouteStats.collect()
+    rows = []
+    for name, totals in routes.items():
+        count = totals['requests'] or 1
+        lookups = totals['cache_hits'] + totals['cache_misses']
+        rows.append({
+            'name': name,
+            'requests': totals['requests'],
+            'total_s': round(totals['time'], 2),
+            'avg_ms': round(totals['time'] / count * 1000, 1),
+            'max_ms': round(totals['max_time'] * 1000, 1),
+            'queries': round(totals['queries'] / count, 1),
+            'db_ms': round(totals['db_time'] / count * 1000, 1),
+            'template_ms': round(totals['template_time'] / count * 1000, 1),
+            'cache_hit_rate': f'{totals["cache_hits"] / lookups:.0%}' if lookups else '—',
+        })
+    rows.sort(key=lambda row: row['total_s'], reverse=True)
+    return render(request, 'admin/metrics.html', {
+        'title': 'Request metrics',
+        'rows': rows,
+        'processes': processes,
+        'enabled': getattr(settings, 'REQUEST_METRICS', False),
+    })
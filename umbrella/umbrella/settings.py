@@ -62,6 +62,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Query count, DB/template time and cache hits of every request; off unless REQUEST_METRICS=1
+    'umbrella.metrics.RequestMetricsMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -177,11 +179,83 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 # ID of the current site
 SITE_ID = 1
 
-# Connecting the caching backend
+# Connecting the caching backend.
+# All workers share the L2 cache (Redis when CACHE_URL is set, e.g. redis://127.0.0.1:6379/0),
+# each worker keeps hot entries in its own L1 for CACHE_LOCAL_TIMEOUT seconds (see umbrella.cache)
+CACHE_URL = os.getenv('CACHE_URL')
+
 CACHES = {
     'default': {
+        'BACKEND': 'umbrella.cache.TieredCache',
+        'OPTIONS': {
+            'LOCAL': 'local',
+            'SHARED': 'shared',
+            'LOCAL_TIMEOUT': int(os.getenv('CACHE_LOCAL_TIMEOUT', 5)),
+            # Feed version tokens must be the same in every worker
+            'SHARED_ONLY_PREFIXES': ['posts:version:'],
+        },
+    },
+    'local': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'LOCATION': 'umbrella-local',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 1000))},
+    },
+    'shared': {
+        'BACKEND': ('django.core.cache.backends.redis.RedisCache' if CACHE_URL
+                    else 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': CACHE_URL or 'umbrella-shared',
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'umbrella'),
+        # Bump to drop everything cached by the previous release (e.g. after a template change)
+        'VERSION': int(os.getenv('CACHE_VERSION', 1)),
+    },
+}
+
+# Sessions are read from the shared cache directly, so a logout is seen by every worker at once
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'shared'
+
+# Lifetime of cached feed pages for anonymous visitors, seconds.
+# Pages are invalidated on every related write (see posts.caching), the timeout only bounds memory usage
+POSTS_CACHE_TIMEOUT = 60 * 5
+
+# Post image renditions, generated in the background after a post is saved (see posts.thumbnails):
+# name -> (geometry, sorl-thumbnail options)
+POSTS_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+
+# Background tasks (posts.tasks) are run by `manage.py run_tasks`; with TASKS_EAGER=1 they run in
+# the request that queues them once its transaction commits, e.g. in development without a worker
+TASKS_EAGER = os.getenv('TASKS_EAGER') == '1'
+
+# Authors with this many followers are not copied into follow timelines, their posts are merged
+# into the follow pages at read time (posts.timeline)
+POSTS_TIMELINE_PULL_THRESHOLD = int(os.getenv('POSTS_TIMELINE_PULL_THRESHOLD', 10000))
+
+# Multiplier of the time budgets of BudgetTest in posts/tests.py, for slow CI machines
+POSTS_BUDGET_TIME_FACTOR = float(os.getenv('POSTS_BUDGET_TIME_FACTOR', 1))
+
+# Serve GET requests of the read-heavy API endpoints with async views (see api.async_views);
+# on by default under ASGI (umbrella.asgi), where they do not hold a worker thread while waiting
+ASYNC_API_VIEWS = os.getenv('ASYNC_API_VIEWS') == '1'
+
+# Redis URL through which every ASGI process receives the live feed updates (see posts.live);
+# without it updates reach only the streams of the process that saved the post
+LIVE_BROKER_URL = os.getenv('LIVE_BROKER_URL')
+
+# Per-request instrumentation (umbrella.metrics): Server-Timing headers, a JSON log line per request
+# and the staff page /admin/metrics/
+REQUEST_METRICS = os.getenv('REQUEST_METRICS') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'umbrella.metrics': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
 }
 
 # CORS - permission to process requests from another domain
@@ -21,6 +21,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
 
+from . import metrics
+
 urlpatterns = [
     # Registration and authorization
     path("auth/", include("users.urls")),
@@ -30,6 +32,7 @@ urlpatterns = [
     path("auth/", include("django.contrib.auth.urls")),
 
     # Admin section
+    path("admin/metrics/", metrics.stats_view, name="admin_metrics"),
     path("admin/", admin.site.urls),
 
     # Flatpages